@@ -0,0 +1,441 @@
+import asyncio, collections
+
+from SynScanProtocol import (UsageError, UnsupportedCommandError, ProtocolError, ResponseTimeoutError, PassthroughError, Command, CoordinateMode, MINIMUM_VERSIONS, Requests)
+
+# Commands that set the mount in motion. If one of these is cancelled after it has been
+# written to the wire, a CANCEL_GOTO is sent to stop the mount.
+_GOTO_COMMANDS = frozenset([
+        Command.GOTO_POSITION_RA_DEC,
+        Command.GOTO_POSITION_RA_DEC_PRECISE,
+        Command.GOTO_POSITION_AZM_ALT,
+        Command.GOTO_POSITION_AZM_ALT_PRECISE
+    ])
+
+
+class _InFlight:
+
+    __slots__ = ("transaction", "future", "extra_hash", "issued")
+
+    def __init__(self, transaction, future):
+        self.transaction = transaction
+        self.future = future
+        self.extra_hash = False # passthrough failed, one more hash character has to be read away
+        self.issued = None      # loop time the request was written
+
+
+class AsyncSynScanController:
+
+    # asyncio variant of SynScanController. The port is opened in non-blocking mode and
+    # serviced from the event loop; every command is written immediately and its response is
+    # matched in order against the queue of in-flight commands, so several coroutines can have
+    # commands outstanding at the same time without a thread per mount.
+    #
+    # It shares the request encoding and response decoding (Requests), the transports
+    # (SynScanTransport), capabilities, recorders and metrics with SynScanController, but not the
+    # blocking read path, the adaptive deadlines or the response cache.
+
+    def __init__(self, timeout = 3.500):
+        self._device = None
+        self._loop = None
+        self._fd = None
+        self._pollHandle = None
+        self._timeout = timeout
+        self._inFlight = collections.deque()
+        self._buffer = bytearray()
+        self._quietHandle = None  # set while resynchronising: ends the wait for a quiet line
+        self._quietLimit = None   # loop time at which the line is taken as quiet regardless
+        self._quietTime = None    # how long the line has to stay silent
+        self._held = collections.deque() # submitted while resynchronising, written once it is done
+        self._recorder = None
+        self._metrics = None
+        self._capabilities = None
+        self.resyncCount = 0
+        self.discardedByteCount = 0
+
+    async def connect(self, port, timeout = None, baudrate = 9600):
+
+        # Same 'port' forms as SynScanController.connect(): a serial port name, a transport address
+        # or an already opened file-like device.
+
+        if self._device is not None:
+            raise UsageError("connect() failed: already connected")
+
+        if timeout is not None:
+            self._timeout = timeout
+
+        if isinstance(port, str):
+            from SynScanTransport import openTransport
+            # Read timeout 0: non-blocking, the event loop tells us when data is available.
+            device = openTransport(port, 0, baudrate)
+        elif hasattr(port, "read") and hasattr(port, "write"):
+            device = port
+        else:
+            raise UsageError("connect() failed: incorrect value for parameter 'port': {}".format(repr(port)))
+
+        self._device = device
+        self._loop = asyncio.get_running_loop()
+
+        try:
+            fd = device.fileno()
+            self._loop.add_reader(fd, self._on_readable)
+            self._fd = fd
+        except (AttributeError, OSError, ValueError, NotImplementedError):
+            # No selectable file descriptor (Windows, file-like test devices): poll instead.
+            self._pollHandle = self._loop.call_soon(self._poll)
+
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def capabilities(self):
+        return self._capabilities
+
+    @capabilities.setter
+    def capabilities(self, capabilities):
+        self._capabilities = capabilities
+
+    @property
+    def recorder(self):
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, recorder):
+        self._recorder = recorder
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self._metrics = metrics
+
+    async def close(self):
+
+        if self._device is None:
+            return
+
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+
+        if self._pollHandle is not None:
+            self._pollHandle.cancel()
+            self._pollHandle = None
+
+        if self._quietHandle is not None:
+            self._quietHandle.cancel()
+            self._quietHandle = None
+
+        self._abort(ProtocolError("connection closed"))
+        while self._held:
+            self._complete(self._held.popleft(), exception = ProtocolError("connection closed"))
+
+        device = self._device
+        self._device = None
+        device.close()
+
+    # Receive path, runs in the event loop.
+
+    def _read_device(self, size):
+        data = self._device.read(size)
+        if self._recorder is not None:
+            self._recorder.received(data)
+        if self._metrics is not None:
+            self._metrics.received(len(data))
+        return data
+
+    def _on_readable(self):
+        data = self._read_device(max(1, self._device.in_waiting))
+        if data:
+            self._received(data)
+
+    def _poll(self):
+        waiting = getattr(self._device, "in_waiting", 1)
+        if waiting:
+            data = self._read_device(waiting)
+            if data:
+                self._received(data)
+        self._pollHandle = self._loop.call_later(0.002, self._poll)
+
+    def _received(self, data):
+        if self._quietHandle is not None:
+            # Resynchronising: whatever arrives now belongs to an aborted command.
+            self.discardedByteCount += len(data)
+            self._waitForQuiet(self._quietTime)
+            return
+        self._buffer += data
+        self._dispatch()
+
+    def _dispatch(self):
+
+        buffer = self._buffer
+
+        while self._inFlight:
+
+            entry = self._inFlight[0]
+            transaction = entry.transaction
+
+            if entry.extra_hash:
+                if len(buffer) < 1:
+                    return
+                extra_hash = bytes(buffer[:1]) ; del buffer[:1]
+                self._inFlight.popleft()
+                if self._metrics is not None:
+                    self._metrics.passthroughFailure(transaction.axisId)
+                if extra_hash != b"#":
+                    self._complete(entry, exception = ProtocolError("extra hash not found"))
+                else:
+                    self._complete(entry, exception = PassthroughError("No valid response from device {}".format(transaction.axisId.name)))
+                continue
+
+            length = transaction.expected_response_length
+            if len(buffer) < length:
+                return
+
+            response = bytes(buffer[:length]) ; del buffer[:length]
+
+            if transaction.check_and_remove_trailing_hash:
+                if not response.endswith(b'#'):
+                    if transaction.axisId is not None:
+                        entry.extra_hash = True
+                        continue
+                    self._inFlight.popleft()
+                    self._failed(entry, ProtocolError("read_binary() failed: response does not end with hash character (ASCII 35)"))
+                    continue
+                # remove the trailing hash character.
+                response = response[:-1]
+
+            self._inFlight.popleft()
+
+            if self._metrics is not None:
+                self._metrics.observe(transaction.command, self._loop.time() - entry.issued)
+
+            try:
+                result = transaction.decode(response)
+            except ProtocolError as exception:
+                self._failed(entry, exception)
+            else:
+                self._complete(entry, result = result)
+
+        # Bytes nobody asked for, e.g. a late response to a command whose entry was aborted.
+        buffer.clear()
+
+    @staticmethod
+    def _complete(entry, result = None, exception = None):
+        # The future may already be done if the caller cancelled it or gave up waiting.
+        if entry.future.done():
+            return
+        if exception is not None:
+            entry.future.set_exception(exception)
+        else:
+            entry.future.set_result(result)
+
+    def _failed(self, entry, exception):
+        if self._metrics is not None:
+            self._metrics.protocolError(entry.transaction.command, exception)
+        self._complete(entry, exception = exception)
+
+    def _abort(self, exception):
+        while self._inFlight:
+            self._complete(self._inFlight.popleft(), exception = exception)
+        self._buffer.clear()
+
+    def _timedOut(self, transaction, timeout):
+        if self._metrics is not None:
+            self._metrics.protocolError(transaction.command, ResponseTimeoutError("no response within {} s".format(timeout), b""))
+
+    def _resynchronise(self, quiet):
+
+        # A response went missing. Everything queued behind it would be matched against the wrong
+        # bytes, so fail all outstanding commands. The missing response may only be late, so drop
+        # whatever arrives until the line has been quiet for 'quiet' seconds (at most the timeout
+        # in total), then empty the input buffer. Commands submitted meanwhile are held back and
+        # written afterwards.
+
+        self._abort(ProtocolError("response stream resynchronised after timeout"))
+        self.resyncCount += 1
+
+        if self._quietHandle is None:
+            self._quietLimit = self._loop.time() + self._timeout
+        self._quietTime = quiet
+        self._waitForQuiet(quiet)
+
+    def _waitForQuiet(self, quiet):
+        if self._quietHandle is not None:
+            self._quietHandle.cancel()
+        self._quietHandle = self._loop.call_at(min(self._loop.time() + quiet, self._quietLimit), self._quiet)
+
+    def _quiet(self):
+        self._quietHandle = None
+        self._buffer.clear()
+        if hasattr(self._device, "reset_input_buffer"):
+            self._device.reset_input_buffer()
+        while self._held:
+            entry = self._held.popleft()
+            if not entry.future.done():
+                self._write(entry)
+
+    # Send path
+
+    def _write(self, entry):
+        request = entry.transaction.request
+        if self._recorder is not None:
+            self._recorder.sent(request)
+        if self._metrics is not None:
+            self._metrics.sent(len(request))
+        self._inFlight.append(entry)
+        entry.issued = self._loop.time()
+        self._device.write(request)
+
+    def submit(self, transaction):
+
+        # Write the transaction and return a future for its result. The future may be awaited,
+        # cancelled or combined with other futures; its bytes keep their place in the stream.
+        # Commands the capabilities rule out fail at once, without being written.
+
+        if self._device is None:
+            raise UsageError("submit() failed: not connected")
+
+        future = self._loop.create_future()
+
+        if self._capabilities is not None and transaction.command in self._capabilities.unsupported:
+            future.set_exception(UnsupportedCommandError("{} requires firmware version {}.{} or later, the hand controller has {}.{}".format(
+                    transaction.command.name, *(MINIMUM_VERSIONS[transaction.command] + self._capabilities.version))))
+            return future
+
+        entry = _InFlight(transaction, future)
+        if self._quietHandle is not None:
+            self._held.append(entry)
+        else:
+            self._write(entry)
+        return future
+
+    async def _wait(self, transaction, future, timeout):
+
+        if timeout is None:
+            timeout = self._timeout
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._timedOut(transaction, timeout)
+                self._resynchronise(timeout)
+            raise
+        except asyncio.CancelledError:
+            future.cancel()
+            if transaction.command in _GOTO_COMMANDS:
+                self.submit(Requests.cancelGoto())
+            raise
+
+    async def _transact(self, transaction, timeout = None):
+        return await self._wait(transaction, self.submit(transaction), timeout)
+
+    async def execute(self, *transactions, timeout = None):
+
+        # Pipelined execution of several transactions. The timeout applies to the whole burst.
+
+        futures = [self.submit(transaction) for transaction in transactions]
+
+        if timeout is None:
+            timeout = self._timeout
+
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures), timeout)
+        except asyncio.TimeoutError:
+            for (transaction, future) in zip(transactions, futures):
+                if not future.done():
+                    self._timedOut(transaction, timeout)
+            self._resynchronise(timeout)
+            raise
+        except asyncio.CancelledError:
+            for (transaction, future) in zip(transactions, futures):
+                future.cancel()
+                if transaction.command in _GOTO_COMMANDS:
+                    self.submit(Requests.cancelGoto())
+            raise
+
+    # Public API starts here
+
+    async def getPosition(self, coordinateMode = CoordinateMode.RA_DEC, highPrecisionFlag = False, timeout = None):
+        return await self._transact(Requests.getPosition(coordinateMode, highPrecisionFlag), timeout)
+
+    async def gotoPosition(self, firstCoordinate, secondCoordinate, coordinateMode = CoordinateMode.AZM_ALT, highPrecisionFlag = True, timeout = None, waitForCompletion = False, pollInterval = 0.5):
+
+        transaction = Requests.gotoPosition(firstCoordinate, secondCoordinate, coordinateMode, highPrecisionFlag)
+        await self._transact(transaction, timeout)
+
+        if waitForCompletion:
+            await self.waitForGoto(pollInterval, timeout)
+
+    async def waitForGoto(self, pollInterval = 0.5, timeout = None):
+
+        # Poll until the current goto has finished. Cancelling the waiting task stops the mount.
+
+        try:
+            while await self.getGotoInProgress(timeout = timeout):
+                await asyncio.sleep(pollInterval)
+        except asyncio.CancelledError:
+            self.submit(Requests.cancelGoto())
+            raise
+
+    async def sync(self, firstCoordinate, secondCoordinate, highPrecisionFlag = True, timeout = None):
+        return await self._transact(Requests.sync(firstCoordinate, secondCoordinate, highPrecisionFlag), timeout)
+
+    async def getTrackingMode(self, timeout = None):
+        return await self._transact(Requests.getTrackingMode(), timeout)
+
+    async def setTrackingMode(self, tracking_mode, timeout = None):
+        return await self._transact(Requests.setTrackingMode(tracking_mode), timeout)
+
+    async def getLocation(self, timeout = None):
+        return await self._transact(Requests.getLocation(), timeout)
+
+    async def setLocation(self, latitude, longitude, timeout = None):
+        return await self._transact(Requests.setLocation(latitude, longitude), timeout)
+
+    async def getTime(self, timeout = None):
+        return await self._transact(Requests.getTime(), timeout)
+
+    async def setTime(self, timestamp, dst, timeout = None):
+        return await self._transact(Requests.setTime(timestamp, dst), timeout)
+
+    async def getVersion(self, timeout = None):
+        return await self._transact(Requests.getVersion(), timeout)
+
+    async def getModel(self, timeout = None):
+        return await self._transact(Requests.getModel(), timeout)
+
+    async def echo(self, c, timeout = None):
+        return await self._transact(Requests.echo(c), timeout)
+
+    async def getAlignmentComplete(self, timeout = None):
+        return await self._transact(Requests.getAlignmentComplete(), timeout)
+
+    async def getGotoInProgress(self, timeout = None):
+        return await self._transact(Requests.getGotoInProgress(), timeout)
+
+    async def cancelGoto(self, timeout = None):
+        return await self._transact(Requests.cancelGoto(), timeout)
+
+    async def passthrough(self, axisId, command, expected_response_bytes, timeout = None):
+        return await self._transact(Requests.passthrough(axisId, command, expected_response_bytes), timeout)
+
+    async def slew_fixed(self, axisId, rate, timeout = None):
+        return await self._transact(Requests.slew_fixed(axisId, rate), timeout)
+
+    async def slew_variable(self, axisId, rate, timeout = None):
+        return await self._transact(Requests.slew_variable(axisId, rate), timeout)
+
+    async def getDeviceVersion(self, axisId, timeout = None):
+
+        (versionMajor, versionMinor) = await self._transact(Requests.getDeviceVersion(axisId), timeout)
+
+        return (versionMajor, versionMinor)
@@ -0,0 +1,246 @@
+import collections, concurrent.futures, threading
+from enum import Enum
+
+from SynScanProtocol import (UsageError, ProtocolError, Command, PassthroughCommand, Requests, READ_ONLY_COMMANDS)
+
+class QueueFullError(Exception):
+    pass
+
+class Priority(Enum):
+    STOP      = 0 # stop slews and cancelGoto, always accepted
+    SLEW      = 1
+    COMMAND   = 2
+    TELEMETRY = 3
+
+_SLEW_COMMANDS = frozenset([
+        PassthroughCommand.MOTOR_SLEW_POSITIVE_VARIABLE_RATE.value,
+        PassthroughCommand.MOTOR_SLEW_NEGATIVE_VARIABLE_RATE.value,
+        PassthroughCommand.MOTOR_SLEW_POSITIVE_FIXED_RATE.value,
+        PassthroughCommand.MOTOR_SLEW_NEGATIVE_FIXED_RATE.value
+    ])
+
+
+def isStopTransaction(transaction):
+    # cancelGoto, or a slew passthrough whose rate bytes are all zero.
+    if transaction.command == Command.CANCEL_GOTO:
+        return True
+    request = transaction.request
+    return transaction.command == Command.PASSTHROUGH and request[3] in _SLEW_COMMANDS and not any(request[4:4 + request[1] - 1])
+
+
+class _Job:
+
+    __slots__ = ("transactions", "future", "key")
+
+    def __init__(self, transactions, key):
+        self.transactions = transactions
+        self.future = concurrent.futures.Future()
+        self.key = key
+
+
+class CommandArbiter:
+
+    # Serialises all access to one controller. Clients submit transactions with a priority; a single
+    # worker thread owns the port and always serves the most urgent queue first, sending whatever
+    # is ready back-to-back as one pipelined burst. Stop commands are promoted to Priority.STOP
+    # automatically. Identical read-only requests that are waiting or on the wire at the same time
+    # share one wire transaction and one future.
+
+    def __init__(self, controller, maxQueueLength = 16, maxBatchLength = 8):
+        self._controller = controller
+        self._maxQueueLength = maxQueueLength
+        self._maxBatchLength = maxBatchLength
+        self._queues = {priority: collections.deque() for priority in Priority}
+        self._shared = {} # request bytes -> job, for read-only jobs not yet completed
+        self._invalidations = [] # field tuples for controller.invalidate(), applied before the next burst
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    @property
+    def controller(self):
+        return self._controller
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target = self._run, name = "CommandArbiter", daemon = True)
+            self._thread.start()
+
+    def stop(self):
+
+        with self._condition:
+            if self._thread is None:
+                return
+            self._running = False
+            self._condition.notify_all()
+            thread = self._thread
+            self._thread = None
+
+        thread.join()
+
+        # Fail whatever did not make it to the wire.
+        with self._condition:
+            for queue in self._queues.values():
+                while queue:
+                    queue.popleft().future.set_exception(ProtocolError("arbiter stopped"))
+            self._shared.clear()
+
+    def submit(self, transactions, priority = Priority.COMMAND):
+
+        # Queue a list of transactions to be executed together and return a concurrent.futures.Future
+        # for the list of their results.
+
+        transactions = list(transactions)
+        if not transactions:
+            raise UsageError("submit() failed: no transactions")
+
+        if all(isStopTransaction(transaction) for transaction in transactions):
+            priority = Priority.STOP
+
+        key = None
+        if len(transactions) == 1 and transactions[0].command in READ_ONLY_COMMANDS:
+            key = transactions[0].request
+
+        with self._condition:
+
+            if not self._running:
+                raise UsageError("submit() failed: arbiter is not running")
+
+            if key is not None:
+                shared = self._shared.get(key)
+                if shared is not None:
+                    return shared.future
+
+            queue = self._queues[priority]
+            if priority != Priority.STOP and len(queue) >= self._maxQueueLength:
+                raise QueueFullError("{} queue is full ({} jobs)".format(priority.name, len(queue)))
+
+            job = _Job(transactions, key)
+            queue.append(job)
+            if key is not None:
+                self._shared[key] = job
+
+            self._condition.notify()
+
+        return job.future
+
+    def execute(self, *transactions, priority = Priority.COMMAND, timeout = None):
+        return self.submit(transactions, priority).result(timeout)
+
+    def client(self, priority = Priority.COMMAND):
+        return ArbiterClient(self, priority)
+
+    def invalidate(self, *fields):
+
+        # Drop cached responses of the controller (see SynScanController.invalidate()). The cache
+        # belongs to the worker thread while it is running, so the worker does this itself, before
+        # it sends the next burst: anything submitted after this call sees the fresh values.
+
+        with self._condition:
+            if self._running:
+                self._invalidations.append(fields)
+                return
+
+        self._invalidate([fields])
+
+    def _invalidate(self, invalidations):
+        invalidate = getattr(self._controller, "invalidate", None)
+        if invalidate is not None:
+            for fields in invalidations:
+                invalidate(*fields)
+
+    def _next_batch(self):
+
+        # Collect ready jobs, most urgent first, up to maxBatchLength transactions (at least one job).
+
+        batch = []
+        length = 0
+
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and (not batch or length + len(queue[0].transactions) <= self._maxBatchLength):
+                job = queue.popleft()
+                batch.append(job)
+                length += len(job.transactions)
+
+        return batch
+
+    def _run(self):
+
+        while True:
+
+            with self._condition:
+                while self._running and not any(self._queues.values()):
+                    self._condition.wait()
+                if not self._running:
+                    return
+                batch = self._next_batch()
+                invalidations = self._invalidations
+                self._invalidations = []
+
+            if invalidations:
+                self._invalidate(invalidations)
+
+            transactions = [transaction for job in batch for transaction in job.transactions]
+
+            try:
+                outcomes = self._controller._exchange(transactions)
+            except Exception as exception:
+                # Port failure: every job of this burst fails the same way.
+                outcomes = [(None, exception)] * len(transactions)
+
+            with self._condition:
+                for job in batch:
+                    if job.key is not None and self._shared.get(job.key) is job:
+                        del self._shared[job.key]
+
+            offset = 0
+            for job in batch:
+                jobOutcomes = outcomes[offset:offset + len(job.transactions)]
+                offset += len(job.transactions)
+                exceptions = [exception for (result, exception) in jobOutcomes if exception is not None]
+                if exceptions:
+                    job.future.set_exception(exceptions[0])
+                else:
+                    job.future.set_result([result for (result, exception) in jobOutcomes])
+
+
+class ArbiterClient:
+
+    # Controller-like view of a CommandArbiter with a fixed priority: offers execute() and every
+    # public command of SynScanController, each blocking until its result is available.
+
+    def __init__(self, arbiter, priority = Priority.COMMAND):
+        self._arbiter = arbiter
+        self._priority = priority
+
+    @property
+    def priority(self):
+        return self._priority
+
+    def execute(self, *transactions):
+        return self._arbiter.execute(*transactions, priority = self._priority)
+
+    def submit(self, *transactions):
+        return self._arbiter.submit(transactions, self._priority)
+
+    def __getattr__(self, name):
+
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        build = getattr(Requests, name)
+
+        def command(*args, **kwargs):
+            return self.execute(build(*args, **kwargs))[0]
+
+        return command
+
+    def getDeviceVersion(self, axisId):
+
+        (versionMajor, versionMinor) = self.execute(Requests.getDeviceVersion(axisId))[0]
+
+        return (versionMajor, versionMinor)
@@ -0,0 +1,323 @@
+import collections, math, socket, threading, time
+
+from SynScanProtocol import UsageError, AxisId, Requests
+
+_AXES = (AxisId.AZM_RA_MOTOR, AxisId.ALT_DEC_MOTOR)
+
+# Resolution of the variable slew rate: 1/4 arcsecond / second, in degrees / second.
+RATE_QUANTUM = 1.0 / (3600.0 * 4)
+
+# A pointing error measurement, in arcseconds per axis (measured minus wanted position). 'timestamp'
+# is host time.monotonic() of the measurement.
+Measurement = collections.namedtuple("Measurement", ["timestamp", "first", "second"])
+
+
+def parseMeasurement(line):
+
+    # "<first> <second>" or "<timestamp> <first> <second>", separated by white space or commas;
+    # without a timestamp the measurement is taken to be from now. Returns None for empty lines
+    # and comments.
+
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+
+    values = [float(value) for value in line.replace(",", " ").split()]
+    if len(values) == 2:
+        return Measurement(time.monotonic(), values[0], values[1])
+    if len(values) == 3:
+        return Measurement(values[0], values[1], values[2])
+
+    raise UsageError("parseMeasurement() failed: expected 2 or 3 values, got {}".format(repr(line)))
+
+
+class PIController:
+
+    # Proportional-integral controller for one axis: error in arcseconds in, rate correction in
+    # arcseconds / second out. The integral is clamped so that it cannot wind up while the output
+    # saturates.
+
+    def __init__(self, proportionalGain = 0.7, integralGain = 0.05, integralLimit = 20.0):
+        self.proportionalGain = proportionalGain
+        self.integralGain = integralGain
+        self.integralLimit = integralLimit
+        self._integral = 0.0
+
+    def reset(self):
+        self._integral = 0.0
+
+    def update(self, error, dt):
+        self._integral = max(-self.integralLimit, min(self.integralLimit, self._integral + error * dt))
+        return -(self.proportionalGain * error + self.integralGain * self._integral)
+
+
+class Guider:
+
+    # Closed-loop guiding with variable-rate slews. Measurements are pushed in with submit() (by
+    # any of the sources below, or by the caller); a loop thread ticks at 'rate' Hz, runs a
+    # PIController per axis on the newest measurement and sets the motor rate to 'baseRates' plus
+    # the correction. A variable-rate slew replaces the tracking rate of that axis, so 'baseRates'
+    # has no default: for an equatorial mount it would be (SIDEREAL_RATE, 0.0) or
+    # (-SIDEREAL_RATE, 0.0), and (0.0, 0.0) would stop the tracking on the first correction.
+    #
+    # Rates are quantised to RATE_QUANTUM; an axis whose quantised rate did not change is not sent,
+    # and changed axes go out in one pipelined burst. Measurements older than 'maxAge' are ignored.
+    # Errors never end the loop: they are counted, the failed axes are sent again, and the loop
+    # slows down while they persist.
+
+    def __init__(self, controller, baseRates, rate = 10.0, maxCorrection = 30.0, maxAge = 2.0, controllers = None, maxRetryDelay = 1.0):
+        if len(baseRates) != 2:
+            raise UsageError("Guider() failed: incorrect value for parameter 'baseRates': {}".format(repr(baseRates)))
+        self._controller = controller
+        self._period = 1.0 / rate
+        self._baseRates = tuple(baseRates)           # degrees / second
+        self._maxCorrection = maxCorrection           # arcseconds / second
+        self._maxAge = maxAge
+        self._maxRetryDelay = maxRetryDelay
+        self._consecutiveErrors = 0
+        self._controllers = controllers if controllers is not None else (PIController(), PIController())
+        self._latest = None
+        self._used = None
+        self._sent = [None, None]                     # last rate sent per axis, in rate quanta
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._intervals = collections.deque(maxlen = 1000)
+        self._latencies = collections.deque(maxlen = 1000)
+        self.tickCount = 0
+        self.sentCount = 0
+        self.skippedCount = 0
+        self.staleCount = 0
+        self.errorCount = 0
+        self.lastError = None
+
+    def submit(self, timestamp, first, second):
+        # Thread-safe; only the newest measurement is kept.
+        measurement = Measurement(timestamp, first, second)
+        with self._lock:
+            if self._latest is None or measurement.timestamp >= self._latest.timestamp:
+                self._latest = measurement
+
+    def start(self):
+        if self._thread is None:
+            for controller in self._controllers:
+                controller.reset()
+            self._sent = [None, None]
+            self._stop.clear()
+            self._thread = threading.Thread(target = self._run, name = "Guider", daemon = True)
+            self._thread.start()
+
+    def stop(self):
+        # Stops the loop and returns both axes to their base rates.
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._send([self._quantise(rate) for rate in self._baseRates], force = True)
+
+    @staticmethod
+    def _quantise(rate):
+        return round(rate / RATE_QUANTUM)
+
+    def _send(self, quanta, force = False):
+
+        transactions = []
+        changed = []
+        for (index, axisId) in enumerate(_AXES):
+            if force or quanta[index] != self._sent[index]:
+                transactions.append(Requests.slew_variable(axisId, quanta[index] * RATE_QUANTUM))
+                changed.append(index)
+            else:
+                self.skippedCount += 1
+
+        if not transactions:
+            return
+
+        try:
+            self._controller.execute(*transactions)
+        except Exception as exception:
+            # Anything from the port or the arbiter (OSError, QueueFullError, ...) as well.
+            self.errorCount += 1
+            self._consecutiveErrors += 1
+            self.lastError = exception
+            # Unknown state: send these axes again next time.
+            for index in changed:
+                self._sent[index] = None
+            return
+
+        self._consecutiveErrors = 0
+        self.sentCount += len(transactions)
+        for index in changed:
+            self._sent[index] = quanta[index]
+
+    def tick(self, now = None):
+
+        # One control step; called by the loop thread.
+
+        now = time.monotonic() if now is None else now
+        self.tickCount += 1
+
+        with self._lock:
+            measurement = self._latest
+
+        if measurement is None or measurement is self._used:
+            return
+
+        if now - measurement.timestamp > self._maxAge:
+            self.staleCount += 1
+            return
+
+        dt = self._period if self._used is None else max(1e-3, measurement.timestamp - self._used.timestamp)
+        self._used = measurement
+
+        quanta = []
+        for (index, error) in enumerate((measurement.first, measurement.second)):
+            correction = self._controllers[index].update(error, dt)
+            correction = max(-self._maxCorrection, min(self._maxCorrection, correction))
+            quanta.append(self._quantise(self._baseRates[index] + correction / 3600.0))
+
+        self._send(quanta)
+        self._latencies.append(time.monotonic() - measurement.timestamp)
+
+    def _run(self):
+
+        deadline = time.monotonic()
+        previous = None
+
+        while not self._stop.is_set():
+
+            started = time.monotonic()
+            if previous is not None:
+                self._intervals.append(started - previous)
+            previous = started
+
+            try:
+                self.tick(started)
+            except Exception as exception:
+                self.errorCount += 1
+                self._consecutiveErrors += 1
+                self.lastError = exception
+
+            deadline += self._period
+            if self._consecutiveErrors:
+                # Back off while the link is failing; the schedule restarts when it recovers.
+                deadline = max(deadline, time.monotonic() + min(self._period * 2 ** min(self._consecutiveErrors, 16), self._maxRetryDelay))
+            delay = deadline - time.monotonic()
+            if delay < 0.0:
+                deadline = time.monotonic()
+                delay = 0.0
+            self._stop.wait(delay)
+
+    def statistics(self):
+
+        # Loop timing: tick interval mean and jitter (standard deviation and worst deviation from the
+        # nominal period), and the latency from measurement to correction, in seconds.
+
+        intervals = list(self._intervals)
+        latencies = sorted(self._latencies)
+
+        statistics = {
+                "ticks"    : self.tickCount,
+                "sent"     : self.sentCount,
+                "skipped"  : self.skippedCount,
+                "stale"    : self.staleCount,
+                "errors"   : self.errorCount
+            }
+
+        if intervals:
+            mean = sum(intervals) / len(intervals)
+            statistics["intervalMean"] = mean
+            statistics["jitter"] = math.sqrt(sum((interval - mean) ** 2 for interval in intervals) / len(intervals))
+            statistics["maxDeviation"] = max(abs(interval - self._period) for interval in intervals)
+
+        if latencies:
+            statistics["latencyMedian"] = latencies[len(latencies) // 2]
+            statistics["latencyMax"] = latencies[-1]
+
+        return statistics
+
+
+class _Source:
+
+    # Reads measurements on a thread of its own and submits them to a guider.
+
+    def __init__(self, guider):
+        self._guider = guider
+        self._stop = threading.Event()
+        self._thread = None
+        self.errorCount = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target = self._run, name = type(self).__name__, daemon = True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _submit(self, line):
+        try:
+            measurement = parseMeasurement(line)
+        except (UsageError, ValueError):
+            self.errorCount += 1
+            return
+        if measurement is not None:
+            self._guider.submit(*measurement)
+
+
+class FileSource(_Source):
+
+    # Follows a text file that a guide camera program appends measurements to, one per line.
+
+    def __init__(self, guider, path, pollInterval = 0.020, fromStart = False):
+        super(FileSource, self).__init__(guider)
+        self._path = path
+        self._pollInterval = pollInterval
+        self._fromStart = fromStart
+
+    def _run(self):
+        with open(self._path, "r") as file:
+            if not self._fromStart:
+                file.seek(0, 2)
+            pending = ""
+            while not self._stop.is_set():
+                data = file.readline()
+                if not data:
+                    self._stop.wait(self._pollInterval)
+                    continue
+                pending += data
+                if pending.endswith("\n"):
+                    self._submit(pending)
+                    pending = ""
+
+
+class SocketSource(_Source):
+
+    # Receives measurements as UDP datagrams, one or more lines each.
+
+    def __init__(self, guider, address = ("127.0.0.1", 11881)):
+        super(SocketSource, self).__init__(guider)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(address)
+        self._socket.settimeout(0.1)
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def stop(self):
+        super(SocketSource, self).stop()
+        self._socket.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                data = self._socket.recv(65536)
+            except socket.timeout:
+                continue
+            for line in data.decode("ascii", "replace").splitlines():
+                self._submit(line)
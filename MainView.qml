@@ -16,11 +16,22 @@ ApplicationWindow {
                 id: comPortSelectId
                 textRole: "display"
                 model: comPortsModel
+
+                // The port list is refreshed in the background as ports come and go; keep the
+                // chosen port selected while it is there.
+                property string selectedPort: ""
+                onActivated: selectedPort = currentText
+            }
+
+            Connections {
+                target: comPortsModel
+                onModelReset: comPortSelectId.currentIndex = Math.max(0, comPortSelectId.find(comPortSelectId.selectedPort))
             }
 
             CustomButton {
                 button_height: comPortSelectId.height
-                text: viewModel.connected ? qsTr("Disconnect") : qsTr("Connect")
+                enabled: !viewModel.busy && (viewModel.connected || comPortSelectId.count > 0)
+                text: viewModel.busy ? qsTr("Connecting…") : viewModel.connected ? qsTr("Disconnect") : qsTr("Connect")
                 onClicked: {
                     if(!viewModel.connected)
                         viewModel.connect(comPortSelectId.currentText);
@@ -82,12 +93,26 @@ ApplicationWindow {
 
         RowLayout {
             Label { text: "Location:" }
-            Text  { text: viewModel.location }
+            Text  {
+                text: viewModel.connected && viewModel.hasLocation
+                      ? viewModel.latitude.toFixed(4) + ", " + viewModel.longitude.toFixed(4)
+                      : qsTr("disconnected")
+            }
         }
 
         RowLayout {
             Label { text: "Current pointing Position:" }
-            Text  { text: viewModel.position }
+            Text  {
+                text: viewModel.connected && viewModel.hasPosition
+                      ? "RA: " + viewModel.rightAscension.toFixed(4) + ", DEC: " + viewModel.declination.toFixed(4)
+                      : qsTr("disconnected")
+            }
+        }
+
+        Label {
+            visible: text !== ""
+            color: "red"
+            text: viewModel.lastError !== "" ? viewModel.lastError : viewModel.telemetryError
         }
     }
 }
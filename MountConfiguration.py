@@ -0,0 +1,137 @@
+import collections, datetime
+
+from SynScanProtocol import UsageError, Command, TrackingMode, Requests
+
+# One difference between the mount and the desired configuration.
+Change = collections.namedtuple("Change", ["field", "current", "desired"])
+
+ConfigurationReport = collections.namedtuple("ConfigurationReport", ["changes", "mismatches"])
+
+
+class MountConfiguration:
+
+    # Desired state of a mount: location, tracking mode and clock. Fields left at None are not
+    # touched. apply() takes two round trips however much changes: one pipelined burst reads the
+    # current state, a second one sends only the setters that are needed, back-to-back, followed by
+    # the reads that verify them.
+    #
+    # The clock is compared rather than blindly set: 'utcOffset' (whole hours, standard time) and
+    # 'dst' must match, and the mount time may be off by at most 'timeTolerance' seconds (the hand
+    # controller only keeps whole seconds).
+
+    def __init__(self, location = None, trackingMode = None, syncTime = False, utcOffset = None, dst = False, timeTolerance = 2.0, locationTolerance = 1.0 / 3600.0):
+
+        if trackingMode is not None and not isinstance(trackingMode, TrackingMode):
+            raise UsageError("MountConfiguration() failed: incorrect value for parameter 'trackingMode': {}".format(repr(trackingMode)))
+
+        if utcOffset is None:
+            # The host's standard time offset.
+            now = datetime.datetime.now(datetime.timezone.utc).astimezone()
+            utcOffset = round((now.utcoffset() - (now.dst() or datetime.timedelta(0))) / datetime.timedelta(hours = 1))
+
+        self.location = location
+        self.trackingMode = trackingMode
+        self.syncTime = syncTime
+        self.utcOffset = utcOffset
+        self.dst = dst
+        self.timeTolerance = timeTolerance
+        self.locationTolerance = locationTolerance
+
+    def readTransactions(self):
+
+        transactions = []
+        if self.location is not None:
+            transactions.append(Requests.getLocation())
+        if self.trackingMode is not None:
+            transactions.append(Requests.getTrackingMode())
+        if self.syncTime:
+            transactions.append(Requests.getTime())
+        return transactions
+
+    def _fields(self, results):
+        # Pairs up readTransactions() results with field names.
+        names = []
+        if self.location is not None:
+            names.append("location")
+        if self.trackingMode is not None:
+            names.append("trackingMode")
+        if self.syncTime:
+            names.append("time")
+        return dict(zip(names, results))
+
+    def _clock(self):
+        # The local time to set, as the hand controller wants it: standard zone, DST included in the hour.
+        zone = datetime.timezone(datetime.timedelta(hours = self.utcOffset))
+        timestamp = datetime.datetime.now(datetime.timezone.utc).astimezone(zone)
+        if self.dst:
+            timestamp += datetime.timedelta(hours = 1)
+        return timestamp
+
+    def diff(self, results):
+
+        # Changes needed, given the results of readTransactions().
+
+        current = self._fields(results)
+        changes = []
+
+        if self.location is not None:
+            (latitude, longitude) = current["location"]
+            if abs(latitude - self.location[0]) > self.locationTolerance or abs(longitude - self.location[1]) > self.locationTolerance:
+                changes.append(Change("location", current["location"], tuple(self.location)))
+
+        if self.trackingMode is not None:
+            if current["trackingMode"] != self.trackingMode.value:
+                changes.append(Change("trackingMode", current["trackingMode"], self.trackingMode))
+
+        if self.syncTime:
+            (timestamp, dst) = current["time"]
+            zone = round(timestamp.utcoffset() / datetime.timedelta(hours = 1))
+            error = (timestamp - self._clock()).total_seconds()
+            if zone != self.utcOffset or dst != self.dst or abs(error) > self.timeTolerance:
+                changes.append(Change("time", current["time"], (self.utcOffset, self.dst)))
+
+        return changes
+
+    def setterTransactions(self, changes):
+
+        # Setters for the changes, followed by the reads that verify them.
+
+        setters = []
+        for change in changes:
+            if change.field == "location":
+                setters.append(Requests.setLocation(*self.location))
+            elif change.field == "trackingMode":
+                setters.append(Requests.setTrackingMode(self.trackingMode))
+            elif change.field == "time":
+                setters.append(Requests.setTime(self._clock(), self.dst))
+
+        return setters + (self.readTransactions() if setters else [])
+
+    def verify(self, changes, results):
+
+        # Changes that did not take, given the results of setterTransactions().
+
+        if not changes:
+            return []
+        return self.diff(results[len(changes):])
+
+    def apply(self, controller):
+
+        # Brings one mount into the desired configuration. 'controller' is anything with execute().
+
+        invalidate = getattr(controller, "invalidate", None)
+        if invalidate is not None:
+            # Read the real state, not what the controller cached earlier.
+            invalidate(Command.GET_LOCATION, Command.GET_TRACKING_MODE, Command.GET_TIME)
+
+        transactions = self.readTransactions()
+        if not transactions:
+            return ConfigurationReport([], [])
+
+        changes = self.diff(controller.execute(*transactions))
+        if not changes:
+            return ConfigurationReport([], [])
+
+        results = controller.execute(*self.setterTransactions(changes))
+
+        return ConfigurationReport(changes, self.verify(changes, results))
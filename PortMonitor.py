@@ -0,0 +1,52 @@
+import threading
+
+from PySide2.QtCore import QObject, Signal
+
+from SynScanFleet import discoverPorts
+
+
+class PortMonitor(QObject):
+
+    # Enumerates the serial ports on a thread of its own and emits portsChanged(list) whenever the
+    # ports differ from the last enumeration: once shortly after start(), then on every hot-plug.
+    # Enumerating can take seconds (on Windows every driver is asked), so the GUI thread never does
+    # it; receivers on the GUI thread get the signal queued.
+
+    portsChanged = Signal(list)
+
+    def __init__(self, interval = 2.0, match = None, parent = None):
+        super(PortMonitor, self).__init__(parent)
+        self._interval = interval
+        self._match = match
+        self._ports = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.errorCount = 0
+
+    @property
+    def ports(self):
+        return list(self._ports or [])
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target = self._run, name = "PortMonitor", daemon = True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                ports = discoverPorts(self._match)
+            except OSError:
+                self.errorCount += 1
+            else:
+                if ports != self._ports:
+                    self._ports = ports
+                    self.portsChanged.emit(ports)
+            self._stop.wait(self._interval)
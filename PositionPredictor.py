@@ -0,0 +1,153 @@
+import collections, math, threading, time
+
+from SynScanProtocol import CoordinateMode, TrackingMode, Requests
+
+# Smallest step of the precise position commands, in degrees.
+POSITION_QUANTUM = 360.0 / (1 << 32)
+
+
+class PositionPredictor:
+
+    # Answers "where does the mount point at time t" from a few recent high-precision samples,
+    # reading the position over the wire only when the estimated error of the prediction exceeds
+    # 'tolerance' (degrees).
+    #
+    # Per axis, the recent samples are fitted with a straight line (least squares). With RA/DEC
+    # coordinates and tracking on, the rates are known to be zero and one sample is enough. The
+    # error estimate is the prediction interval of the fit plus 'driftRate' (degrees / second) for
+    # every second since the newest sample, which covers periodic error and other motion the line
+    # cannot model, and forces a read now and then. While the motion is unknown (after a rate
+    # change, during a goto) every query is a read.
+
+    def __init__(self, controller, coordinateMode = CoordinateMode.RA_DEC, tolerance = 2.0 / 3600.0, window = 8, driftRate = 0.2 / 3600.0):
+        self._controller = controller
+        self._transaction = Requests.getPosition(coordinateMode, highPrecisionFlag = True)
+        self._coordinateMode = coordinateMode
+        self.tolerance = tolerance
+        self.driftRate = driftRate
+        self._samples = collections.deque(maxlen = window) # (timestamp, first, second), angles unwrapped
+        self._knownRates = None # (first, second) in degrees / second when the motion is known a priori
+        self._moving = False
+        self._lock = threading.Lock()
+        self.readCount = 0
+        self.predictedCount = 0
+
+    # Motion state; each change that invalidates the fit drops the samples.
+
+    def setTrackingMode(self, trackingMode):
+        tracking = TrackingMode(trackingMode) != TrackingMode.OFF
+        with self._lock:
+            knownRates = (0.0, 0.0) if tracking and self._coordinateMode == CoordinateMode.RA_DEC else None
+            if knownRates != self._knownRates:
+                self._knownRates = knownRates
+                self._samples.clear()
+
+    def setMoving(self, moving):
+        # True while a goto or a manual slew runs: the motion cannot be predicted.
+        with self._lock:
+            self._moving = moving
+            self._samples.clear()
+
+    def invalidate(self):
+        with self._lock:
+            self._samples.clear()
+
+    # Samples
+
+    def observe(self, timestamp, position):
+
+        # Adds a sample taken elsewhere (e.g. by a TelemetryPoller or a PositionStream).
+
+        with self._lock:
+            (first, second) = position
+            if self._samples:
+                # Unwrap relative to the previous sample so the fit never sees a jump at 360 degrees.
+                (_, previousFirst, previousSecond) = self._samples[-1]
+                first = previousFirst + ((first - previousFirst + 180.0) % 360.0 - 180.0)
+                second = previousSecond + ((second - previousSecond + 180.0) % 360.0 - 180.0)
+            self._samples.append((timestamp, first, second))
+
+    def read(self):
+        sent = time.monotonic()
+        (position, ) = self._controller.execute(self._transaction)
+        received = time.monotonic()
+        self.readCount += 1
+        self.observe(0.5 * (sent + received), position)
+        return position
+
+    # Prediction
+
+    def _fit(self, samples, axis, at):
+
+        # Returns (prediction, error) of one axis at time 'at'.
+
+        n = len(samples)
+        times = [sample[0] for sample in samples]
+        values = [sample[axis] for sample in samples]
+        age = max(0.0, at - times[-1])
+
+        if self._knownRates is not None:
+            rate = self._knownRates[axis - 1]
+            offsets = [value - rate * (t - times[-1]) for (t, value) in zip(times, values)]
+            mean = sum(offsets) / n
+            spread = math.sqrt(sum((offset - mean) ** 2 for offset in offsets) / n) if n > 1 else 0.0
+            return (mean + rate * (at - times[-1]), spread + POSITION_QUANTUM + self.driftRate * age)
+
+        if n < 2:
+            return (values[-1], math.inf)
+
+        meanTime = sum(times) / n
+        meanValue = sum(values) / n
+        sxx = sum((t - meanTime) ** 2 for t in times)
+        if sxx == 0.0:
+            return (values[-1], math.inf)
+        rate = sum((t - meanTime) * (value - meanValue) for (t, value) in zip(times, values)) / sxx
+        intercept = meanValue - rate * meanTime
+
+        if n > 2:
+            residual = math.sqrt(sum((value - intercept - rate * t) ** 2 for (t, value) in zip(times, values)) / (n - 2))
+        else:
+            # Two samples fit any line exactly; assume the worst case of their quantisation.
+            residual = POSITION_QUANTUM
+        residual = max(residual, POSITION_QUANTUM)
+
+        interval = residual * math.sqrt(1.0 + 1.0 / n + (at - meanTime) ** 2 / sxx)
+
+        return (intercept + rate * at, interval + self.driftRate * age)
+
+    def predict(self, at = None):
+
+        # (position, error) at host time 'at' (time.monotonic(), default: now) without reading;
+        # error is math.inf when there is nothing to go by.
+
+        at = time.monotonic() if at is None else at
+
+        with self._lock:
+            samples = list(self._samples)
+            moving = self._moving
+
+        if not samples or moving:
+            return (None, math.inf)
+
+        (first, firstError) = self._fit(samples, 1, at)
+        (second, secondError) = self._fit(samples, 2, at)
+
+        return ((first % 360.0, second % 360.0), max(firstError, secondError))
+
+    def position(self, at = None):
+
+        # Like predict(), but reads the position first when the prediction would be off by more
+        # than the tolerance.
+
+        (position, error) = self.predict(at)
+        if error <= self.tolerance:
+            self.predictedCount += 1
+            return (position, error)
+
+        self.read()
+        (position, error) = self.predict(at)
+        if position is None:
+            # Moving: the fresh sample is all there is.
+            (_, first, second) = self._samples[-1]
+            return ((first % 360.0, second % 360.0), 0.0)
+        return (position, error)
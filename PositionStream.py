@@ -0,0 +1,196 @@
+import threading, time
+
+import numpy as np
+
+from SynScanProtocol import UsageError, CoordinateMode, Requests
+
+# One position sample. 'sequence' counts from 1 (0 marks an unused slot), times are host
+# time.monotonic() seconds: 'timestamp' is the midpoint between sending the request and receiving
+# the response, the best estimate of when the hand controller sampled its encoders, and
+# 'roundTrip' is the time between the two. Angles are in degrees.
+SAMPLE_DTYPE = np.dtype([
+        ("sequence",  np.uint64),
+        ("timestamp", np.float64),
+        ("roundTrip", np.float64),
+        ("first",     np.float64),
+        ("second",    np.float64)
+    ])
+
+
+class PositionHistory:
+
+    # Fixed-size ring buffer of position samples in a numpy structured array, optionally backed by a
+    # memory-mapped file so that other processes can read it while it is written. There is no
+    # header: readers find the newest sample by its sequence number. A single thread appends.
+    #
+    # Every slot is a seqlock: append() zeroes the sequence number, writes the fields, then writes
+    # the new sequence number. latest() and since() copy the samples and read the sequence numbers
+    # again afterwards; a slot that was zero or changed meanwhile was (over)written during the copy
+    # and is left out. segments() returns the raw views, unchecked.
+
+    def __init__(self, capacity = 65536, path = None):
+
+        if not (isinstance(capacity, int) and capacity > 0):
+            raise UsageError("PositionHistory() failed: incorrect value for parameter 'capacity': {}".format(repr(capacity)))
+
+        if path is None:
+            self._samples = np.zeros(capacity, dtype = SAMPLE_DTYPE)
+        else:
+            self._samples = np.memmap(path, dtype = SAMPLE_DTYPE, mode = "w+", shape = (capacity,))
+
+        self._capacity = capacity
+        self._count = 0
+
+    @classmethod
+    def open(cls, path):
+
+        # Read-only view of a history written by another process; it follows the writer.
+
+        samples = np.memmap(path, dtype = SAMPLE_DTYPE, mode = "r")
+        history = cls.__new__(cls)
+        history._samples = samples
+        history._capacity = len(samples)
+        history._count = None
+        return history
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def samples(self):
+        # The raw buffer, in storage order.
+        return self._samples
+
+    @property
+    def count(self):
+        # Total number of samples appended so far, including overwritten ones.
+        if self._count is None:
+            return int(self._samples["sequence"].max()) if self._capacity else 0
+        return self._count
+
+    def __len__(self):
+        return min(self.count, self._capacity)
+
+    def append(self, timestamp, roundTrip, first, second):
+        count = self._count + 1
+        sample = self._samples[(count - 1) % self._capacity]
+        # Invalid while the fields are written, so that a reader cannot take the old sequence
+        # number together with half of the new data.
+        sample["sequence"] = 0
+        sample["timestamp"] = timestamp
+        sample["roundTrip"] = roundTrip
+        sample["first"] = first
+        sample["second"] = second
+        sample["sequence"] = count
+        self._count = count
+
+    def flush(self):
+        if isinstance(self._samples, np.memmap):
+            self._samples.flush()
+
+    def segments(self, n = None):
+
+        # The newest n samples (default: all) as at most two views, oldest first.
+
+        count = self.count
+        length = min(count, self._capacity) if n is None else min(n, count, self._capacity)
+        end = count % self._capacity
+        start = end - length
+
+        if start >= 0:
+            return [self._samples[start:end]]
+        return [self._samples[start:], self._samples[:end]]
+
+    def latest(self, n = None):
+
+        # A consistent copy of the newest n samples, oldest first. Samples the writer overwrote
+        # while they were copied are left out, so fewer than n may be returned.
+
+        segments = self.segments(n)
+        # 'sequence' is the first field: the copy reads it before the rest of each sample.
+        samples = np.concatenate(segments) if len(segments) != 1 else segments[0].copy()
+        sequences = np.concatenate([segment["sequence"] for segment in segments])
+        valid = (samples["sequence"] != 0) & (samples["sequence"] == sequences)
+        return samples if valid.all() else samples[valid]
+
+    def since(self, sequence):
+        # Samples newer than the given sequence number, e.g. the last one a consumer has seen.
+        return self.latest(max(0, self.count - sequence))
+
+    def __iter__(self):
+        yield from self.latest()
+
+
+class PositionStream:
+
+    # Samples the precise position commands ('e' or 'z') back-to-back, as fast as the link allows
+    # (or every 'interval' seconds), into a PositionHistory. Requests are sent one at a time: with
+    # several in flight the round trip of a sample, and so its timestamp, would not be known.
+
+    def __init__(self, controller, history = None, coordinateMode = CoordinateMode.AZM_ALT, interval = 0.0, onSample = None):
+        self._controller = controller
+        self.history = history if history is not None else PositionHistory()
+        self._transaction = Requests.getPosition(coordinateMode, highPrecisionFlag = True)
+        self._interval = interval
+        self._onSample = onSample
+        self._running = False
+        self._thread = None
+        self._stopped = threading.Event()
+        self.errorCount = 0
+        self.lastError = None
+
+    def sample(self):
+
+        transaction = self._transaction
+
+        sent = time.monotonic()
+        (position, ) = self._controller.execute(transaction)
+        received = time.monotonic()
+
+        self.history.append(0.5 * (sent + received), received - sent, position[0], position[1])
+
+        if self._onSample is not None:
+            self._onSample(self.history)
+
+        return position
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._stopped.clear()
+        self._thread = threading.Thread(target = self._run, name = "PositionStream", daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._running = False
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self.history.flush()
+
+    def _run(self):
+
+        retryDelay = 0.0
+
+        while self._running:
+
+            started = time.monotonic()
+
+            try:
+                self.sample()
+            except Exception as exception:
+                # OSError from the port or QueueFullError from an arbiter too: the stream keeps
+                # going, backing off while the link is down instead of spinning on the error.
+                self.errorCount += 1
+                self.lastError = exception
+                retryDelay = min(max(2 * retryDelay, 0.050), 1.0)
+            else:
+                retryDelay = 0.0
+
+            remaining = max(self._interval, retryDelay) - (time.monotonic() - started)
+            if remaining > 0.0:
+                self._stopped.wait(remaining)
@@ -0,0 +1,294 @@
+import bisect, collections, mmap, struct, threading, time
+
+from SynScanProtocol import UsageError, ProtocolError
+
+# Session log: every byte a SynScanController sends or receives, with timestamps, for post-mortems
+# and replay. The file format is append-only and little more than a header and a list of chunks:
+#
+#   file header   ">8sd"    magic, wall clock time (POSIX) of the start of the session
+#   chunk header  ">4sIIdd" chunk magic, number of records, payload length, time of first and last record
+#   record        ">dBH"    time since the start of the session (seconds), direction, data length; then the data
+#
+# Chunks are written with a single write() each, so a crash can only leave a partial chunk at the
+# end of the file, which the reader ignores. The chunk headers carry the time range of their records:
+# seeking by time only has to look at chunk headers.
+
+FILE_HEADER   = struct.Struct(">8sd")
+CHUNK_HEADER  = struct.Struct(">4sIIdd")
+RECORD_HEADER = struct.Struct(">dBH")
+
+FILE_MAGIC  = b"SYNSLOG1"
+CHUNK_MAGIC = b"CHNK"
+
+SENT     = 0 # host -> hand controller
+RECEIVED = 1 # hand controller -> host
+
+LogRecord = collections.namedtuple("LogRecord", ["timestamp", "direction", "data"])
+
+
+class SessionRecorder:
+
+    # Streaming writer. sent() and received() are called on the I/O path of the controller and only
+    # append to a queue; a background thread packs the queue into chunks and writes them out.
+
+    def __init__(self, path, flushInterval = 1.0, maxChunkLength = 65536):
+        self._file = open(path, "wb")
+        self._flushInterval = flushInterval
+        self._maxChunkLength = maxChunkLength
+        self._queue = collections.deque()
+        self._origin = time.monotonic()
+        self.startTime = time.time()
+        self.recordCount = 0
+        self.chunkCount = 0
+
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, self.startTime))
+        self._file.flush()
+
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = "SessionRecorder", daemon = True)
+        self._thread.start()
+
+    def sent(self, data):
+        self._queue.append((time.monotonic() - self._origin, SENT, bytes(data)))
+
+    def received(self, data):
+        self._queue.append((time.monotonic() - self._origin, RECEIVED, bytes(data)))
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._closing.set()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_chunk(self, records):
+
+        payload = b''.join(RECORD_HEADER.pack(timestamp, direction, len(data)) + data for (timestamp, direction, data) in records)
+        header = CHUNK_HEADER.pack(CHUNK_MAGIC, len(records), len(payload), records[0][0], records[-1][0])
+
+        self._file.write(header + payload)
+        self.recordCount += len(records)
+        self.chunkCount += 1
+
+    def _drain(self):
+
+        records = []
+        length = 0
+
+        while self._queue:
+            record = self._queue.popleft()
+            records.append(record)
+            length += RECORD_HEADER.size + len(record[2])
+            if length >= self._maxChunkLength:
+                self._write_chunk(records)
+                records = []
+                length = 0
+
+        if records:
+            self._write_chunk(records)
+            self._file.flush()
+
+    def _run(self):
+        while not self._closing.wait(self._flushInterval):
+            self._drain()
+        self._drain()
+
+
+class SessionReader:
+
+    # Memory-maps a session log and indexes its chunks.
+
+    def __init__(self, path):
+
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        if len(self._map) < FILE_HEADER.size:
+            raise ProtocolError("SessionReader() failed: file too short")
+
+        (magic, self.startTime) = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != FILE_MAGIC:
+            raise ProtocolError("SessionReader() failed: not a session log")
+
+        self._chunks = [] # (payload offset, number of records, payload length, first time, last time)
+
+        offset = FILE_HEADER.size
+        while offset + CHUNK_HEADER.size <= len(self._map):
+            (magic, count, length, first, last) = CHUNK_HEADER.unpack_from(self._map, offset)
+            if magic != CHUNK_MAGIC or offset + CHUNK_HEADER.size + length > len(self._map):
+                break # partial chunk at the end of the log
+            self._chunks.append((offset + CHUNK_HEADER.size, count, length, first, last))
+            offset += CHUNK_HEADER.size + length
+
+        self._lastTimes = [chunk[4] for chunk in self._chunks]
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return sum(chunk[1] for chunk in self._chunks)
+
+    @property
+    def duration(self):
+        return self._lastTimes[-1] if self._chunks else 0.0
+
+    def records(self, start = None, end = None):
+
+        # Records with start <= timestamp < end (seconds since the start of the session), in order.
+
+        index = 0 if start is None else bisect.bisect_left(self._lastTimes, start)
+
+        for (offset, count, length, first, last) in self._chunks[index:]:
+            if end is not None and first >= end:
+                return
+            for _ in range(count):
+                (timestamp, direction, size) = RECORD_HEADER.unpack_from(self._map, offset)
+                offset += RECORD_HEADER.size
+                if start is not None and timestamp < start:
+                    offset += size
+                    continue
+                if end is not None and timestamp >= end:
+                    return
+                yield LogRecord(timestamp, direction, self._map[offset:offset + size])
+                offset += size
+
+    def __iter__(self):
+        return self.records()
+
+
+class ReplayDevice:
+
+    # File-like device that SynScanController.connect() can attach to and that answers with the
+    # responses of a recorded session. Every write is matched with the next recorded request; the
+    # responses recorded after it become readable with the same delays they had in the recording,
+    # divided by 'speed' (None: immediately). Writes that differ from the recording are counted in
+    # 'mismatchCount' but answered all the same.
+
+    def __init__(self, reader, speed = 1.0, start = None, timeout = 3.500):
+        self._records = reader.records(start)
+        self._next = next(self._records, None)
+        self.speed = speed
+        self.timeout = timeout
+        self.is_open = True
+        self.mismatchCount = 0
+        self._pending = collections.deque() # (available time, response bytes)
+        self._condition = threading.Condition()
+
+    def _advance(self):
+        record = self._next
+        self._next = next(self._records, None)
+        return record
+
+    def write(self, data):
+
+        with self._condition:
+
+            if not self.is_open:
+                raise UsageError("write() failed: device is closed")
+
+            now = time.monotonic()
+
+            # Responses nobody read before this request are handed out right away.
+            while self._next is not None and self._next.direction != SENT:
+                self._pending.append((now, self._advance().data))
+
+            request = self._advance()
+            if request is None:
+                raise ProtocolError("write() failed: end of recorded session")
+            if request.data != bytes(data):
+                self.mismatchCount += 1
+
+            while self._next is not None and self._next.direction != SENT:
+                response = self._advance()
+                delay = 0.0 if not self.speed else (response.timestamp - request.timestamp) / self.speed
+                self._pending.append((now + delay, response.data))
+
+            self._condition.notify_all()
+
+        return len(data)
+
+    def read(self, size = 1):
+
+        response = bytearray()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        with self._condition:
+
+            while len(response) < size:
+
+                now = time.monotonic()
+
+                while self._pending and self._pending[0][0] <= now and len(response) < size:
+                    (available, data) = self._pending.popleft()
+                    take = size - len(response)
+                    response += data[:take]
+                    if len(data) > take:
+                        self._pending.appendleft((available, data[take:]))
+
+                if len(response) == size or not self.is_open:
+                    break
+
+                wait = self._pending[0][0] - now if self._pending else None
+
+                if deadline is not None:
+                    if now >= deadline:
+                        break
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+
+                self._condition.wait(wait)
+
+        return bytes(response)
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        with self._condition:
+            return sum(len(data) for (available, data) in self._pending if available <= now)
+
+    def reset_input_buffer(self):
+        with self._condition:
+            now = time.monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                self._pending.popleft()
+
+    def close(self):
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
+
+
+def replayIntoSimulator(reader, simulator, start = None, end = None):
+
+    # Feeds the recorded requests into a SynScanSimulator, on the simulator's clock shifted to the
+    # recorded times, and yields (timestamp, request, recorded response, simulated response) per
+    # request, e.g. to find where the simulator and the real hand controller disagree.
+
+    origin = simulator.clock()
+    request = None
+    recorded = b''
+
+    for record in reader.records(start, end):
+        if record.direction == SENT:
+            if request is not None:
+                yield (request.timestamp, request.data, recorded, simulated)
+            request = record
+            recorded = b''
+            simulated = simulator.feed(record.data, now = origin + record.timestamp)
+        else:
+            recorded += record.data
+
+    if request is not None:
+        yield (request.timestamp, request.data, recorded, simulated)
@@ -0,0 +1,132 @@
+import threading
+
+from SynScanProtocol import UsageError, AxisId, Requests
+
+_AXES = (AxisId.AZM_RA_MOTOR, AxisId.ALT_DEC_MOTOR)
+
+_FIXED    = 0
+_VARIABLE = 1
+
+
+class SlewControl:
+
+    # Latest-wins slew stage for continuous input (buttons, joysticks, gamepads). Callers only set
+    # the desired rate per axis; a worker thread sends whatever is desired when the link is free.
+    # Rates that are superseded before they could be sent are never sent, changed axes go out
+    # together in one pipelined burst, and stop() overrides anything still pending. Combined with
+    # a CommandArbiter the zero-rate slews of stop() are also sent ahead of all other traffic.
+
+    def __init__(self, controller, retryDelay = 0.050, maxRetryDelay = 1.0):
+        self._controller = controller
+        self._retryDelay = retryDelay
+        self._maxRetryDelay = maxRetryDelay
+        self._desired = {axisId: (_FIXED, 0) for axisId in _AXES}
+        self._sent = {axisId: (_FIXED, 0) for axisId in _AXES}
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.lastError = None
+        self.sentCount = 0
+        self.supersededCount = 0
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._running = True
+            # Nothing is sent until there is input: the mount may be running a goto started from the
+            # hand controller, which a zero-rate slew would cut short. Only a stop() requested
+            # before the start is still sent.
+            for axisId in _AXES:
+                if self._sent[axisId] is not None:
+                    self._sent[axisId] = self._desired[axisId]
+            self._thread = threading.Thread(target = self._run, name = "SlewControl", daemon = True)
+            self._thread.start()
+
+    def close(self):
+
+        with self._condition:
+            if self._thread is None:
+                return
+            self._running = False
+            self._condition.notify_all()
+            thread = self._thread
+            self._thread = None
+
+        thread.join()
+
+    def _set(self, axisId, desired):
+
+        if axisId not in _AXES:
+            raise UsageError("slew command only supported for motors.")
+
+        with self._condition:
+            if self._desired[axisId] != self._sent[axisId]:
+                # The previous request for this axis has not been sent yet and never will be.
+                self.supersededCount += 1
+            self._desired[axisId] = desired
+            self._condition.notify()
+
+    def setRate(self, axisId, rate):
+        if not (isinstance(rate, int) and -9 <= rate <= +9):
+            raise UsageError("setRate() failed: incorrect value for parameter 'rate': {}".format(repr(rate)))
+        self._set(axisId, (_FIXED, rate))
+
+    def setVariableRate(self, axisId, rate):
+        # rate in degrees / second; building the request validates the range up front.
+        Requests.slew_variable(axisId, rate)
+        self._set(axisId, (_VARIABLE, float(rate)))
+
+    def stop(self):
+        # Always sent, even if the last request was a stop already: the mount may have been set
+        # moving by the hand controller or a goto since.
+        with self._condition:
+            for axisId in _AXES:
+                self._desired[axisId] = (_FIXED, 0)
+                self._sent[axisId] = None
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return any(self._desired[axisId] != self._sent[axisId] for axisId in _AXES)
+
+    @staticmethod
+    def _transaction(axisId, desired):
+        (kind, rate) = desired
+        if kind == _VARIABLE:
+            return Requests.slew_variable(axisId, rate)
+        return Requests.slew_fixed(axisId, rate)
+
+    def _run(self):
+
+        retryDelay = self._retryDelay
+
+        while True:
+
+            with self._condition:
+                while self._running and all(self._desired[axisId] == self._sent[axisId] for axisId in _AXES):
+                    self._condition.wait()
+                if not self._running:
+                    return
+                changes = [(axisId, self._desired[axisId]) for axisId in _AXES if self._desired[axisId] != self._sent[axisId]]
+
+            transactions = [self._transaction(axisId, desired) for (axisId, desired) in changes]
+
+            try:
+                self._controller.execute(*transactions)
+            except Exception as exception:
+                # Protocol errors, but also OSError from the port or QueueFullError from an arbiter:
+                # none of them may end the thread, or stop() would no longer work.
+                self.lastError = exception
+                # Keep the desired state and try again, backing off while the link is down.
+                with self._condition:
+                    self._condition.wait(retryDelay)
+                retryDelay = min(2 * retryDelay, self._maxRetryDelay)
+                continue
+
+            retryDelay = self._retryDelay
+
+            with self._condition:
+                for (axisId, desired) in changes:
+                    self._sent[axisId] = desired
+                self.sentCount += len(transactions)
@@ -0,0 +1,58 @@
+import importlib, sys, time
+
+
+class StartupProfile:
+
+    # Wall-clock profile of the application start, measured from 'origin' (time.perf_counter() as
+    # early as possible in the process): named milestones set with mark(), and every module loaded
+    # through importModule() with the time it took and how many modules it pulled in. report()
+    # compares the last milestone with the budget. For a per-module breakdown of everything that is
+    # imported, run the interpreter with -X importtime.
+
+    def __init__(self, budget = 1.5, origin = None):
+        self.budget = budget
+        self._origin = time.perf_counter() if origin is None else origin
+        self._marks = []   # (name, seconds since origin)
+        self._imports = [] # (module name, seconds, number of modules loaded)
+
+    def elapsed(self):
+        return time.perf_counter() - self._origin
+
+    def mark(self, name):
+        self._marks.append((name, self.elapsed()))
+
+    def importModule(self, name):
+        loaded = len(sys.modules)
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        self._imports.append((name, time.perf_counter() - started, len(sys.modules) - loaded))
+        return module
+
+    @property
+    def total(self):
+        return self._marks[-1][1] if self._marks else None
+
+    def overBudget(self):
+        return self.total is not None and self.total > self.budget
+
+    def report(self):
+
+        lines = ["Startup profile (budget {:.0f} ms):".format(self.budget * 1e3)]
+
+        previous = 0.0
+        for (name, at) in self._marks:
+            lines.append("  {:<28} {:8.1f} ms  (+{:.1f} ms)".format(name, at * 1e3, (at - previous) * 1e3))
+            previous = at
+
+        if self._imports:
+            lines.append("Imports, slowest first:")
+            for (name, seconds, count) in sorted(self._imports, key = lambda entry: entry[1], reverse = True):
+                lines.append("  {:<28} {:8.1f} ms  ({} modules)".format(name, seconds * 1e3, count))
+
+        if self.total is not None:
+            if self.overBudget():
+                lines.append("OVER BUDGET by {:.1f} ms".format((self.total - self.budget) * 1e3))
+            else:
+                lines.append("within budget ({:.1f} ms to spare)".format((self.budget - self.total) * 1e3))
+
+        return "\n".join(lines)
@@ -0,0 +1,262 @@
+import argparse, datetime, json, math, platform, sys, time
+
+from SynScanProtocol import SynScanController, Requests, CoordinateMode, TrackingMode, AxisId, ProtocolError, PassthroughError
+
+# Read-only commands (and stop slews), safe to run against a real mount. Every entry builds the
+# list of transactions for a single iteration; more than one transaction is sent pipelined.
+BENCHMARKS = {
+        "getPosition"                      : lambda: [Requests.getPosition()],
+        "getPosition(precise)"             : lambda: [Requests.getPosition(highPrecisionFlag = True)],
+        "getPosition(AZM_ALT)"             : lambda: [Requests.getPosition(CoordinateMode.AZM_ALT)],
+        "getPosition(AZM_ALT, precise)"    : lambda: [Requests.getPosition(CoordinateMode.AZM_ALT, highPrecisionFlag = True)],
+        "getTrackingMode"                  : lambda: [Requests.getTrackingMode()],
+        "getLocation"                      : lambda: [Requests.getLocation()],
+        "getTime"                          : lambda: [Requests.getTime()],
+        "getVersion"                       : lambda: [Requests.getVersion()],
+        "getModel"                         : lambda: [Requests.getModel()],
+        "echo"                             : lambda: [Requests.echo(42)],
+        "getAlignmentComplete"             : lambda: [Requests.getAlignmentComplete()],
+        "getGotoInProgress"                : lambda: [Requests.getGotoInProgress()],
+        "cancelGoto"                       : lambda: [Requests.cancelGoto()],
+        "getDeviceVersion"                 : lambda: [Requests.getDeviceVersion(AxisId.AZM_RA_MOTOR)],
+        "slew_fixed(stop)"                 : lambda: [Requests.slew_fixed(AxisId.AZM_RA_MOTOR, 0)],
+        "slew_variable(stop)"              : lambda: [Requests.slew_variable(AxisId.AZM_RA_MOTOR, 0.0)],
+        "statusPoll(pipelined)"            : lambda: [Requests.getPosition(), Requests.getGotoInProgress(), Requests.getTrackingMode()],
+    }
+
+# Commands that change the mount's state (clock, location, tracking, pointing). Always run against
+# the simulator, against a real mount only when asked for with --setters.
+SETTER_BENCHMARKS = {
+        "setTime"                          : lambda: [Requests.setTime(datetime.datetime.now(datetime.timezone.utc), False)],
+        "setLocation"                      : lambda: [Requests.setLocation(48.0, 11.0)],
+        "setTrackingMode"                  : lambda: [Requests.setTrackingMode(TrackingMode.OFF)],
+        "gotoPosition+cancelGoto"          : lambda: [Requests.gotoPosition(10.0, 20.0), Requests.cancelGoto()],
+        "configure(pipelined)"             : lambda: [Requests.setLocation(48.0, 11.0), Requests.setTrackingMode(TrackingMode.OFF), Requests.setTime(datetime.datetime.now(datetime.timezone.utc), False)],
+    }
+
+PHASES = ("encode", "write", "wait", "decode", "total")
+
+
+def percentile(sortedSamples, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    if not sortedSamples:
+        return None
+    rank = max(1, math.ceil(fraction * len(sortedSamples)))
+    return sortedSamples[rank - 1]
+
+
+def summarize(samples):
+
+    # Latencies are collected in nanoseconds and reported in milliseconds.
+
+    samples = sorted(samples)
+
+    return {
+            "mean_ms" : sum(samples) / len(samples) / 1e6,
+            "min_ms"  : samples[0] / 1e6,
+            "p50_ms"  : percentile(samples, 0.50) / 1e6,
+            "p95_ms"  : percentile(samples, 0.95) / 1e6,
+            "p99_ms"  : percentile(samples, 0.99) / 1e6,
+            "max_ms"  : samples[-1] / 1e6
+        }
+
+
+# Receive paths of the controller: 'buffer' reads into the preallocated receive buffer and decodes
+# from a view of it (what SynScanController uses), 'copy' reads a new bytes object per response.
+RECEIVE_PATHS = ("buffer", "copy")
+
+
+def runBenchmark(controller, build, iterations, warmup = 3, receive = "buffer"):
+
+    # Runs one benchmark and splits every iteration into its phases:
+    #   encode  building the request bytes
+    #   write   handing the request to the device
+    #   wait    waiting for and reading the response bytes
+    #   decode  turning the response into the API result
+
+    clock = time.perf_counter_ns
+    read = controller._read_into if receive == "buffer" else controller._read_binary
+    timings = {phase: [] for phase in PHASES}
+    errors = 0
+
+    for iteration in range(warmup + iterations):
+
+        t0 = clock()
+        transactions = build()
+        request = transactions[0].request if len(transactions) == 1 else b''.join(transaction.request for transaction in transactions)
+        t1 = clock()
+        controller._write_binary(request)
+        t2 = clock()
+
+        wait = 0
+        decode = 0
+        for transaction in transactions:
+            t3 = clock()
+            try:
+                response = read(transaction.expected_response_length, transaction.check_and_remove_trailing_hash)
+            except ProtocolError:
+                errors += 1
+                response = None
+            t4 = clock()
+            if response is not None:
+                try:
+                    transaction.decode(response)
+                except (ProtocolError, PassthroughError):
+                    errors += 1
+            t5 = clock()
+            wait += t4 - t3
+            decode += t5 - t4
+
+        t6 = clock()
+
+        if iteration >= warmup:
+            timings["encode"].append(t1 - t0)
+            timings["write"].append(t2 - t1)
+            timings["wait"].append(wait)
+            timings["decode"].append(decode)
+            timings["total"].append(t6 - t0)
+
+    elapsed = sum(timings["total"]) / 1e9
+    commands = iterations * len(build())
+
+    result = {phase: summarize(samples) for (phase, samples) in timings.items()}
+    result["iterations"] = iterations
+    result["commands_per_second"] = commands / elapsed if elapsed > 0 else None
+    result["errors"] = errors
+
+    result.update(runExecute(controller, build, iterations, warmup))
+
+    return result
+
+
+def runExecute(controller, build, iterations, warmup = 3):
+
+    # The same commands through the public controller.execute(), as applications call them:
+    # including capability checks, the response cache, adaptive deadlines and recovery.
+
+    clock = time.perf_counter_ns
+    samples = []
+    errors = 0
+    cacheHits = controller.cacheHitCount
+
+    for iteration in range(warmup + iterations):
+        if iteration == warmup:
+            cacheHits = controller.cacheHitCount
+        t0 = clock()
+        try:
+            controller.execute(*build())
+        except (ProtocolError, PassthroughError):
+            errors += 1
+        t1 = clock()
+        if iteration >= warmup:
+            samples.append(t1 - t0)
+
+    return {
+            "execute"        : summarize(samples),
+            "execute_errors" : errors,
+            "cache_hits"     : controller.cacheHitCount - cacheHits
+        }
+
+
+def compare(results, baseline, threshold):
+
+    # Reports the benchmarks whose median latency, on the wire ('total') or through the public
+    # API ('execute'), got worse by more than 'threshold' (a fraction).
+
+    regressions = []
+
+    for (name, result) in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        for metric in ("total", "execute"):
+            if metric not in previous or metric not in result:
+                continue
+            before = previous[metric]["p50_ms"]
+            after = result[metric]["p50_ms"]
+            if before > 0 and (after - before) / before > threshold:
+                regressions.append(("{} ({})".format(name, metric), before, after))
+
+    return regressions
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Latency and throughput benchmark for the SynScan protocol implementation.")
+    parser.add_argument("--port", help = "serial port or transport address (e.g. tcp://host:port) of a real hand controller (default: simulated hand controller)")
+    parser.add_argument("--iterations", type = int, default = 100)
+    parser.add_argument("--baudrate", type = int, default = 9600, help = "baud rate of the serial port or of the simulated link, 0 for an instant simulated link")
+    parser.add_argument("--response-delay", type = float, default = 0.0, help = "processing delay of the simulated hand controller, in seconds")
+    parser.add_argument("--receive", choices = RECEIVE_PATHS, default = "buffer", help = "receive path to measure (default: buffer)")
+    parser.add_argument("--benchmark", action = "append", choices = sorted(list(BENCHMARKS) + list(SETTER_BENCHMARKS)), help = "run only the given benchmark (repeatable)")
+    parser.add_argument("--setters", action = "store_true", help = "also run the benchmarks that change the mount's state on a real hand controller")
+    parser.add_argument("--output", help = "write the results as JSON to this file")
+    parser.add_argument("--baseline", help = "compare against the JSON results of an earlier run")
+    parser.add_argument("--threshold", type = float, default = 0.10, help = "relative p50 slowdown reported as regression")
+    args = parser.parse_args(argv)
+
+    controller = SynScanController()
+
+    if args.port:
+        controller.connect(args.port, baudrate = args.baudrate or 9600)
+        backend = args.port
+    else:
+        from SynScanSimulator import SimulatedDevice
+        controller.connect(SimulatedDevice(baudrate = args.baudrate or None, responseDelay = args.response_delay))
+        backend = "simulator"
+
+    benchmarks = dict(BENCHMARKS)
+    if args.setters or not args.port:
+        benchmarks.update(SETTER_BENCHMARKS)
+
+    names = args.benchmark or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            parser.error("{} changes the mount's state; add --setters to run it on a real hand controller".format(name))
+
+    results = {
+            "metadata": {
+                    "timestamp"      : datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "python"         : platform.python_version(),
+                    "platform"       : platform.platform(),
+                    "backend"        : backend,
+                    "baudrate"       : args.baudrate,
+                    "response_delay" : args.response_delay,
+                    "iterations"     : args.iterations,
+                    "receive"        : args.receive
+                },
+            "results": {}
+        }
+
+    try:
+        for name in names:
+            result = runBenchmark(controller, benchmarks[name], args.iterations, receive = args.receive)
+            results["results"][name] = result
+            print("{:<32} p50 {:8.3f} ms  p95 {:8.3f} ms  p99 {:8.3f} ms  {:8.1f} cmd/s  (encode {:.1f} / write {:.1f} / wait {:.1f} / decode {:.1f} us)  execute p50 {:8.3f} ms{}".format(
+                    name,
+                    result["total"]["p50_ms"], result["total"]["p95_ms"], result["total"]["p99_ms"],
+                    result["commands_per_second"],
+                    *(result[phase]["p50_ms"] * 1e3 for phase in ("encode", "write", "wait", "decode")),
+                    result["execute"]["p50_ms"],
+                    "  ({} cached)".format(result["cache_hits"]) if result["cache_hits"] else ""))
+    finally:
+        controller.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for (name, before, after) in regressions:
+            print("REGRESSION {}: p50 {:.3f} ms -> {:.3f} ms".format(name, before, after))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
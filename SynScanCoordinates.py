@@ -0,0 +1,177 @@
+import datetime
+
+import numpy as np
+
+from SynScanProtocol import ProtocolError, CoordinateMode, Transaction, Requests
+
+# Vectorised versions of the coordinate handling in SynScanProtocol, for planning many targets at
+# once. Angles are in degrees throughout (right ascension too, like the rest of the API); the hand
+# controller encodes them as fractions of a full turn in 16 bits, or 32 bits for the precise commands.
+
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype = np.uint8)
+
+# ASCII code -> nibble value, 255 for characters that are not hex digits.
+_NIBBLES = np.full(256, 255, dtype = np.uint8)
+for (_value, _character) in enumerate(b"0123456789abcdef"):
+    _NIBBLES[_character] = _value
+for (_value, _character) in enumerate(b"ABCDEF"):
+    _NIBBLES[_character] = _value + 10
+
+def _digits(highPrecisionFlag):
+    return 8 if highPrecisionFlag else 4
+
+
+def encodeAngles(degrees, highPrecisionFlag = True):
+    # Degrees -> integer fractions of a turn (uint32), wrapped into range.
+    bits = 4 * _digits(highPrecisionFlag)
+    fractions = np.round(np.asarray(degrees, dtype = np.float64) * ((1 << bits) / 360.0)).astype(np.int64)
+    return (fractions & ((1 << bits) - 1)).astype(np.uint32)
+
+def decodeAngles(fractions, highPrecisionFlag = True):
+    # Integer fractions of a turn -> degrees in [0, 360).
+    bits = 4 * _digits(highPrecisionFlag)
+    return np.asarray(fractions, dtype = np.float64) * (360.0 / (1 << bits))
+
+def _hex(fractions, digits):
+    # (n,) integers -> (n, digits) array of lower case ASCII hex digits.
+    shifts = np.arange(4 * (digits - 1), -1, -4, dtype = np.uint32)
+    return _HEX_DIGITS[(fractions[:, None] >> shifts) & 0xF]
+
+def encodeCoordinateRequests(command, firstCoordinates, secondCoordinates, highPrecisionFlag = True):
+
+    # Builds the request bytes "<command><first>,<second>" for every pair of coordinates, as one
+    # (n, 1 + 2 * digits + 1) uint8 array. Row i is the request for target i.
+
+    digits = _digits(highPrecisionFlag)
+    first = encodeAngles(np.atleast_1d(firstCoordinates), highPrecisionFlag)
+    second = encodeAngles(np.atleast_1d(secondCoordinates), highPrecisionFlag)
+
+    requests = np.empty((len(first), 2 + 2 * digits), dtype = np.uint8)
+    requests[:, 0] = ord(command.value)
+    requests[:, 1:1 + digits] = _hex(first, digits)
+    requests[:, 1 + digits] = ord(",")
+    requests[:, 2 + digits:] = _hex(second, digits)
+
+    return requests
+
+def gotoTransactions(firstCoordinates, secondCoordinates, coordinateMode = CoordinateMode.AZM_ALT, highPrecisionFlag = True):
+
+    # The same transactions Requests.gotoPosition() builds, for many targets at once. Command,
+    # response length and decoder are taken from a transaction Requests builds, only the request
+    # bytes are encoded here.
+
+    template = Requests.gotoPosition(0.0, 0.0, coordinateMode, highPrecisionFlag)
+    requests = encodeCoordinateRequests(template.command, firstCoordinates, secondCoordinates, highPrecisionFlag)
+
+    return [Transaction(template.command, row.tobytes(), template.expected_response_length, template.decode) for row in requests]
+
+def decodePositionResponses(responses, highPrecisionFlag = True):
+
+    # Decodes many getPosition() responses at once, e.g. recorded samples. 'responses' is a sequence
+    # of responses with or without the trailing hash, or a (n, length) uint8 array. Returns an
+    # (n, 2) array of angles in degrees.
+
+    digits = _digits(highPrecisionFlag)
+    length = 2 * digits + 1
+
+    if isinstance(responses, np.ndarray):
+        data = responses.astype(np.uint8, copy = False)
+    else:
+        responses = list(responses)
+        if not responses:
+            return np.empty((0, 2))
+        data = np.frombuffer(b"".join(responses), dtype = np.uint8).reshape(len(responses), -1)
+
+    if data.shape[1] not in (length, length + 1):
+        raise ProtocolError("decodePositionResponses() failed: unexpected response length ({})".format(data.shape[1]))
+
+    if np.any(data[:, digits] != ord(",")) or (data.shape[1] == length + 1 and np.any(data[:, length] != ord("#"))):
+        raise ProtocolError("decodePositionResponses() failed: malformed response")
+
+    nibbles = _NIBBLES[np.concatenate((data[:, :digits], data[:, digits + 1:length]), axis = 1)]
+    if np.any(nibbles == 255):
+        raise ProtocolError("decodePositionResponses() failed: response contains non-hex characters")
+
+    weights = (np.uint64(1) << np.arange(4 * (digits - 1), -1, -4, dtype = np.uint64))
+    nibbles = nibbles.astype(np.uint64)
+    fractions = np.stack((nibbles[:, :digits] @ weights, nibbles[:, digits:] @ weights), axis = 1)
+
+    return decodeAngles(fractions, highPrecisionFlag)
+
+
+# Equatorial <-> horizontal coordinates. Azimuth is measured from north through east, longitude is
+# positive east, timestamps are timezone-aware datetimes or POSIX timestamps (arrays allowed).
+
+def julianDate(timestamps):
+    if isinstance(timestamps, datetime.datetime):
+        timestamps = timestamps.timestamp()
+    return np.asarray(timestamps, dtype = np.float64) / 86400.0 + 2440587.5
+
+def localSiderealTime(timestamps, longitude):
+    # Mean local sidereal time, in degrees.
+    days = julianDate(timestamps) - 2451545.0
+    return (280.46061837 + 360.98564736629 * days + np.asarray(longitude, dtype = np.float64)) % 360.0
+
+def raDecToAzAlt(ra, dec, latitude, longitude, timestamps):
+
+    hourAngle = np.radians(localSiderealTime(timestamps, longitude) - np.asarray(ra, dtype = np.float64))
+    dec = np.radians(np.asarray(dec, dtype = np.float64))
+    latitude = np.radians(latitude)
+
+    altitude = np.arcsin(np.sin(dec) * np.sin(latitude) + np.cos(dec) * np.cos(latitude) * np.cos(hourAngle))
+    azimuth = np.arctan2(-np.sin(hourAngle) * np.cos(dec), np.cos(latitude) * np.sin(dec) - np.sin(latitude) * np.cos(dec) * np.cos(hourAngle))
+
+    return (np.degrees(azimuth) % 360.0, np.degrees(altitude))
+
+def azAltToRaDec(azimuth, altitude, latitude, longitude, timestamps):
+
+    azimuth = np.radians(np.asarray(azimuth, dtype = np.float64))
+    altitude = np.radians(np.asarray(altitude, dtype = np.float64))
+    latitude = np.radians(latitude)
+
+    dec = np.arcsin(np.sin(altitude) * np.sin(latitude) + np.cos(altitude) * np.cos(latitude) * np.cos(azimuth))
+    hourAngle = np.arctan2(-np.sin(azimuth) * np.cos(altitude), np.cos(latitude) * np.sin(altitude) - np.sin(latitude) * np.cos(altitude) * np.cos(azimuth))
+
+    ra = (localSiderealTime(timestamps, longitude) - np.degrees(hourAngle)) % 360.0
+
+    return (ra, np.degrees(dec))
+
+
+class MountFrame:
+
+    # Site and clock of one mount, read once from the hand controller (getLocation and getTime in a
+    # single pipelined burst), for converting many targets with the mount's own idea of where and
+    # when it is.
+
+    def __init__(self, latitude, longitude, clockOffset = 0.0):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.clockOffset = clockOffset # mount clock minus host clock, in seconds
+
+    @classmethod
+    def fromController(cls, controller):
+
+        ((latitude, longitude), (timestamp, dst)) = controller.execute(Requests.getLocation(), Requests.getTime())
+
+        # The zone sent by the hand controller is the standard time offset; with DST enabled its
+        # clock runs one hour ahead of that.
+        if dst:
+            timestamp -= datetime.timedelta(hours = 1)
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        return cls(latitude, longitude, (timestamp - now).total_seconds())
+
+    def timestamp(self, when = None):
+        # Host POSIX time (default: now) -> mount time.
+        if when is None:
+            when = datetime.datetime.now(datetime.timezone.utc)
+        if isinstance(when, datetime.datetime):
+            when = when.timestamp()
+        return np.asarray(when, dtype = np.float64) + self.clockOffset
+
+    def raDecToAzAlt(self, ra, dec, when = None):
+        return raDecToAzAlt(ra, dec, self.latitude, self.longitude, self.timestamp(when))
+
+    def azAltToRaDec(self, azimuth, altitude, when = None):
+        return azAltToRaDec(azimuth, altitude, self.latitude, self.longitude, self.timestamp(when))
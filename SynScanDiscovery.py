@@ -0,0 +1,77 @@
+import collections, concurrent.futures, random, time
+
+from SynScanProtocol import ProtocolError, Command, Model, Requests, SynScanController, Capabilities, MINIMUM_VERSIONS
+from SynScanFleet import discoverPorts
+
+# Result of probing one port. 'controller' is connected when the probe succeeded.
+ProbeResult = collections.namedtuple("ProbeResult", ["port", "controller", "capabilities", "roundTrip", "error"])
+
+
+def probePort(port, timeout = 0.250, controllerFactory = SynScanController):
+
+    # Opens the port and checks for a hand controller: an ECHO of a random byte and GET_VERSION in
+    # one burst, then GET_MODEL if the firmware has it. Every read is bounded by 'timeout', so a
+    # port with nothing (or something else) on it is given up quickly.
+
+    controller = controllerFactory()
+
+    try:
+        controller.connect(port, timeout)
+        started = time.monotonic()
+        (echo, version) = controller.execute(Requests.echo(random.randrange(256)), Requests.getVersion())
+        roundTrip = time.monotonic() - started
+
+        model = None
+        if version >= MINIMUM_VERSIONS[Command.GET_MODEL]:
+            model = controller.getModel()
+            try:
+                model = Model(model)
+            except ValueError:
+                pass
+
+    except Exception as exception:
+        try:
+            controller.close()
+        except Exception:
+            pass
+        return ProbeResult(port, None, None, None, exception)
+
+    capabilities = Capabilities(version, model)
+    controller.capabilities = capabilities
+
+    return ProbeResult(port, controller, capabilities, roundTrip, None)
+
+
+def probePorts(ports = None, timeout = 0.250, controllerFactory = SynScanController, match = None):
+
+    # Probes the given ports (default: all serial ports) in parallel; returns a ProbeResult per port.
+
+    if ports is None:
+        ports = discoverPorts(match)
+    if not ports:
+        return []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = len(ports)) as executor:
+        return list(executor.map(lambda port: probePort(port, timeout, controllerFactory), ports))
+
+
+def autoConnect(ports = None, timeout = 3.500, probeTimeout = 0.250, controllerFactory = SynScanController, match = None):
+
+    # Finds the hand controller among the candidate ports and returns its controller, connected and
+    # with its capabilities set. With several hand controllers, the fastest to answer wins; the
+    # other ports are closed again. 'timeout' is the read timeout for normal operation.
+
+    results = probePorts(ports, probeTimeout, controllerFactory, match)
+    found = sorted((result for result in results if result.error is None), key = lambda result: result.roundTrip)
+
+    if not found:
+        failures = ", ".join("{}: {}".format(result.port, result.error) for result in results) or "no serial ports"
+        raise ProtocolError("autoConnect() failed: no hand controller found ({})".format(failures))
+
+    for result in found[1:]:
+        result.controller.close()
+
+    controller = found[0].controller
+    controller.timeout = timeout
+
+    return controller
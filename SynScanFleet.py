@@ -0,0 +1,217 @@
+import collections, concurrent.futures, datetime, time
+
+from SynScanProtocol import UsageError, Command, CoordinateMode, TrackingMode, Requests, SynScanController
+from CommandArbiter import CommandArbiter, Priority
+from MountConfiguration import ConfigurationReport
+
+# Outcome of one broadcast on one mount: the list of results, or the exception that failed it.
+FleetResult = collections.namedtuple("FleetResult", ["results", "error"])
+
+MountStatus = collections.namedtuple("MountStatus", ["name", "timestamp", "position", "gotoInProgress", "trackingMode", "error"])
+
+
+def _trackingModeName(value):
+    # getTrackingMode() returns the raw mode byte.
+    try:
+        return TrackingMode(value).name
+    except ValueError:
+        return str(value)
+
+
+def discoverPorts(match = None):
+
+    # Serial ports found by serial.tools.list_ports; 'match' (a string) keeps only the ports whose
+    # device name, description or hardware id contain it, e.g. the USB id of the hand controllers.
+
+    import serial.tools.list_ports # not needed until ports are enumerated
+
+    ports = []
+    for port in serial.tools.list_ports.comports():
+        if match is None or any(match in (text or "") for text in (port.device, port.description, port.hwid)):
+            ports.append(port.device)
+    return sorted(ports)
+
+
+class SynScanFleet:
+
+    # Drives several mounts at once. Every mount gets its own controller and CommandArbiter, so each
+    # port has its own I/O thread: a broadcast submits to all arbiters first and only then waits, and
+    # the mounts answer in parallel. Sending the time to ten mounts takes about one round trip.
+
+    def __init__(self, controllerFactory = SynScanController, timeout = 3.500):
+        self._controllerFactory = controllerFactory
+        self._timeout = timeout
+        self._mounts = collections.OrderedDict() # name -> CommandArbiter
+
+    @property
+    def names(self):
+        return list(self._mounts)
+
+    def __len__(self):
+        return len(self._mounts)
+
+    def add(self, name, controller):
+        # Adds a controller that is already connected, e.g. to a simulator.
+        if name in self._mounts:
+            raise UsageError("add() failed: mount {} already in fleet".format(repr(name)))
+        arbiter = CommandArbiter(controller)
+        arbiter.start()
+        self._mounts[name] = arbiter
+
+    def open(self, ports = None, match = None):
+
+        # Connects to the given ports (default: all discovered ports) in parallel and adds the mounts
+        # that answer. Returns a dict port -> exception for the ports that could not be opened.
+
+        if ports is None:
+            ports = discoverPorts(match)
+
+        def connect(port):
+            controller = self._controllerFactory()
+            controller.connect(port, self._timeout)
+            try:
+                # Make sure there is a hand controller on the other end.
+                controller.getVersion()
+            except Exception:
+                controller.close()
+                raise
+            return controller
+
+        failures = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, len(ports))) as executor:
+            futures = {port: executor.submit(connect, port) for port in ports if port not in self._mounts}
+            for (port, future) in futures.items():
+                try:
+                    self.add(port, future.result())
+                except Exception as exception:
+                    failures[port] = exception
+
+        return failures
+
+    def remove(self, name):
+        arbiter = self._mounts.pop(name)
+        arbiter.stop()
+        arbiter.controller.close()
+
+    def close(self):
+        for name in list(self._mounts):
+            self.remove(name)
+
+    def client(self, name, priority = Priority.COMMAND):
+        # Controller-like access to one mount, sharing its I/O thread with the broadcasts.
+        return self._mounts[name].client(priority)
+
+    def broadcast(self, transactions, priority = Priority.COMMAND, names = None, timeout = None):
+
+        # Executes the transactions on every mount (or the named ones) in parallel. 'transactions'
+        # is a list of transactions, or a function name -> list of transactions. Returns a dict
+        # name -> FleetResult; a mount that fails does not affect the others.
+
+        names = self.names if names is None else list(names)
+
+        futures = {}
+        results = collections.OrderedDict()
+
+        for name in names:
+            try:
+                requests = transactions(name) if callable(transactions) else transactions
+                futures[name] = self._mounts[name].submit(requests, priority)
+            except Exception as exception:
+                results[name] = FleetResult(None, exception)
+
+        concurrent.futures.wait(futures.values(), timeout = timeout)
+
+        for name in names:
+            if name in results:
+                continue
+            future = futures[name]
+            if not future.done():
+                results[name] = FleetResult(None, concurrent.futures.TimeoutError("no response within {} s".format(timeout)))
+            elif future.exception() is not None:
+                results[name] = FleetResult(None, future.exception())
+            else:
+                results[name] = FleetResult(future.result(), None)
+
+        return results
+
+    # Group operations
+
+    def cancelGotoAll(self, timeout = None):
+        return self.broadcast([Requests.cancelGoto()], Priority.STOP, timeout = timeout)
+
+    def parkAll(self, azimuth = 0.0, altitude = 0.0, timeout = None):
+        # Stops tracking and slews to the park position, in mount (azimuth/altitude) coordinates.
+        return self.broadcast([Requests.setTrackingMode(TrackingMode.OFF), Requests.gotoPosition(azimuth, altitude, CoordinateMode.AZM_ALT)], timeout = timeout)
+
+    def setTimeAll(self, timestamp = None, dst = False, timeout = None):
+        # One request for all mounts, so that they agree on the time (default: now, local time zone).
+        if timestamp is None:
+            timestamp = datetime.datetime.now(datetime.timezone.utc).astimezone()
+        return self.broadcast([Requests.setTime(timestamp, dst)], timeout = timeout)
+
+    def setLocationAll(self, latitude, longitude, timeout = None):
+        return self.broadcast([Requests.setLocation(latitude, longitude)], timeout = timeout)
+
+    def setTrackingModeAll(self, tracking_mode, timeout = None):
+        return self.broadcast([Requests.setTrackingMode(tracking_mode)], timeout = timeout)
+
+    def configureAll(self, configuration, timeout = None):
+
+        # Brings every mount into a MountConfiguration: all mounts are read in parallel, then each
+        # gets only the setters it needs (plus verification reads), again in parallel. Returns a
+        # dict name -> FleetResult whose results are ConfigurationReports.
+
+        for arbiter in self._mounts.values():
+            arbiter.invalidate(Command.GET_LOCATION, Command.GET_TRACKING_MODE, Command.GET_TIME)
+
+        reads = self.broadcast(configuration.readTransactions(), Priority.COMMAND, timeout = timeout)
+
+        changes = {}
+        results = collections.OrderedDict()
+        for (name, (values, error)) in reads.items():
+            if error is not None:
+                results[name] = FleetResult(None, error)
+            else:
+                changes[name] = configuration.diff(values)
+                if not changes[name]:
+                    results[name] = FleetResult(ConfigurationReport([], []), None)
+
+        pending = [name for name in changes if changes[name]]
+        if pending:
+            writes = self.broadcast(lambda name: configuration.setterTransactions(changes[name]), Priority.COMMAND, pending, timeout)
+            for (name, (values, error)) in writes.items():
+                if error is not None:
+                    results[name] = FleetResult(None, error)
+                else:
+                    results[name] = FleetResult(ConfigurationReport(changes[name], configuration.verify(changes[name], values)), None)
+
+        return collections.OrderedDict((name, results[name]) for name in reads)
+
+    def statusAll(self, coordinateMode = CoordinateMode.RA_DEC, timeout = None):
+
+        # Position, goto and tracking state of every mount, each read in one pipelined burst.
+
+        transactions = [Requests.getPosition(coordinateMode, highPrecisionFlag = True), Requests.getGotoInProgress(), Requests.getTrackingMode()]
+        results = self.broadcast(transactions, Priority.TELEMETRY, timeout = timeout)
+        timestamp = time.time()
+
+        status = collections.OrderedDict()
+        for (name, (values, error)) in results.items():
+            if error is not None:
+                status[name] = MountStatus(name, timestamp, None, None, None, error)
+            else:
+                (position, gotoInProgress, trackingMode) = values
+                status[name] = MountStatus(name, timestamp, position, gotoInProgress, trackingMode, None)
+
+        return status
+
+    @staticmethod
+    def summary(status):
+        lines = ["{:<24} {:>22} {:>6} {:<10} {}".format("mount", "position", "goto", "tracking", "error")]
+        for mount in status.values():
+            position = "({:.4f}, {:.4f})".format(*mount.position) if mount.position is not None else "-"
+            goto = "-" if mount.gotoInProgress is None else ("yes" if mount.gotoInProgress else "no")
+            tracking = "-" if mount.trackingMode is None else _trackingModeName(mount.trackingMode)
+            lines.append("{:<24} {:>22} {:>6} {:<10} {}".format(mount.name, position, goto, tracking, "" if mount.error is None else repr(mount.error)))
+        return "\n".join(lines)
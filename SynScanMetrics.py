@@ -0,0 +1,172 @@
+import bisect, threading
+
+from SynScanProtocol import ResponseTimeoutError
+
+# Upper bounds of the latency histogram buckets, in seconds. At 9600 baud a byte takes about 1 ms,
+# so the interesting range is a few milliseconds to a few hundred.
+LATENCY_BUCKETS = (0.002, 0.005, 0.010, 0.020, 0.050, 0.100, 0.200, 0.500, 1.0, 2.0, 5.0)
+
+
+class _Histogram:
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1) # last bucket: +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def copy(self):
+        histogram = _Histogram()
+        histogram.counts = list(self.counts)
+        histogram.total = self.total
+        histogram.count = self.count
+        return histogram
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile (None for +Inf or an empty histogram).
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for (bound, count) in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+
+class Metrics:
+
+    # Counters and latency histograms for one SynScanController, enabled by assigning an instance to
+    # controller.metrics. The controller calls observe()/protocolError()/passthroughFailure() and
+    # sent()/received() from its I/O thread; snapshot() and prometheus() may be called from any
+    # thread. Without metrics, the controller pays one 'is not None' check per hook.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}          # Command -> _Histogram
+        self._protocolErrors = {}     # (Command, kind) -> count
+        self._passthroughFailures = {} # AxisId -> count
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    # Hooks
+
+    def sent(self, length):
+        self.bytesSent += length
+
+    def received(self, length):
+        self.bytesReceived += length
+
+    def observe(self, command, seconds):
+        with self._lock:
+            histogram = self._latencies.get(command)
+            if histogram is None:
+                histogram = self._latencies[command] = _Histogram()
+            histogram.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram.total += seconds
+            histogram.count += 1
+
+    def protocolError(self, command, exception):
+        key = (command, "timeout" if isinstance(exception, ResponseTimeoutError) else "malformed")
+        with self._lock:
+            self._protocolErrors[key] = self._protocolErrors.get(key, 0) + 1
+
+    def passthroughFailure(self, axisId):
+        with self._lock:
+            self._passthroughFailures[axisId] = self._passthroughFailures.get(axisId, 0) + 1
+
+    # Queries
+
+    def reset(self):
+        with self._lock:
+            self._latencies = {}
+            self._protocolErrors = {}
+            self._passthroughFailures = {}
+            self.bytesSent = 0
+            self.bytesReceived = 0
+
+    def latency(self, command):
+        # (count, mean, median, 99th percentile) of one command; the percentiles are bucket bounds.
+        with self._lock:
+            histogram = self._latencies.get(command)
+            histogram = histogram.copy() if histogram is not None else _Histogram()
+        mean = histogram.total / histogram.count if histogram.count else None
+        return (histogram.count, mean, histogram.quantile(0.5), histogram.quantile(0.99))
+
+    def snapshot(self):
+
+        with self._lock:
+            latencies = {command: histogram.copy() for (command, histogram) in self._latencies.items()}
+            protocolErrors = dict(self._protocolErrors)
+            passthroughFailures = dict(self._passthroughFailures)
+
+        commands = {}
+        for (command, histogram) in latencies.items():
+            commands[command.name] = {
+                    "count"   : histogram.count,
+                    "sum"     : histogram.total,
+                    "mean"    : histogram.total / histogram.count if histogram.count else None,
+                    "p50"     : histogram.quantile(0.5),
+                    "p99"     : histogram.quantile(0.99),
+                    "buckets" : dict(zip(LATENCY_BUCKETS + (float("inf"), ), histogram.counts))
+                }
+
+        return {
+                "bytesSent"           : self.bytesSent,
+                "bytesReceived"       : self.bytesReceived,
+                "commands"            : commands,
+                "protocolErrors"      : {"{}/{}".format(command.name, kind): count for ((command, kind), count) in protocolErrors.items()},
+                "passthroughFailures" : {axisId.name: count for (axisId, count) in passthroughFailures.items()}
+            }
+
+    def prometheus(self, prefix = "synscan", labels = None):
+
+        # Text exposition format. 'labels' is a dict of extra labels for every sample, e.g. the port.
+
+        with self._lock:
+            latencies = {command: histogram.copy() for (command, histogram) in self._latencies.items()}
+            protocolErrors = dict(self._protocolErrors)
+            passthroughFailures = dict(self._passthroughFailures)
+
+        common = "".join(',{}="{}"'.format(name, value) for (name, value) in sorted((labels or {}).items()))
+
+        def selector(*pairs):
+            text = ",".join('{}="{}"'.format(name, value) for (name, value) in pairs) + common
+            return "{" + text.lstrip(",") + "}" if text else ""
+
+        lines = []
+
+        lines.append("# HELP {}_bytes_sent_total Bytes written to the hand controller.".format(prefix))
+        lines.append("# TYPE {}_bytes_sent_total counter".format(prefix))
+        lines.append("{}_bytes_sent_total{} {}".format(prefix, selector(), self.bytesSent))
+
+        lines.append("# HELP {}_bytes_received_total Bytes read from the hand controller.".format(prefix))
+        lines.append("# TYPE {}_bytes_received_total counter".format(prefix))
+        lines.append("{}_bytes_received_total{} {}".format(prefix, selector(), self.bytesReceived))
+
+        name = "{}_command_latency_seconds".format(prefix)
+        lines.append("# HELP {} Time from writing a request until its response was read.".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for (command, histogram) in sorted(latencies.items(), key = lambda item: item[0].name):
+            cumulative = 0
+            for (bound, count) in zip(LATENCY_BUCKETS + (float("inf"), ), histogram.counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(name, selector(("command", command.name), ("le", "+Inf" if bound == float("inf") else repr(bound))), cumulative))
+            lines.append("{}_sum{} {!r}".format(name, selector(("command", command.name)), histogram.total))
+            lines.append("{}_count{} {}".format(name, selector(("command", command.name)), histogram.count))
+
+        name = "{}_protocol_errors_total".format(prefix)
+        lines.append("# HELP {} Responses that timed out or were malformed.".format(name))
+        lines.append("# TYPE {} counter".format(name))
+        for ((command, kind), count) in sorted(protocolErrors.items(), key = lambda item: (item[0][0].name, item[0][1])):
+            lines.append("{}{} {}".format(name, selector(("command", command.name), ("kind", kind)), count))
+
+        name = "{}_passthrough_failures_total".format(prefix)
+        lines.append("# HELP {} Passthrough requests the motor controller did not answer.".format(name))
+        lines.append("# TYPE {} counter".format(name))
+        for (axisId, count) in sorted(passthroughFailures.items(), key = lambda item: item[0].name):
+            lines.append("{}{} {}".format(name, selector(("axis", axisId.name)), count))
+
+        return "\n".join(lines) + "\n"
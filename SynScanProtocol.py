@@ -1,4 +1,4 @@
-import serial, datetime
+import binascii, collections, datetime, math, struct, time
 from enum import Enum
 
 class UsageError(Exception):
@@ -10,6 +10,16 @@ class ProtocolError(Exception):
 class PassthroughError(Exception):
     pass
 
+class UnsupportedCommandError(UsageError):
+    pass
+
+class ResponseTimeoutError(ProtocolError):
+    # The response did not arrive completely before the read deadline; 'response' holds the bytes
+    # that did arrive.
+    def __init__(self, message, response = b''):
+        super(ResponseTimeoutError, self).__init__(message)
+        self.response = response
+
 class Model(Enum):
     gps_series  =  1
     i_series    =  3
@@ -49,6 +59,48 @@ class Command(Enum):
     CANCEL_GOTO                   = 'M' # 1.2+
     PASSTHROUGH                   = 'P' # 1.6+ this includes slewing commands, 'get device version' commands, GPS commands, and RTC commands
 
+# Oldest hand controller firmware version supporting each command, as (major, minor).
+MINIMUM_VERSIONS = {
+        Command.GET_POSITION_RA_DEC           : (1,  2),
+        Command.GET_POSITION_RA_DEC_PRECISE   : (1,  6),
+        Command.GET_POSITION_AZM_ALT          : (1,  2),
+        Command.GET_POSITION_AZM_ALT_PRECISE  : (2,  2),
+        Command.GOTO_POSITION_RA_DEC          : (1,  2),
+        Command.GOTO_POSITION_RA_DEC_PRECISE  : (1,  6),
+        Command.GOTO_POSITION_AZM_ALT         : (1,  2),
+        Command.GOTO_POSITION_AZM_ALT_PRECISE : (2,  2),
+        Command.SYNC                          : (4, 10),
+        Command.SYNC_PRECISE                  : (4, 10),
+        Command.GET_TRACKING_MODE             : (2,  3),
+        Command.SET_TRACKING_MODE             : (1,  6),
+        Command.GET_LOCATION                  : (2,  3),
+        Command.SET_LOCATION                  : (2,  3),
+        Command.GET_TIME                      : (2,  3),
+        Command.SET_TIME                      : (2,  3),
+        Command.GET_VERSION                   : (1,  2),
+        Command.GET_MODEL                     : (2,  2),
+        Command.ECHO                          : (1,  2),
+        Command.GET_ALIGNMENT_COMPLETE        : (1,  2),
+        Command.GET_GOTO_IN_PROGRESS          : (1,  2),
+        Command.CANCEL_GOTO                   : (1,  2),
+        Command.PASSTHROUGH                   : (1,  6)
+    }
+
+# Commands that only query the hand controller; their responses may be shared between clients.
+READ_ONLY_COMMANDS = frozenset([
+        Command.GET_POSITION_RA_DEC,
+        Command.GET_POSITION_RA_DEC_PRECISE,
+        Command.GET_POSITION_AZM_ALT,
+        Command.GET_POSITION_AZM_ALT_PRECISE,
+        Command.GET_TRACKING_MODE,
+        Command.GET_LOCATION,
+        Command.GET_TIME,
+        Command.GET_VERSION,
+        Command.GET_MODEL,
+        Command.GET_ALIGNMENT_COMPLETE,
+        Command.GET_GOTO_IN_PROGRESS
+    ])
+
 class PassthroughCommand(Enum):
     MOTOR_SLEW_POSITIVE_VARIABLE_RATE =   6
     MOTOR_SLEW_NEGATIVE_VARIABLE_RATE =   7
@@ -70,214 +122,293 @@ class AxisId(Enum):
     AZM_RA_MOTOR  = 16
     ALT_DEC_MOTOR = 17
 
+# Time to live of cached responses, in seconds, per command (PassthroughCommand for passthrough
+# requests). Only these responses are cached; see SynScanController.invalidate().
+CACHE_TIME_TO_LIVE = {
+        Command.GET_VERSION                   : math.inf,
+        Command.GET_MODEL                     : math.inf,
+        PassthroughCommand.GET_DEVICE_VERSION : math.inf,
+        Command.GET_LOCATION                  : 60.0,
+        Command.GET_ALIGNMENT_COMPLETE        : 5.0
+    }
+
+# Cached responses each setter makes stale.
+CACHE_INVALIDATIONS = {
+        Command.SET_LOCATION      : (Command.GET_LOCATION, ),
+        Command.SET_TIME          : (Command.GET_TIME, ),
+        Command.SET_TRACKING_MODE : (Command.GET_TRACKING_MODE, ),
+        Command.SYNC              : (Command.GET_ALIGNMENT_COMPLETE, ),
+        Command.SYNC_PRECISE      : (Command.GET_ALIGNMENT_COMPLETE, )
+    }
+
+# Approximate motor speeds of the fixed slew rates 0 .. 9, in degrees / second.
+FIXED_SLEW_RATES = (0.0, 0.0083, 0.0167, 0.0333, 0.0667, 0.1333, 0.5, 1.0, 2.0, 4.0)
+
+# Apparent rotation of the sky, in degrees / second.
+SIDEREAL_RATE = 360.0 / 86164.0905
+
+
+class Transaction:
+
+    # A single request/response exchange with the hand controller. The response of every SynScan
+    # command has a fixed length, so a transaction knows up front how many bytes to read back.
+    # 'decode' turns the raw response (trailing hash removed) into the value returned by the API.
+    # The controller passes it a memoryview of its receive buffer, which the next read overwrites:
+    # decoders return numbers or copies, never the view itself.
+
+    __slots__ = ("command", "request", "expected_response_length", "check_and_remove_trailing_hash", "decode", "axisId")
+
+    def __init__(self, command, request, expected_response_length, decode = None, check_and_remove_trailing_hash = True, axisId = None):
+        self.command                        = command
+        self.request                        = request
+        self.expected_response_length       = expected_response_length
+        self.check_and_remove_trailing_hash = check_and_remove_trailing_hash
+        self.decode                         = decode
+        self.axisId                         = axisId # set for passthrough commands only
 
-class SynScanController:
+    def __repr__(self):
+        return "Transaction({}, {!r}, {})".format(self.command.name, self.request, self.expected_response_length)
 
-    def __init__(self):
-        self._device = None
 
-    def connect(self, port):
-        if isinstance(port, str):
-            device = serial.Serial(
-                    port             = port,
-                    baudrate         = 9600,
-                    bytesize         = serial.EIGHTBITS,
-                    parity           = serial.PARITY_NONE,
-                    stopbits         = serial.STOPBITS_ONE,
-                    timeout          = 3.500,
-                    xonxoff          = 0,
-                    rtscts           = False,
-                    writeTimeout     = None,
-                    dsrdtr           = False,
-                    interCharTimeout = None
-                )
-            self._device = device
-        else:
-            raise UsageError("")
+def _decode_none(response):
+    # Response is a single hash ('#') character. Drop it.
+    return None
 
-    @property
-    def device(self):
-        return self._device
+def _decode_first_byte(response):
+    return response[0]
 
-    def close(self):
-        if self._device != None:
-            return self._device.close()
+# Precompiled response layouts of the position commands, the counterpart of the request encoders:
+# two hex fields and a comma. 'text' splits the fields off the receive buffer, binascii turns the
+# hex digits into bytes (a table lookup per digit, in C, rejecting anything that is not a hex
+# digit) and 'binary' unpacks those bytes as the two integers; 'denominator' is one full turn.
+_PositionLayout = collections.namedtuple("_PositionLayout", ["text", "binary", "denominator"])
 
-    def _write_binary(self, request):
-        return self._device.write(request)
+_POSITION_LAYOUT         = _PositionLayout(struct.Struct("4sc4s"), struct.Struct(">HH"), 0x10000)
+_POSITION_LAYOUT_PRECISE = _PositionLayout(struct.Struct("8sc8s"), struct.Struct(">II"), 0x100000000)
 
-    @staticmethod
-    def _to_bytes(arg):
+_POSITION_LAYOUTS = {
+        Command.GET_POSITION_RA_DEC          : _POSITION_LAYOUT,
+        Command.GET_POSITION_RA_DEC_PRECISE  : _POSITION_LAYOUT_PRECISE,
+        Command.GET_POSITION_AZM_ALT         : _POSITION_LAYOUT,
+        Command.GET_POSITION_AZM_ALT_PRECISE : _POSITION_LAYOUT_PRECISE
+    }
 
-        if isinstance(arg, Command) or isinstance(arg, TrackingMode) or isinstance(arg, AxisId) or isinstance (arg, PassthroughCommand):
-           arg = arg.value
+def _decode_position(layout):
 
-        if isinstance(arg, int):
-            arg = bytes([arg])
+    (text, binary, denominator) = layout
+    scale = 360.0 / denominator
+    unpack_text = text.unpack_from
+    unpack_binary = binary.unpack
+    unhexlify = binascii.unhexlify
 
-        if isinstance(arg, str):
-            arg = bytes(arg, "ascii")
+    def decode(response):
+        if len(response) == text.size:
+            (first, separator, second) = unpack_text(response)
+            if separator == b",":
+                try:
+                    (first, second) = unpack_binary(unhexlify(first + second))
+                except binascii.Error:
+                    pass
+                else:
+                    return (first * scale, second * scale)
+        raise ProtocolError("getPosition() failed: unexpected response ({})".format(repr(bytes(response))))
 
-        if not isinstance(arg, bytes):
-            arg = b''.join(SynScanController._to_bytes(e) for e in arg)
+    return decode
 
-        return arg
+def _decode_location(response):
 
-    def _write(self, *args):
-        msg = SynScanController._to_bytes(args)
-        # print("message to be written:", msg)
-        return self._write_binary(msg)
+    latitude_degrees = response[0]
+    latitude_minutes = response[1]
+    latitude_seconds = response[2]
+    latitude_sign    = response[3] # 0 == north, 1 == south
 
-    def _read_binary(self, expected_response_length, check_and_remove_trailing_hash = True):
+    longitude_degrees = response[4]
+    longitude_minutes = response[5]
+    longitude_seconds = response[6]
+    longitude_sign    = response[7] # 0 == east, 1 == west
 
-        if not (isinstance(expected_response_length, int) and expected_response_length > 0):
-            raise UsageError("_read_binary() failed: incorrect value for parameter 'expected_response_length': {}".format(repr(expected_response_length)))
+    latitude_seconds = latitude_degrees * 3600 + latitude_minutes * 60 + latitude_seconds
+    if latitude_sign != 0:
+        latitude_seconds = -latitude_seconds
 
-        if not isinstance(check_and_remove_trailing_hash, bool):
-            raise UsageError("_read_binary() failed: incorrect value for parameter 'check_and_remove_trailing_hash': {}".format(repr(check_and_remove_trailing_hash)))
+    longitude_seconds = longitude_degrees * 3600 + longitude_minutes * 60 + longitude_seconds
+    if longitude_sign != 0:
+        longitude_seconds = -longitude_seconds
 
-        response = self._device.read(expected_response_length)
+    latitude = latitude_seconds / 3600.0
+    longitude = longitude_seconds / 3600.0
 
-        if len(response) != expected_response_length:
-            raise ProtocolError("read_binary() failed: actual response length ({}) not equal to expected response length ({})".format(len(response), expected_response_length))
+    return (latitude, longitude)
 
-        if check_and_remove_trailing_hash:
-            if not response.endswith(b'#'):
-                print(response)
-                raise ProtocolError("read_binary() failed: response does not end with hash character (ASCII 35)")
-            # remove the trailing hash character.
-            response = response[:-1]
+def _decode_time(response):
 
-        return response
+    hour   = response[0] # 24 hour clock
+    minute = response[1]
+    second = response[2]
+    month  = response[3] # jan == 1, dec == 12
+    day    = response[4] # 1 .. 31
+    year   = response[5] # year minus 2000
+    zone   = response[6] # 2-complement of timezone (hour offset from UTC)
+    dst    = response[7] # 1 to enable DST, 0 for standard time.
 
-    def _read_ascii(self, expected_response_length, check_and_remove_trailing_hash = True):
-        response = self._read_binary(expected_response_length, check_and_remove_trailing_hash)
-        response = response.decode("ascii")
-        return response
+    year += 2000
 
-    # Public API starts here
+    if zone >= 128: # take care of negative zone offsets
+        zone -= 256
 
-    def getPosition(self, coordinateMode = CoordinateMode.RA_DEC, highPrecisionFlag = False):
+    zone = datetime.timedelta(hours = zone)
 
-        if highPrecisionFlag:
-            command = Command.GET_POSITION_AZM_ALT_PRECISE if (coordinateMode == CoordinateMode.AZM_ALT) else Command.GET_POSITION_RA_DEC_PRECISE
-            expected_response_length = 8 + 1 + 8 + 1
-            denominator = 0x100000000
-        else:
-            command = Command.GET_POSITION_AZM_ALT if (coordinateMode == CoordinateMode.AZM_ALT) else Command.GET_POSITION_RA_DEC
-            expected_response_length = 4 + 1 + 4 + 1
-            denominator = 0x10000
+    dst = (dst != 0)
 
-        self._write(command)
+    tzinfo = datetime.timezone(zone) # simple timezone with offset relative to UTC
+    timestamp = datetime.datetime(year, month, day, hour, minute, second, 0, tzinfo)
 
-        response = self._read_ascii(expected_response_length = expected_response_length, check_and_remove_trailing_hash = True)
-        response = response.split(",")
-        if not (len(response) == 2):
-            raise ProtocolError("getPosition() failed: unexpected response ({})".format(response))
+    return (timestamp, dst)
 
-        response = (360.0 * int(response[0], 16) / float(denominator), 360.0 * int(response[1], 16) / float(denominator))
-        return response
+def _decode_version(response):
+    return (response[0], response[1])
 
-    def gotoPosition(self, firstCoordinate, secondCoordinate, coordinateMode = CoordinateMode.AZM_ALT, highPrecisionFlag = True):
+def _decode_echo(c):
 
-        # Initiate a "GoTo" command.
+    def decode(response):
+        response = response[0]
+        if not(response == c):
+            raise ProtocolError("echo() failed: unexpected response ({})".format(repr(response)))
+        return None
 
-        if highPrecisionFlag:
-            command = Command.GOTO_POSITION_AZM_ALT_PRECISE if (coordinateMode == CoordinateMode.AZM_ALT) else Command.GOTO_POSITION_RA_DEC_PRECISE
-            firstCoordinate  = round(firstCoordinate  / 360.0 * 0x100000000)
-            secondCoordinate = round(secondCoordinate / 360.0 * 0x100000000)
-            coordinates = "{:08x},{:08x}".format(firstCoordinate, secondCoordinate)
-        else:
-            command = Command.GOTO_POSITION_AZM_ALT if (coordinateMode == CoordinateMode.AZM_ALT) else Command.GOTO_POSITION_RA_DEC
-            firstCoordinate  = round(firstCoordinate  / 360.0 * 0x10000)
-            secondCoordinate = round(secondCoordinate / 360.0 * 0x10000)
-            coordinates = "{:04x},{:04x}".format(firstCoordinate, secondCoordinate)
+    return decode
 
-        self._write(command, coordinates)
+def _decode_alignment_complete(response):
+    response = response[0]
+    if not response in [0, 1]:
+        raise ProtocolError("getAlignmentComplete() failed: unexpected response ({})".format(repr(response)))
+    return (response == 1) # convert to bool
 
-        # Response is a single hash ('#') character. Drop it.
-        response = self._read_binary(expected_response_length = 0 + 1, check_and_remove_trailing_hash = True)
+def _decode_goto_in_progress(response):
+    response = response[0]
+    # Response should be ASCII '0' or '1'
+    if not response in [0x30, 0x31]:
+        raise ProtocolError("getGotoInProgress() failed: unexpected response ({})".format(repr(chr(response))))
+    return (response == 0x31) # convert to bool
 
-        return None
+def _decode_raw(response):
+    return bytes(response)
 
-    def sync(self, firstCoordinate, secondCoordinate, highPrecisionFlag = True):
 
-        # sync always works in RA/DEC coordinates
+# Precompiled request encoders. Requests without arguments are constant, all others are packed by
+# a struct (or a bytes format string) per command, so building a request allocates the request
+# bytes and nothing else. SynScanController._to_bytes() remains the generic fallback for
+# arbitrary passthrough payloads and _write().
 
-        if highPrecisionFlag:
-            command = Command.SYNC_PRECISE
-            firstCoordinate  = round(firstCoordinate  / 360.0 * 0x100000000)
-            secondCoordinate = round(secondCoordinate / 360.0 * 0x100000000)
-            coordinates = "{}{:08x},{:08x}".format(firstCoordinate, secondCoordinate)
-        else:
-            command = Command.SYNC
-            firstCoordinate  = round(firstCoordinate  / 360.0 * 0x10000)
-            secondCoordinate = round(secondCoordinate / 360.0 * 0x10000)
-            coordinates = "{}{:04x},{:04x}".format(firstCoordinate, secondCoordinate)
+_SINGLE_BYTE_REQUEST = {command: bytes(command.value, "ascii") for command in Command}
 
-        self._write(command, coordinates)
+_PRECISE_COORDINATES_REQUEST = b"%c%08x,%08x"
+_COORDINATES_REQUEST         = b"%c%04x,%04x"
 
-        # Response is a single hash ('#') character. Drop it.
-        response = self._read_binary(expected_response_length = 0 + 1, check_and_remove_trailing_hash = True)
+_COMMAND_AND_BYTE_REQUEST = struct.Struct(">cB")     # ECHO, SET_TRACKING_MODE
+_EIGHT_BYTES_REQUEST      = struct.Struct(">c8B")    # SET_LOCATION, SET_TIME
+_PASSTHROUGH_REQUEST      = struct.Struct(">c7B")    # 'P', length, destination, id, 3 data bytes, response length
 
-        return None
+_PASSTHROUGH = bytes(Command.PASSTHROUGH.value, "ascii")
 
-    def getTrackingMode(self):
 
-        command = Command.GET_TRACKING_MODE
-        self._write(command)
 
-        response = self._read_binary(expected_response_length = 1 + 1, check_and_remove_trailing_hash = True)
+def _constant_transaction(command, expected_response_length, decode):
+    return Transaction(command, _SINGLE_BYTE_REQUEST[command], expected_response_length, decode)
 
-        tracking_mode = response[0]
+# Transactions of the commands without arguments are immutable and built only once.
+_GET_POSITION = {
+        (CoordinateMode.RA_DEC,  False) : _constant_transaction(Command.GET_POSITION_RA_DEC,          4 + 1 + 4 + 1, _decode_position(_POSITION_LAYOUTS[Command.GET_POSITION_RA_DEC])),
+        (CoordinateMode.RA_DEC,  True)  : _constant_transaction(Command.GET_POSITION_RA_DEC_PRECISE,  8 + 1 + 8 + 1, _decode_position(_POSITION_LAYOUTS[Command.GET_POSITION_RA_DEC_PRECISE])),
+        (CoordinateMode.AZM_ALT, False) : _constant_transaction(Command.GET_POSITION_AZM_ALT,         4 + 1 + 4 + 1, _decode_position(_POSITION_LAYOUTS[Command.GET_POSITION_AZM_ALT])),
+        (CoordinateMode.AZM_ALT, True)  : _constant_transaction(Command.GET_POSITION_AZM_ALT_PRECISE, 8 + 1 + 8 + 1, _decode_position(_POSITION_LAYOUTS[Command.GET_POSITION_AZM_ALT_PRECISE]))
+    }
 
-        return tracking_mode
+_GET_TRACKING_MODE      = _constant_transaction(Command.GET_TRACKING_MODE,      1 + 1, _decode_first_byte)
+_GET_LOCATION           = _constant_transaction(Command.GET_LOCATION,           8 + 1, _decode_location)
+_GET_TIME               = _constant_transaction(Command.GET_TIME,               8 + 1, _decode_time)
+_GET_VERSION            = _constant_transaction(Command.GET_VERSION,            2 + 1, _decode_version)
+_GET_MODEL              = _constant_transaction(Command.GET_MODEL,              1 + 1, _decode_first_byte)
+_GET_ALIGNMENT_COMPLETE = _constant_transaction(Command.GET_ALIGNMENT_COMPLETE, 1 + 1, _decode_alignment_complete)
+_GET_GOTO_IN_PROGRESS   = _constant_transaction(Command.GET_GOTO_IN_PROGRESS,   1 + 1, _decode_goto_in_progress)
+_CANCEL_GOTO            = _constant_transaction(Command.CANCEL_GOTO,            0 + 1, _decode_none)
 
-    def setTrackingMode(self, tracking_mode):
+_GOTO_COMMANDS = {
+        (CoordinateMode.RA_DEC,  False) : Command.GOTO_POSITION_RA_DEC,
+        (CoordinateMode.RA_DEC,  True)  : Command.GOTO_POSITION_RA_DEC_PRECISE,
+        (CoordinateMode.AZM_ALT, False) : Command.GOTO_POSITION_AZM_ALT,
+        (CoordinateMode.AZM_ALT, True)  : Command.GOTO_POSITION_AZM_ALT_PRECISE
+    }
 
-        if not isinstance(tracking_mode, TrackingMode):
-            raise UsageError("_read_binary() failed: incorrect value for parameter 'tracking_mode': {}".format(repr(tracking_mode)))
 
-        command = Command.GET_TRACKING_MODE
+def _encode_coordinates(command, firstCoordinate, secondCoordinate, highPrecisionFlag):
+    # Angles are sent as fractions of a full turn, wrapped into the 16 or 32 bit range.
+    if highPrecisionFlag:
+        return _PRECISE_COORDINATES_REQUEST % (ord(command.value), round(firstCoordinate / 360.0 * 0x100000000) & 0xffffffff, round(secondCoordinate / 360.0 * 0x100000000) & 0xffffffff)
+    return _COORDINATES_REQUEST % (ord(command.value), round(firstCoordinate / 360.0 * 0x10000) & 0xffff, round(secondCoordinate / 360.0 * 0x10000) & 0xffff)
 
-        self._write(command, tracking_mode)
+_PASSTHROUGH_COMMANDS = {command.value: command for command in PassthroughCommand}
 
-        # Response is a single hash ('#') character. Drop it.
-        response = self._read_binary(expected_response_length = 0 + 1, check_and_remove_trailing_hash = True)
+# The longest regular response is a precise position (18 bytes); longer passthrough responses grow the buffer.
+_RECEIVE_BUFFER_SIZE = 64
 
-        return None
+# Marks a cache miss; None is a valid response.
+_MISS = object()
 
-    def getLocation(self):
+def _passthrough_transaction(axisId, length, identifier, d1, d2, d3, expected_response_bytes, decode = _decode_raw):
+    request = _PASSTHROUGH_REQUEST.pack(_PASSTHROUGH, length, axisId.value, identifier, d1, d2, d3, expected_response_bytes)
+    return Transaction(Command.PASSTHROUGH, request, expected_response_bytes + 1, decode, axisId = axisId)
 
-        command = Command.GET_LOCATION
-        self._write(command)
 
-        response = self._read_binary(expected_response_length = 8 + 1, check_and_remove_trailing_hash = True)
+class Requests:
 
-        latitude_degrees = response[0]
-        latitude_minutes = response[1]
-        latitude_seconds = response[2]
-        latitude_sign    = response[3] # 0 == north, 1 == south
+    # Builds the Transaction for every command of the public API. The methods mirror the signatures of
+    # the corresponding SynScanController methods, so that a command can be executed right away or
+    # queued in a Pipeline together with other commands.
 
-        longitude_degrees = response[4]
-        longitude_minutes = response[5]
-        longitude_seconds = response[6]
-        longitude_sign    = response[7] # 0 == east, 1 == west
+    @staticmethod
+    def getPosition(coordinateMode = CoordinateMode.RA_DEC, highPrecisionFlag = False):
+        return _GET_POSITION[(CoordinateMode.AZM_ALT if coordinateMode == CoordinateMode.AZM_ALT else CoordinateMode.RA_DEC, bool(highPrecisionFlag))]
 
-        latitude_seconds = latitude_degrees * 3600 + latitude_minutes * 60 + latitude_seconds
-        if latitude_sign != 0:
-            latitude_seconds = -latitude_seconds
+    @staticmethod
+    def gotoPosition(firstCoordinate, secondCoordinate, coordinateMode = CoordinateMode.AZM_ALT, highPrecisionFlag = True):
 
-        longitude_seconds = longitude_degrees * 3600 + longitude_minutes * 60 + longitude_seconds
-        if longitude_sign != 0:
-            longitude_seconds = -longitude_seconds
+        # Initiate a "GoTo" command.
 
-        latitude = latitude_seconds / 3600.0
-        longitude = longitude_seconds / 3600.0
+        highPrecisionFlag = bool(highPrecisionFlag)
+        command = _GOTO_COMMANDS[(CoordinateMode.AZM_ALT if coordinateMode == CoordinateMode.AZM_ALT else CoordinateMode.RA_DEC, highPrecisionFlag)]
 
-        return (latitude, longitude)
+        return Transaction(command, _encode_coordinates(command, firstCoordinate, secondCoordinate, highPrecisionFlag), 0 + 1, _decode_none)
 
-    def setLocation(self, latitude, longitude):
+    @staticmethod
+    def sync(firstCoordinate, secondCoordinate, highPrecisionFlag = True):
+
+        # sync always works in RA/DEC coordinates
+
+        command = Command.SYNC_PRECISE if highPrecisionFlag else Command.SYNC
+
+        return Transaction(command, _encode_coordinates(command, firstCoordinate, secondCoordinate, highPrecisionFlag), 0 + 1, _decode_none)
+
+    @staticmethod
+    def getTrackingMode():
+        return _GET_TRACKING_MODE
+
+    @staticmethod
+    def setTrackingMode(tracking_mode):
+
+        if not isinstance(tracking_mode, TrackingMode):
+            raise UsageError("setTrackingMode() failed: incorrect value for parameter 'tracking_mode': {}".format(repr(tracking_mode)))
+
+        command = Command.SET_TRACKING_MODE
+
+        return Transaction(command, _COMMAND_AND_BYTE_REQUEST.pack(_SINGLE_BYTE_REQUEST[command], tracking_mode.value), 0 + 1, _decode_none)
+
+    @staticmethod
+    def getLocation():
+        return _GET_LOCATION
+
+    @staticmethod
+    def setLocation(latitude, longitude):
 
         # Fix latitude
 
@@ -307,52 +438,20 @@ class SynScanController:
 
         # Synthesize "W" request
 
-        request = [
-                Command.SET_LOCATION,
+        request = _EIGHT_BYTES_REQUEST.pack(
+                _SINGLE_BYTE_REQUEST[Command.SET_LOCATION],
                 latitude_degrees, latitude_minutes, latitude_seconds, latitude_sign,
                 longitude_degrees, longitude_minutes, longitude_seconds, longitude_sign
-            ]
-
-        self._write(request)
-
-        # Response is a single hash ('#') character. Drop it.
-        response = self._read_binary(expected_response_length = 0 + 1, check_and_remove_trailing_hash = True)
-
-        return None
-
-    def getTime(self):
-
-        request = Command.GET_TIME
-        self._write(request)
-
-        response = self._read_binary(expected_response_length = 8 + 1, check_and_remove_trailing_hash = True)
-
-        hour   = response[0] # 24 hour clock
-        minute = response[1]
-        second = response[2]
-        month  = response[3] # jan == 1, dec == 12
-        day    = response[4] # 1 .. 31
-        year   = response[5] # year minus 2000
-        zone   = response[6] # 2-complement of timezone (hour offset from UTC)
-        dst    = response[7] # 1 to enable DST, 0 for standard time.
+            )
 
-        year += 2000
+        return Transaction(Command.SET_LOCATION, request, 0 + 1, _decode_none)
 
-        if zone >= 128: # take care of negative zone offsets
-            zone -= 256
-
-        zone = datetime.timedelta(hours = zone)
-
-        dst = (dst != 0)
-
-        print(year, month, day, hour, minute, second)
-
-        tzinfo = datetime.timezone(zone) # simple timezone with offset relative to UTC
-        timestamp = datetime.datetime(year, month, day, hour, minute, second, 0, tzinfo)
-
-        return (timestamp, dst)
+    @staticmethod
+    def getTime():
+        return _GET_TIME
 
-    def setTime(self, timestamp, dst):
+    @staticmethod
+    def setTime(timestamp, dst):
 
         hour   = timestamp.hour
         minute = timestamp.minute
@@ -365,77 +464,41 @@ class SynScanController:
         if zone < 0:
             zone += 256
 
-        request = [Command.SET_TIME, hour, minute, second, month, day, year, zone, dst]
-        self._write(request)
-
-        # Response is a single hash ('#') character. Drop it.
-        response = self._read_binary(expected_response_length = 0 + 1, check_and_remove_trailing_hash = True)
-
-        return None
-
-    def getVersion(self):
-        request = Command.GET_VERSION
-        self._write(request)
-        response = self._read_binary(expected_response_length = 2 + 1, check_and_remove_trailing_hash = True)
-        response = (response[0], response[1])
-        return response
-
+        request = _EIGHT_BYTES_REQUEST.pack(_SINGLE_BYTE_REQUEST[Command.SET_TIME], hour, minute, second, month, day, year, zone, 1 if dst else 0)
 
+        return Transaction(Command.SET_TIME, request, 0 + 1, _decode_none)
 
-    def getModel(self):
-        request = Command.GET_MODEL
-        self._write(request)
-        response = self._read_binary(expected_response_length = 1 + 1, check_and_remove_trailing_hash = True)
-        response = response[0]
-        return response
-
+    @staticmethod
+    def getVersion():
+        return _GET_VERSION
 
+    @staticmethod
+    def getModel():
+        return _GET_MODEL
 
-    def echo(self, c):
-        if not isinstance(c, int) and (0 <= c <= 255):
+    @staticmethod
+    def echo(c):
+        if not (isinstance(c, int) and (0 <= c <= 255)):
             raise UsageError("echo() failed: incorrect 'c' parameter")
-        request = [Command.ECHO, c]
-        self._write(request)
-        response = self._read_binary(expected_response_length = 1 + 1, check_and_remove_trailing_hash = True)
-        response = response[0]
-        if not(response == c):
-            raise ProtocolError("echo() failed: unexpected response ({})".format(repr(response)))
-        return None
-
-    def getAlignmentComplete(self):
-        request = [Command.GET_ALIGNMENT_COMPLETE]
-        self._write(request)
-        response = self._read_binary(expected_response_length = 1 + 1, check_and_remove_trailing_hash = True)
-        response = response[0]
-        if not response in [0, 1]:
-            raise ProtocolError("getAlignmentComplete() failed: unexpected response ({})".format(repr(response)))
-        response = (response == 1) # convert to bool
-        return response
-
-
-    def getGotoInProgress(self):
-        request = [Command.GET_GOTO_IN_PROGRESS]
-        self._write(request)
-        response = self._read_ascii(expected_response_length = 1 + 1, check_and_remove_trailing_hash = True)
-        response = response[0]
-        # Response should be ASCII '0' or '1'
-        if not response in ['0', '1']:
-            raise ProtocolError("getGotoInProgress() failed: unexpected response ({})".format(repr(response)))
-        response = (response == '1') # convert to bool
-        return response
+        return Transaction(Command.ECHO, _COMMAND_AND_BYTE_REQUEST.pack(_SINGLE_BYTE_REQUEST[Command.ECHO], c), 1 + 1, _decode_echo(c))
 
+    @staticmethod
+    def getAlignmentComplete():
+        return _GET_ALIGNMENT_COMPLETE
 
-    def cancelGoto(self):
-        request = [Command.CANCEL_GOTO]
-        self._write(request)
-        response = self._read_binary(expected_response_length = 0 + 1, check_and_remove_trailing_hash = True)
-        return None
+    @staticmethod
+    def getGotoInProgress():
+        return _GET_GOTO_IN_PROGRESS
 
+    @staticmethod
+    def cancelGoto():
+        return _CANCEL_GOTO
 
     # The commands below are low-level 'pass-through' commands that are handled by the specified
     # sub-devices connected to the hand controller via the 6-pin RJ-12 port.
 
-    def passthrough(self, axisId, command, expected_response_bytes):
+    @staticmethod
+    def passthrough(axisId, command, expected_response_bytes):
 
         if not isinstance(axisId, AxisId):
             raise UsageError("incorrect value for parameter 'axisId': {}".format(repr(axisId)))
@@ -443,31 +506,20 @@ class SynScanController:
         if not (isinstance(expected_response_bytes, int) and expected_response_bytes >= 0):
             raise UsageError("passthrough() failed: incorrect value for parameter 'expected_response_bytes': {}".format(repr(expected_response_bytes)))
 
+        if isinstance(command, PassthroughCommand):
+            return _passthrough_transaction(axisId, 1, command.value, 0, 0, 0, expected_response_bytes)
+
         command_bytes = SynScanController._to_bytes(command)
 
         if not (1 <= len(command_bytes) <= 4):
-            raise UsageError("expected between 1 and 4 command bytes for passthrough command (received {})".format(len(command)))
+            raise UsageError("expected between 1 and 4 command bytes for passthrough command (received {})".format(len(command_bytes)))
 
-        padding = bytes(4 - len(command_bytes))
+        padded = command_bytes + bytes(4 - len(command_bytes))
 
-        request = [Command.PASSTHROUGH, len(command_bytes), axisId, command_bytes, padding, expected_response_bytes]
+        return _passthrough_transaction(axisId, len(command_bytes), padded[0], padded[1], padded[2], padded[3], expected_response_bytes)
 
-        self._write(request)
-
-        # Receive response.
-        try:
-            response = self._read_binary(expected_response_length = expected_response_bytes + 1, check_and_remove_trailing_hash = True)
-        except ProtocolError as exception:
-            # read away extra hash
-            extra_hash = self._device.read(1)
-            if extra_hash != b"#":
-                raise ProtocolError("extra hash not found") from exception
-
-            raise PassthroughError("No valid response from device {}".format(AxisId.name))
-
-        return response
-
-    def slew_fixed(self, axisId, rate):
+    @staticmethod
+    def slew_fixed(axisId, rate):
         if axisId not in [AxisId.AZM_RA_MOTOR, AxisId.ALT_DEC_MOTOR]:
             raise UsageError("slew command only supported for motors.")
         if not (isinstance(rate, int) and -9 <= rate <= +9):
@@ -479,10 +531,11 @@ class SynScanController:
             command = PassthroughCommand.MOTOR_SLEW_NEGATIVE_FIXED_RATE
             rate = -rate
 
-        self.passthrough(axisId, [command, rate], expected_response_bytes = 0)
+        return _passthrough_transaction(axisId, 2, command.value, rate, 0, 0, 0, _decode_none)
 
-    def slew_variable(self, AxisId, rate):
-        if AxisId not in [AxisId.AZM_RA_MOTOR, AxisId.ALT_DEC_MOTOR]:
+    @staticmethod
+    def slew_variable(axisId, rate):
+        if axisId not in [AxisId.AZM_RA_MOTOR, AxisId.ALT_DEC_MOTOR]:
             raise UsageError("slew command only supported for motors.")
 
         # rate is assumed to be in in degrees / second
@@ -497,11 +550,669 @@ class SynScanController:
         if not (0 <= rate <= 65535):
             raise UsageError("variable rate out of range.")
 
-        self.passthrough(AxisId, [command, rate // 256, rate % 256], expected_response_bytes = 0)
+        return _passthrough_transaction(axisId, 3, command.value, rate // 256, rate % 256, 0, 0, _decode_none)
+
+    @staticmethod
+    def getDeviceVersion(axisId):
+        return Requests.passthrough(axisId, command = PassthroughCommand.GET_DEVICE_VERSION, expected_response_bytes = 2)
+
+
+class Capabilities:
+
+    # What one hand controller supports, derived from its firmware version. Assigned to
+    # SynScanController.capabilities, it makes the controller reject unsupported commands with an
+    # UnsupportedCommandError instead of waiting for a response that never comes.
+
+    def __init__(self, version, model = None):
+        self.version = tuple(version)
+        self.model = model
+        self.unsupported = frozenset(command for (command, minimum) in MINIMUM_VERSIONS.items() if self.version < minimum)
+
+    def supports(self, command):
+        return command not in self.unsupported
+
+    def profile(self):
+        # Command -> (minimum version, supported)
+        return {command: (minimum, command not in self.unsupported) for (command, minimum) in MINIMUM_VERSIONS.items()}
+
+    def __repr__(self):
+        model = self.model.name if isinstance(self.model, Model) else self.model
+        return "Capabilities(version = {}.{}, model = {}, unsupported = [{}])".format(
+                self.version[0], self.version[1], model, ", ".join(sorted(command.name for command in self.unsupported)))
+
+
+class SynScanController:
+
+    def __init__(self, adaptiveTimeouts = True, minimumTimeout = 0.010, cacheTimeToLive = CACHE_TIME_TO_LIVE):
+        self._device = None
+        self._writev = None # scatter/gather write of the device, if it has one
+        self._readinto = None # read into a caller's buffer, if the device has it
+        self._receiveBuffer = bytearray(_RECEIVE_BUFFER_SIZE) # reused by every response, see _read_into()
+        self._receiveViews = {} # response length -> (view of the response, view without the trailing hash)
+        self._timeout = None # upper bound for every read, as passed to connect()
+        self._adaptiveTimeouts = adaptiveTimeouts
+        self._minimumTimeout = minimumTimeout
+        self._roundTripTimes = {} # Command -> [smoothed round-trip time, round-trip time deviation, back-off factor], in seconds
+        self.timeoutCount = 0
+        self.resyncCount = 0
+        self.discardedByteCount = 0
+        self._recorder = None # e.g. a SessionLog.SessionRecorder; sees every byte sent and received
+        self._metrics = None  # e.g. a SynScanMetrics.Metrics; counts bytes, latencies and errors
+        self._capabilities = None # Capabilities of the connected hand controller, once known
+        self._cacheTimeToLive = dict(cacheTimeToLive or {})
+        self._cache = {} # request bytes -> (field, expiry time, result)
+        self.cacheHitCount = 0
+
+    def connect(self, port, timeout = 3.500, baudrate = 9600):
+
+        # 'port' is a serial port name, a transport address (see SynScanTransport.openTransport,
+        # e.g. "tcp://192.168.4.1:4030"), or an already opened file-like device.
+
+        self._timeout = timeout
+        self._roundTripTimes = {}
+        self._cache = {}
+        self._capabilities = None
+        if isinstance(port, str):
+            from SynScanTransport import openTransport
+            self._device = openTransport(port, timeout, baudrate)
+        elif hasattr(port, "read") and hasattr(port, "write"):
+            # An already opened device, e.g. a simulated hand controller.
+            self._device = port
+            if hasattr(port, "timeout"):
+                port.timeout = timeout
+        else:
+            raise UsageError("connect() failed: incorrect value for parameter 'port': {}".format(repr(port)))
+        self._writev = getattr(self._device, "writev", None)
+        self._readinto = getattr(self._device, "readinto", None)
+
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
+
+    @property
+    def capabilities(self):
+        return self._capabilities
+
+    @capabilities.setter
+    def capabilities(self, capabilities):
+        self._capabilities = capabilities
+
+    def discoverCapabilities(self):
+
+        # Reads the firmware version (and the model, where supported) and enables the capability
+        # checks for this hand controller.
+
+        self._capabilities = None
+        version = self._transact(Requests.getVersion())
+        model = self._transact(Requests.getModel()) if version >= MINIMUM_VERSIONS[Command.GET_MODEL] else None
+        try:
+            model = Model(model)
+        except ValueError:
+            pass
+        self._capabilities = Capabilities(version, model)
+        return self._capabilities
+
+    @property
+    def recorder(self):
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, recorder):
+        self._recorder = recorder
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self._metrics = metrics
+
+    def close(self):
+        self._cache = {}
+        if self._device != None:
+            return self._device.close()
+
+    def _write_binary(self, request):
+        if self._recorder is not None:
+            self._recorder.sent(request)
+        if self._metrics is not None:
+            self._metrics.sent(len(request))
+        return self._device.write(request)
+
+    def _write_buffers(self, buffers):
+        # Several requests in one write; without joining them if the device can gather.
+        if self._writev is None or self._recorder is not None:
+            return self._write_binary(b''.join(buffers))
+        if self._metrics is not None:
+            self._metrics.sent(sum(len(buffer) for buffer in buffers))
+        return self._writev(buffers)
+
+    def _read_device(self, size):
+        response = self._device.read(size)
+        if self._recorder is not None:
+            self._recorder.received(response)
+        if self._metrics is not None:
+            self._metrics.received(len(response))
+        return response
+
+    @staticmethod
+    def _to_bytes(arg):
+
+        if isinstance(arg, Command) or isinstance(arg, TrackingMode) or isinstance(arg, AxisId) or isinstance (arg, PassthroughCommand):
+           arg = arg.value
+
+        if isinstance(arg, int):
+            arg = bytes([arg])
+
+        if isinstance(arg, str):
+            arg = bytes(arg, "ascii")
+
+        if not isinstance(arg, bytes):
+            arg = b''.join(SynScanController._to_bytes(e) for e in arg)
+
+        return arg
+
+    def _write(self, *args):
+        msg = SynScanController._to_bytes(args)
+        # print("message to be written:", msg)
+        return self._write_binary(msg)
+
+    def _read_binary(self, expected_response_length, check_and_remove_trailing_hash = True):
+
+        if not (isinstance(expected_response_length, int) and expected_response_length > 0):
+            raise UsageError("_read_binary() failed: incorrect value for parameter 'expected_response_length': {}".format(repr(expected_response_length)))
+
+        if not isinstance(check_and_remove_trailing_hash, bool):
+            raise UsageError("_read_binary() failed: incorrect value for parameter 'check_and_remove_trailing_hash': {}".format(repr(check_and_remove_trailing_hash)))
+
+        response = self._read_device(expected_response_length)
+
+        if len(response) != expected_response_length:
+            raise ResponseTimeoutError("read_binary() failed: actual response length ({}) not equal to expected response length ({})".format(len(response), expected_response_length), response)
+
+        if check_and_remove_trailing_hash:
+            if not response.endswith(b'#'):
+                raise ProtocolError("read_binary() failed: response does not end with hash character (ASCII 35)")
+            # remove the trailing hash character.
+            response = response[:-1]
+
+        return response
+
+    def _read_into(self, expected_response_length, check_and_remove_trailing_hash = True):
+
+        # Like _read_binary(), without allocating: reads into the receive buffer and returns a
+        # memoryview of the response, valid until the next read. The arguments come from a
+        # Transaction and are not checked again.
+
+        views = self._receiveViews.get(expected_response_length)
+        if views is None:
+            if expected_response_length > len(self._receiveBuffer):
+                # Long passthrough responses only; views of the old buffer may still be referenced.
+                self._receiveBuffer = bytearray(expected_response_length)
+                self._receiveViews = {}
+            view = memoryview(self._receiveBuffer)[:expected_response_length]
+            views = (view, view[:-1])
+            self._receiveViews[expected_response_length] = views
+
+        view = views[0]
+
+        if self._readinto is not None:
+            length = self._readinto(view) or 0
+        else:
+            response = self._device.read(expected_response_length)
+            length = len(response)
+            view[:length] = response
+
+        if self._recorder is not None:
+            self._recorder.received(bytes(view[:length]))
+        if self._metrics is not None:
+            self._metrics.received(length)
+
+        if length != expected_response_length:
+            raise ResponseTimeoutError("read_binary() failed: actual response length ({}) not equal to expected response length ({})".format(length, expected_response_length), bytes(view[:length]))
+
+        if check_and_remove_trailing_hash:
+            if view[-1] != 35:
+                raise ProtocolError("read_binary() failed: response does not end with hash character (ASCII 35)")
+            return views[1]
+
+        return view
+
+    def _read_ascii(self, expected_response_length, check_and_remove_trailing_hash = True):
+        response = self._read_binary(expected_response_length, check_and_remove_trailing_hash)
+        response = response.decode("ascii")
+        return response
+
+    # Read deadlines. Every command's round-trip time is tracked like TCP tracks its retransmission
+    # timeout: the smoothed mean plus the larger of four times the smoothed deviation and the
+    # minimum timeout, and never less than twice the mean, bounded by the timeout given to
+    # connect(). A steady link drives the deviation towards zero; the floors keep an ordinary
+    # jitter from being taken for a lost response. A lost byte then costs a few round-trip times
+    # instead of the full timeout.
+
+    def responseDeadline(self, command):
+        estimate = self._roundTripTimes.get(command)
+        if estimate is None or not self._adaptiveTimeouts or self._timeout is None:
+            return self._timeout
+        (smoothed, deviation, backOff) = estimate
+        deadline = max(smoothed + max(self._minimumTimeout, 4.0 * deviation), 2.0 * smoothed)
+        return min(self._timeout, max(self._minimumTimeout, deadline * backOff))
+
+    def _update_round_trip_time(self, command, sample):
+        estimate = self._roundTripTimes.get(command)
+        if estimate is None:
+            self._roundTripTimes[command] = [sample, sample / 2.0, 1.0]
+        else:
+            estimate[1] = 0.75 * estimate[1] + 0.25 * abs(estimate[0] - sample)
+            estimate[0] = 0.875 * estimate[0] + 0.125 * sample
+            estimate[2] = 1.0
+
+    def _back_off(self, command):
+        # After consecutive timeouts, assume the link got slower rather than failing again right
+        # away; the next successful round trip resets the deadline.
+        estimate = self._roundTripTimes.get(command)
+        if estimate is not None:
+            estimate[2] = min(2.0 * estimate[2], 64.0)
+
+    def _set_read_timeout(self, timeout):
+        # Reconfiguring a serial port is a system call: round up to 5 ms steps, so that the timeout
+        # only has to be changed when the deadline really moves.
+        if timeout is None:
+            return
+        timeout = math.ceil(timeout * 200.0) / 200.0
+        device = self._device
+        if getattr(device, "timeout", timeout) != timeout:
+            device.timeout = timeout
+
+    def _resynchronise(self, command):
+
+        # The read of 'command' lost its alignment with the response stream. A response that is
+        # only late may still be on its way, so drop everything that arrives until the line has
+        # been quiet for one response deadline of the command (at most the connect() timeout in
+        # total), then whatever is left in the input buffer. The next request then starts on an
+        # empty line. Commands without a round-trip estimate already waited the full timeout, for
+        # them a short pause covers the rest of a response still being transferred.
+
+        self.resyncCount += 1
+
+        if command in self._roundTripTimes and self._adaptiveTimeouts and self._timeout is not None:
+            quiet = self.responseDeadline(command)
+        else:
+            quiet = self._minimumTimeout
+        self._set_read_timeout(quiet)
+
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while deadline is None or time.monotonic() < deadline:
+            data = self._read_device(max(1, getattr(self._device, "in_waiting", 1)))
+            if not data:
+                break
+            self.discardedByteCount += len(data)
+
+        reset_input_buffer = getattr(self._device, "reset_input_buffer", None)
+        if reset_input_buffer is not None:
+            reset_input_buffer()
 
-    def getDeviceVersion(self, AxisId):
+    def _receive(self, transaction, issued, sample = True):
 
-        (versionMajor, versionMinor) = self.passthrough(AxisId, command = PassthroughCommand.GET_DEVICE_VERSION, expected_response_bytes = 2)
+        # 'issued' is the time the request was written; 'sample' tells whether the time until the
+        # response is a clean round-trip time sample (not so for responses queued behind others).
+
+        self._set_read_timeout(self.responseDeadline(transaction.command))
+
+        try:
+            response = self._read_into(transaction.expected_response_length, transaction.check_and_remove_trailing_hash)
+        except ProtocolError as exception:
+
+            if self._metrics is not None:
+                self._metrics.protocolError(transaction.command, exception)
+
+            if isinstance(exception, ResponseTimeoutError):
+                self.timeoutCount += 1
+                self._back_off(transaction.command)
+                aligned = exception.response.endswith(b"#")
+            else:
+                aligned = False
+
+            if transaction.axisId is None:
+                if not aligned:
+                    self._resynchronise(transaction.command)
+                raise
+
+            if self._metrics is not None:
+                self._metrics.passthroughFailure(transaction.axisId)
+
+            # read away extra hash
+            extra_hash = self._read_device(1)
+            if extra_hash != b"#":
+                self._resynchronise(transaction.command)
+                raise ProtocolError("extra hash not found") from exception
+
+            raise PassthroughError("No valid response from device {}".format(transaction.axisId.name))
+
+        if sample or self._metrics is not None:
+            elapsed = time.monotonic() - issued
+            if sample:
+                self._update_round_trip_time(transaction.command, elapsed)
+            if self._metrics is not None:
+                self._metrics.observe(transaction.command, elapsed)
+
+        try:
+            return transaction.decode(response)
+        except ProtocolError as exception:
+            if self._metrics is not None:
+                self._metrics.protocolError(transaction.command, exception)
+            raise
+
+    # Response cache. Responses of the commands in cacheTimeToLive are kept for that long (keyed by
+    # the request, so that e.g. the device version of each motor is kept separately); setters drop
+    # the entries they make stale before they are sent, see CACHE_INVALIDATIONS.
+
+    @staticmethod
+    def _cache_field(transaction):
+        if transaction.axisId is not None:
+            return _PASSTHROUGH_COMMANDS.get(transaction.request[3])
+        return transaction.command
+
+    def _from_cache(self, transaction):
+
+        stale = CACHE_INVALIDATIONS.get(transaction.command)
+        if stale is not None:
+            self.invalidate(*stale)
+            return _MISS
+
+        entry = self._cache.get(transaction.request)
+        if entry is None:
+            return _MISS
+        if time.monotonic() >= entry[1]:
+            del self._cache[transaction.request]
+            return _MISS
+
+        self.cacheHitCount += 1
+        return entry[2]
+
+    def _to_cache(self, transaction, result):
+        field = self._cache_field(transaction)
+        timeToLive = self._cacheTimeToLive.get(field)
+        if timeToLive is not None:
+            self._cache[transaction.request] = (field, time.monotonic() + timeToLive, result)
+
+    @staticmethod
+    def _cacheable(transactions):
+        # Per transaction of a burst, whether its response may be cached: not if a setter later in
+        # the same burst makes it stale, because the response was read before the setter ran.
+        stale = set()
+        cacheable = []
+        for transaction in reversed(transactions):
+            cacheable.append(SynScanController._cache_field(transaction) not in stale)
+            stale.update(CACHE_INVALIDATIONS.get(transaction.command, ()))
+        cacheable.reverse()
+        return cacheable
+
+    def invalidate(self, *fields):
+        # Drops the cached responses of the given Commands / PassthroughCommands (default: all).
+        if not fields:
+            self._cache = {}
+            return
+        self._cache = {request: entry for (request, entry) in self._cache.items() if entry[0] not in fields}
+
+    def refresh(self, transaction):
+        # Executes a request bypassing the cache, and caches the fresh response.
+        self._cache.pop(transaction.request, None)
+        return self.execute(transaction)[0]
+
+    def _check_supported(self, transaction):
+        if transaction.command in self._capabilities.unsupported:
+            raise UnsupportedCommandError("{} requires firmware version {}.{} or later, the hand controller has {}.{}".format(
+                    transaction.command.name, *(MINIMUM_VERSIONS[transaction.command] + self._capabilities.version)))
+
+    def _transact(self, transaction):
+
+        if self._capabilities is not None:
+            self._check_supported(transaction)
+
+        if self._cacheTimeToLive:
+            result = self._from_cache(transaction)
+            if result is not _MISS:
+                return result
+
+        issued = time.monotonic()
+        self._write_binary(transaction.request)
+        result = self._receive(transaction, issued)
+
+        if self._cacheTimeToLive:
+            self._to_cache(transaction, result)
+
+        return result
+
+    def _exchange(self, transactions):
+
+        # Write all requests back-to-back, then collect the responses in order. Since every response
+        # has a fixed length, the hand controller answers them in the same order they were sent.
+        # Returns a (result, exception) pair per transaction; an exception in one transaction does
+        # not prevent the responses of the following transactions from being read, unless the line
+        # had to be resynchronised, which drops them.
+
+        if self._capabilities is not None:
+            outcomes = []
+            for transaction in transactions:
+                try:
+                    self._check_supported(transaction)
+                except UnsupportedCommandError as exception:
+                    outcomes.append((None, exception))
+                else:
+                    outcomes.append(None)
+            if any(outcome is not None for outcome in outcomes):
+                supported = [transaction for (transaction, outcome) in zip(transactions, outcomes) if outcome is None]
+                results = iter(self._exchange(supported) if supported else ())
+                return [next(results) if outcome is None else outcome for outcome in outcomes]
+
+        if self._cacheTimeToLive:
+            cached = [self._from_cache(transaction) for transaction in transactions]
+            if any(result is not _MISS for result in cached):
+                missing = [transaction for (transaction, result) in zip(transactions, cached) if result is _MISS]
+                outcomes = iter(self._exchange(missing) if missing else ())
+                return [next(outcomes) if result is _MISS else (result, None) for result in cached]
+
+        issued = time.monotonic()
+        self._write_buffers([transaction.request for transaction in transactions])
+
+        cacheable = self._cacheable(transactions) if self._cacheTimeToLive else None
+
+        outcomes = []
+        sample = True
+        resyncCount = self.resyncCount
+        for (index, transaction) in enumerate(transactions):
+            if self.resyncCount != resyncCount:
+                # The responses still due were dropped with the line.
+                outcomes.append((None, ProtocolError("no response: discarded while resynchronising after an earlier error in the burst")))
+                continue
+            try:
+                result = self._receive(transaction, issued, sample)
+            except (ProtocolError, PassthroughError) as exception:
+                outcomes.append((None, exception))
+            else:
+                outcomes.append((result, None))
+                if cacheable is not None and cacheable[index]:
+                    self._to_cache(transaction, result)
+            # Only the first response measures a full round trip, the others overlap with it.
+            sample = False
+
+        return outcomes
+
+    def execute(self, *transactions):
+
+        # Execute the given transactions in a single pipelined burst and return their results.
+        # Raises the first error encountered, after all responses have been read.
+
+        if len(transactions) == 1:
+            return [self._transact(transactions[0])]
+
+        outcomes = self._exchange(transactions)
+
+        for (result, exception) in outcomes:
+            if exception is not None:
+                raise exception
+
+        return [result for (result, exception) in outcomes]
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    # Public API starts here
+
+    def getPosition(self, coordinateMode = CoordinateMode.RA_DEC, highPrecisionFlag = False):
+        return self._transact(Requests.getPosition(coordinateMode, highPrecisionFlag))
+
+    def gotoPosition(self, firstCoordinate, secondCoordinate, coordinateMode = CoordinateMode.AZM_ALT, highPrecisionFlag = True):
+        return self._transact(Requests.gotoPosition(firstCoordinate, secondCoordinate, coordinateMode, highPrecisionFlag))
+
+    def sync(self, firstCoordinate, secondCoordinate, highPrecisionFlag = True):
+        return self._transact(Requests.sync(firstCoordinate, secondCoordinate, highPrecisionFlag))
+
+    def getTrackingMode(self):
+        return self._transact(Requests.getTrackingMode())
+
+    def setTrackingMode(self, tracking_mode):
+        return self._transact(Requests.setTrackingMode(tracking_mode))
+
+    def getLocation(self):
+        return self._transact(Requests.getLocation())
+
+    def setLocation(self, latitude, longitude):
+        return self._transact(Requests.setLocation(latitude, longitude))
+
+    def getTime(self):
+        return self._transact(Requests.getTime())
+
+    def setTime(self, timestamp, dst):
+        return self._transact(Requests.setTime(timestamp, dst))
+
+    def getVersion(self):
+        return self._transact(Requests.getVersion())
+
+    def getModel(self):
+        return self._transact(Requests.getModel())
+
+    def echo(self, c):
+        return self._transact(Requests.echo(c))
+
+    def getAlignmentComplete(self):
+        return self._transact(Requests.getAlignmentComplete())
+
+    def getGotoInProgress(self):
+        return self._transact(Requests.getGotoInProgress())
+
+    def cancelGoto(self):
+        return self._transact(Requests.cancelGoto())
+
+    # The commands below are low-level 'pass-through' commands that are handled by the specified
+    # sub-devices connected to the hand controller via the 6-pin RJ-12 port.
+
+    def passthrough(self, axisId, command, expected_response_bytes):
+        return self._transact(Requests.passthrough(axisId, command, expected_response_bytes))
+
+    def slew_fixed(self, axisId, rate):
+        return self._transact(Requests.slew_fixed(axisId, rate))
+
+    def slew_variable(self, axisId, rate):
+        return self._transact(Requests.slew_variable(axisId, rate))
+
+    def getDeviceVersion(self, axisId):
+
+        (versionMajor, versionMinor) = self._transact(Requests.getDeviceVersion(axisId))
 
         return (versionMajor, versionMinor)
 
+
+class PendingResponse:
+
+    # Placeholder for the result of a transaction queued in a Pipeline.
+
+    def __init__(self, transaction):
+        self.transaction = transaction
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def _set(self, result, exception):
+        self._result = result
+        self._exception = exception
+        self._done = True
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise UsageError("result() failed: pipeline has not been executed yet")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class Pipeline:
+
+    # Queues commands and sends them to the hand controller in one go. Every public command of
+    # SynScanController is available under the same name; queuing it returns a PendingResponse:
+    #
+    #     with controller.pipeline() as pipeline:
+    #         position       = pipeline.getPosition()
+    #         gotoInProgress = pipeline.getGotoInProgress()
+    #         trackingMode   = pipeline.getTrackingMode()
+    #
+    #     print(position.result(), gotoInProgress.result(), trackingMode.result())
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._pending = []
+
+    def __getattr__(self, name):
+
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        build = getattr(Requests, name)
+
+        def queue(*args, **kwargs):
+            return self.queue(build(*args, **kwargs))
+
+        return queue
+
+    def __len__(self):
+        return len(self._pending)
+
+    def queue(self, transaction):
+        pending = PendingResponse(transaction)
+        self._pending.append(pending)
+        return pending
+
+    def execute(self):
+
+        pending = self._pending
+        self._pending = []
+
+        if len(pending) != 0:
+            outcomes = self._controller._exchange([p.transaction for p in pending])
+            for (p, (result, exception)) in zip(pending, outcomes):
+                p._set(result, exception)
+
+        return pending
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        else:
+            self._pending = []
+        return False
@@ -0,0 +1,480 @@
+import argparse, collections, concurrent.futures, itertools, socket, socketserver, struct, sys, threading, time
+
+from SynScanProtocol import (UsageError, ProtocolError, PassthroughError, Command, AxisId, Transaction, SynScanController, READ_ONLY_COMMANDS)
+from CommandArbiter import CommandArbiter, Priority, QueueFullError
+from TelemetryPoller import TelemetryPoller
+
+# Wire format, all integers big-endian.
+#
+# Client -> server:  request id (u32), kind (u8), expected response length (u8), flags (u8),
+#                    request length (u8), followed by the raw SynScan request bytes.
+# Server -> client:  request id (u32), status (u8), payload length (u16), followed by the payload:
+#                    the raw SynScan response without trailing hash, an error message (utf-8),
+#                    or for STATUS_TELEMETRY a packed TELEMETRY record.
+#
+# Clients encode and decode the SynScan commands themselves, the server only multiplexes the raw
+# transactions of all clients onto the one serial port.
+
+REQUEST_HEADER  = struct.Struct(">IBBBB")
+RESPONSE_HEADER = struct.Struct(">IBH")
+TELEMETRY       = struct.Struct(">Qdd??B") # sequence, first coordinate, second coordinate, goto in progress, valid, tracking mode
+
+KIND_TRANSACTION = 0
+KIND_SUBSCRIBE   = 1
+KIND_UNSUBSCRIBE = 2
+
+FLAG_CHECK_HASH  = 0x01
+
+STATUS_OK                = 0
+STATUS_PROTOCOL_ERROR    = 1
+STATUS_PASSTHROUGH_ERROR = 2
+STATUS_USAGE_ERROR       = 3
+STATUS_BUSY              = 4
+STATUS_TELEMETRY         = 5
+
+DEFAULT_PORT = 11880
+
+# Frames queued for one client before it counts as stalled: further telemetry frames are dropped
+# once half of this is queued, and a client that lets it fill up entirely is disconnected.
+MAX_QUEUED_FRAMES = 256
+
+_COMMANDS = {ord(command.value): command for command in Command}
+
+
+def _identity(response):
+    # The controller's response is a view of its receive buffer; keep a copy.
+    return bytes(response)
+
+
+def parseAddress(address):
+    # "host:port" or ("host", port) for TCP, anything else with a slash is a Unix socket path.
+    if isinstance(address, tuple):
+        return (socket.AF_INET, address)
+    if "/" in address:
+        return (socket.AF_UNIX, address)
+    (host, _, port) = address.rpartition(":")
+    return (socket.AF_INET, (host or "127.0.0.1", int(port) if port else DEFAULT_PORT))
+
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+
+    # send() is called on the arbiter's I/O thread and on the telemetry poller's thread, so it must
+    # never block on the socket: frames are queued, and a sender thread per client writes them out.
+    # One slow or stalled client therefore cannot hold up the serial traffic of the others.
+
+    def setup(self):
+        self.synscan = self.server.synscan
+        self.rfile = self.request.makefile("rb")
+        self.droppedCount = 0
+        self._frames = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._draining = False
+        self._sender = threading.Thread(target = self._sendLoop, name = "SynScanServerSender", daemon = True)
+        self._sender.start()
+
+    def send(self, requestId, status, payload):
+        frame = RESPONSE_HEADER.pack(requestId, status, len(payload)) + payload
+        with self._condition:
+            if self._closed:
+                return
+            if status == STATUS_TELEMETRY and len(self._frames) >= MAX_QUEUED_FRAMES // 2:
+                # Falling behind: skip samples rather than queue stale ones.
+                self.droppedCount += 1
+                return
+            if len(self._frames) >= MAX_QUEUED_FRAMES:
+                self._disconnect()
+                return
+            self._frames.append(frame)
+            self._condition.notify()
+
+    def _sendLoop(self):
+        while True:
+            with self._condition:
+                while not self._frames and not self._closed and not self._draining:
+                    self._condition.wait()
+                if self._closed or not self._frames:
+                    return
+                frames = b"".join(self._frames)
+                self._frames.clear()
+            try:
+                self.request.sendall(frames)
+            except OSError:
+                self._disconnect()
+                return
+
+    def _disconnect(self):
+        # Also ends the reader loop in handle(), which then removes the client.
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def finish(self):
+        # The client may have closed only its sending side: let the replies still queued go out.
+        with self._condition:
+            self._draining = True
+            self._condition.notify_all()
+        self._sender.join(1.0)
+        self._disconnect()
+        self._sender.join()
+
+    def handle(self):
+
+        self.synscan._addClient(self)
+
+        try:
+            self._serve()
+        except OSError:
+            pass # connection reset or shut down by _disconnect()
+        finally:
+            self.synscan._removeClient(self)
+
+    def _serve(self):
+        while True:
+            header = self.rfile.read(REQUEST_HEADER.size)
+            if len(header) != REQUEST_HEADER.size:
+                return
+            (requestId, kind, expected_response_length, flags, request_length) = REQUEST_HEADER.unpack(header)
+            request = self.rfile.read(request_length)
+            if len(request) != request_length:
+                return
+            if kind == KIND_TRANSACTION:
+                self.synscan._handleTransaction(self, requestId, request, expected_response_length, flags)
+            elif kind == KIND_SUBSCRIBE:
+                self.synscan._subscribe(self)
+                self.send(requestId, STATUS_OK, b"")
+            elif kind == KIND_UNSUBSCRIBE:
+                self.synscan._unsubscribe(self)
+                self.send(requestId, STATUS_OK, b"")
+            else:
+                self.send(requestId, STATUS_USAGE_ERROR, "unknown request kind {}".format(kind).encode("utf-8"))
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class SynScanServer:
+
+    # Owns one controller and serves it to any number of TCP or Unix socket clients. All client
+    # requests go through a CommandArbiter, so concurrent identical queries share a wire
+    # transaction; read-only responses are additionally answered from a short-lived cache.
+    # Subscribed clients get every telemetry sample pushed to them.
+
+    def __init__(self, controller, address = ("127.0.0.1", DEFAULT_PORT), cacheTimeToLive = 0.100, pollRate = 4.0):
+
+        self._arbiter = CommandArbiter(controller)
+        self._poller = TelemetryPoller(self._arbiter.client(Priority.TELEMETRY), rate = pollRate, onUpdate = self._publish)
+        self._cacheTimeToLive = cacheTimeToLive
+        self._cache = {} # request bytes -> (time.monotonic(), response)
+        self._cacheGeneration = 0 # incremented by every write, see _handleTransaction()
+        self._clients = set()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+        (family, address) = parseAddress(address)
+        server = _UnixServer(address, _ClientHandler) if family == socket.AF_UNIX else _TCPServer(address, _ClientHandler)
+        server.synscan = self
+        self._server = server
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._arbiter.start()
+        self._thread = threading.Thread(target = self._server.serve_forever, name = "SynScanServer", daemon = True)
+        self._thread.start()
+
+    def serve_forever(self):
+        self._arbiter.start()
+        self._server.serve_forever()
+
+    def close(self):
+        self._poller.stop()
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._arbiter.stop()
+
+    def _addClient(self, client):
+        with self._lock:
+            self._clients.add(client)
+
+    def _removeClient(self, client):
+        self._unsubscribe(client)
+        with self._lock:
+            self._clients.discard(client)
+
+    def _subscribe(self, client):
+        with self._lock:
+            self._subscribers.add(client)
+            first = len(self._subscribers) == 1
+        if first:
+            self._poller.start()
+
+    def _unsubscribe(self, client):
+        with self._lock:
+            if client not in self._subscribers:
+                return
+            self._subscribers.discard(client)
+            last = len(self._subscribers) == 0
+        if last:
+            self._poller.stop()
+
+    def _publish(self, snapshot):
+
+        if snapshot.position is None:
+            return
+
+        payload = TELEMETRY.pack(snapshot.sequence, snapshot.position[0], snapshot.position[1], bool(snapshot.gotoInProgress), snapshot.error is None, snapshot.trackingMode or 0)
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for client in subscribers:
+            client.send(0, STATUS_TELEMETRY, payload)
+
+    def _handleTransaction(self, client, requestId, request, expected_response_length, flags):
+
+        command = _COMMANDS.get(request[0]) if request else None
+        if command is None or expected_response_length == 0:
+            client.send(requestId, STATUS_USAGE_ERROR, b"malformed request")
+            return
+
+        axisId = None
+        if command == Command.PASSTHROUGH:
+            try:
+                axisId = AxisId(request[2])
+            except (IndexError, ValueError):
+                axisId = None
+
+        cacheable = command in READ_ONLY_COMMANDS
+
+        if cacheable:
+            cached = self._cache.get(request)
+            if cached is not None and time.monotonic() - cached[0] < self._cacheTimeToLive:
+                client.send(requestId, STATUS_OK, cached[1])
+                return
+        else:
+            # Anything that is not a plain read (setters, goto, sync, slews, passthrough) may change
+            # what the reads return: drop the cache, and keep reads already in flight from storing
+            # responses they may have got before this write.
+            with self._lock:
+                self._cacheGeneration += 1
+                self._cache = {}
+
+        generation = self._cacheGeneration
+
+        transaction = Transaction(command, request, expected_response_length, _identity, bool(flags & FLAG_CHECK_HASH), axisId)
+
+        try:
+            future = self._arbiter.submit([transaction], Priority.COMMAND)
+        except QueueFullError as exception:
+            client.send(requestId, STATUS_BUSY, str(exception).encode("utf-8"))
+            return
+        except UsageError as exception:
+            client.send(requestId, STATUS_USAGE_ERROR, str(exception).encode("utf-8"))
+            return
+
+        def reply(future):
+            try:
+                response = future.result()[0]
+            except PassthroughError as exception:
+                client.send(requestId, STATUS_PASSTHROUGH_ERROR, str(exception).encode("utf-8"))
+            except ProtocolError as exception:
+                client.send(requestId, STATUS_PROTOCOL_ERROR, str(exception).encode("utf-8"))
+            except Exception as exception:
+                client.send(requestId, STATUS_USAGE_ERROR, str(exception).encode("utf-8"))
+            else:
+                if cacheable:
+                    with self._lock:
+                        if generation == self._cacheGeneration:
+                            self._cache[request] = (time.monotonic(), response)
+                client.send(requestId, STATUS_OK, response)
+
+        future.add_done_callback(reply)
+
+
+class SynScanClient(SynScanController):
+
+    # SynScanController that talks to a SynScanServer instead of a serial port. All public commands,
+    # execute() and pipeline() work unchanged; requests are multiplexed over the socket.
+
+    def __init__(self):
+        super(SynScanClient, self).__init__()
+        self._socket = None
+        self._timeout = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._sendLock = threading.Lock()
+        self._pendingLock = threading.Lock()
+        self._reader = None
+        self._telemetryCallbacks = []
+
+    def connect(self, address = ("127.0.0.1", DEFAULT_PORT), timeout = 3.500):
+        (family, address) = parseAddress(address)
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.connect(address)
+        if family == socket.AF_INET:
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._timeout = timeout
+        self._reader = threading.Thread(target = self._read_loop, args = (self._socket.makefile("rb"),), name = "SynScanClient", daemon = True)
+        self._reader.start()
+
+    @property
+    def device(self):
+        return self._socket
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+            self._reader.join()
+
+    def _read_loop(self, rfile):
+
+        while True:
+            header = rfile.read(RESPONSE_HEADER.size)
+            if len(header) != RESPONSE_HEADER.size:
+                break
+            (requestId, status, length) = RESPONSE_HEADER.unpack(header)
+            payload = rfile.read(length)
+
+            if status == STATUS_TELEMETRY:
+                (sequence, first, second, gotoInProgress, valid, trackingMode) = TELEMETRY.unpack(payload)
+                for callback in list(self._telemetryCallbacks):
+                    callback(sequence, (first, second), gotoInProgress, trackingMode, valid)
+                continue
+
+            with self._pendingLock:
+                future = self._pending.pop(requestId, None)
+            if future is None:
+                continue
+
+            if status == STATUS_OK:
+                future.set_result(payload)
+            elif status == STATUS_PASSTHROUGH_ERROR:
+                future.set_exception(PassthroughError(payload.decode("utf-8")))
+            elif status in (STATUS_PROTOCOL_ERROR, STATUS_BUSY):
+                future.set_exception(ProtocolError(payload.decode("utf-8")))
+            else:
+                future.set_exception(UsageError(payload.decode("utf-8")))
+
+        # Connection closed: fail everything still waiting.
+        with self._pendingLock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(ProtocolError("connection to server closed"))
+
+    def _send(self, kind, request = b"", expected_response_length = 0, flags = 0):
+
+        if self._socket is None:
+            raise UsageError("not connected")
+
+        requestId = next(self._ids) & 0xffffffff
+        future = concurrent.futures.Future()
+        with self._pendingLock:
+            self._pending[requestId] = future
+
+        frame = REQUEST_HEADER.pack(requestId, kind, expected_response_length, flags, len(request)) + request
+        with self._sendLock:
+            self._socket.sendall(frame)
+
+        return future
+
+    def _submit(self, transaction):
+        flags = FLAG_CHECK_HASH if transaction.check_and_remove_trailing_hash else 0
+        return self._send(KIND_TRANSACTION, transaction.request, transaction.expected_response_length, flags)
+
+    def _result(self, transaction, future):
+        try:
+            response = future.result(self._timeout)
+        except concurrent.futures.TimeoutError:
+            raise ProtocolError("no response from server within {} s".format(self._timeout))
+        return transaction.decode(response)
+
+    def _transact(self, transaction):
+        return self._result(transaction, self._submit(transaction))
+
+    def _exchange(self, transactions):
+
+        futures = [self._submit(transaction) for transaction in transactions]
+
+        outcomes = []
+        for (transaction, future) in zip(transactions, futures):
+            try:
+                outcomes.append((self._result(transaction, future), None))
+            except (ProtocolError, PassthroughError) as exception:
+                outcomes.append((None, exception))
+
+        return outcomes
+
+    def subscribe(self, callback):
+
+        # callback(sequence, position, gotoInProgress, trackingMode, valid) is called on the reader
+        # thread for every telemetry sample the server pushes.
+
+        self._telemetryCallbacks.append(callback)
+        if len(self._telemetryCallbacks) == 1:
+            self._send(KIND_SUBSCRIBE).result(self._timeout)
+
+    def unsubscribe(self, callback):
+        self._telemetryCallbacks.remove(callback)
+        if len(self._telemetryCallbacks) == 0:
+            self._send(KIND_UNSUBSCRIBE).result(self._timeout)
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Serve one SynScan mount to many clients.")
+    backend = parser.add_mutually_exclusive_group(required = True)
+    backend.add_argument("--port", help = "serial port of the hand controller")
+    backend.add_argument("--simulate", action = "store_true", help = "serve a simulated hand controller")
+    parser.add_argument("--listen", default = "127.0.0.1:{}".format(DEFAULT_PORT), help = "host:port, or a path for a Unix socket")
+    parser.add_argument("--cache-ttl", type = float, default = 0.100, help = "seconds read-only responses are served from the cache")
+    parser.add_argument("--poll-rate", type = float, default = 4.0, help = "telemetry samples per second pushed to subscribers")
+    args = parser.parse_args(argv)
+
+    controller = SynScanController()
+    if args.simulate:
+        from SynScanSimulator import SimulatedDevice
+        controller.connect(SimulatedDevice())
+    else:
+        controller.connect(args.port)
+
+    server = SynScanServer(controller, args.listen, args.cache_ttl, args.poll_rate)
+    print("serving on", server.address)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
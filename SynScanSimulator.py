@@ -0,0 +1,483 @@
+import collections, datetime, os, random, select, threading, time
+
+from SynScanProtocol import (UsageError, Model, Command, PassthroughCommand, TrackingMode, AxisId, FIXED_SLEW_RATES, SIDEREAL_RATE)
+
+# Length of every request in bytes, including the command character.
+REQUEST_LENGTHS = {
+        Command.GET_POSITION_RA_DEC           :  1,
+        Command.GET_POSITION_RA_DEC_PRECISE   :  1,
+        Command.GET_POSITION_AZM_ALT          :  1,
+        Command.GET_POSITION_AZM_ALT_PRECISE  :  1,
+        Command.GOTO_POSITION_RA_DEC          :  1 + 4 + 1 + 4,
+        Command.GOTO_POSITION_RA_DEC_PRECISE  :  1 + 8 + 1 + 8,
+        Command.GOTO_POSITION_AZM_ALT         :  1 + 4 + 1 + 4,
+        Command.GOTO_POSITION_AZM_ALT_PRECISE :  1 + 8 + 1 + 8,
+        Command.SYNC                          :  1 + 4 + 1 + 4,
+        Command.SYNC_PRECISE                  :  1 + 8 + 1 + 8,
+        Command.GET_TRACKING_MODE             :  1,
+        Command.SET_TRACKING_MODE             :  1 + 1,
+        Command.GET_LOCATION                  :  1,
+        Command.SET_LOCATION                  :  1 + 8,
+        Command.GET_TIME                      :  1,
+        Command.SET_TIME                      :  1 + 8,
+        Command.GET_VERSION                   :  1,
+        Command.GET_MODEL                     :  1,
+        Command.ECHO                          :  1 + 1,
+        Command.GET_ALIGNMENT_COMPLETE        :  1,
+        Command.GET_GOTO_IN_PROGRESS          :  1,
+        Command.CANCEL_GOTO                   :  1,
+        Command.PASSTHROUGH                   :  1 + 7
+    }
+
+_COMMANDS = {ord(command.value): command for command in Command}
+
+# Goto speed of each axis, in degrees / second.
+GOTO_RATE = FIXED_SLEW_RATES[9]
+
+
+def _shortest(delta):
+    # Shortest signed angular distance, in degrees.
+    return (delta + 180.0) % 360.0 - 180.0
+
+
+class SynScanSimulator:
+
+    # Protocol-level model of a SynScan hand controller with two motor axes.
+    #
+    # The mount is modelled as equatorially aligned: the AZM/ALT commands report the raw axis
+    # angles, the RA/DEC commands report the axis angles corrected for the rotation of the sky
+    # (and for any sync offset). With tracking enabled the first axis follows the sky at the
+    # sidereal rate, so the reported RA stays constant; with tracking off it drifts instead.
+    # Gotos move both axes at GOTO_RATE along the shortest path, slews at the fixed or variable
+    # rate that was commanded.
+
+    def __init__(self, version = (4, 21), model = Model.gt, deviceVersion = (7, 11), location = (0.0, 0.0), alignmentComplete = True, trackingMode = TrackingMode.OFF, clock = time.monotonic):
+
+        self.version = version
+        self.model = model
+        self.deviceVersion = deviceVersion
+        self.location = location
+        self.alignmentComplete = alignmentComplete
+        self.trackingMode = trackingMode
+
+        self._clock = clock
+        self._epoch = clock()
+        self._now = self._epoch
+
+        self._axes = [0.0, 0.0]     # degrees
+        self._rates = [0.0, 0.0]    # degrees / second, slews only
+        self._goto = None           # (RA/DEC target flag, first coordinate, second coordinate)
+        self._syncOffset = (0.0, 0.0)
+
+        self._timeOffset = datetime.timedelta(0)
+        self._timeZone = datetime.timezone.utc
+        self._dst = False
+
+        self._buffer = bytearray()
+        self._lock = threading.RLock()
+
+    @property
+    def clock(self):
+        return self._clock
+
+    # Motion model
+
+    def _siderealAngle(self, now):
+        return SIDEREAL_RATE * (now - self._epoch)
+
+    def _raDec(self, now):
+        return (
+                (self._axes[0] - self._siderealAngle(now) + self._syncOffset[0]) % 360.0,
+                (self._axes[1] + self._syncOffset[1]) % 360.0
+            )
+
+    def _gotoTarget(self, now):
+        (raDecFlag, first, second) = self._goto
+        if raDecFlag:
+            # RA/DEC targets move with the sky.
+            return ((first - self._syncOffset[0] + self._siderealAngle(now)) % 360.0, (second - self._syncOffset[1]) % 360.0)
+        return (first, second)
+
+    def advance(self, now = None):
+
+        with self._lock:
+
+            if now is None:
+                now = self._clock()
+
+            dt = now - self._now
+            if dt <= 0.0:
+                return
+            self._now = now
+
+            if self._goto is not None:
+                target = self._gotoTarget(now)
+                arrived = True
+                for axis in (0, 1):
+                    delta = _shortest(target[axis] - self._axes[axis])
+                    step = GOTO_RATE * dt
+                    if abs(delta) > step:
+                        delta = step if delta > 0 else -step
+                        arrived = False
+                    self._axes[axis] = (self._axes[axis] + delta) % 360.0
+                if arrived:
+                    self._goto = None
+                    self._axes[0] = target[0]
+                    self._axes[1] = target[1]
+            else:
+                for axis in (0, 1):
+                    self._axes[axis] = (self._axes[axis] + self._rates[axis] * dt) % 360.0
+
+            if self.trackingMode != TrackingMode.OFF and self._goto is None:
+                self._axes[0] = (self._axes[0] + SIDEREAL_RATE * dt) % 360.0
+
+    def axes(self, now = None):
+        with self._lock:
+            self.advance(now)
+            return tuple(self._axes)
+
+    def gotoInProgress(self):
+        return self._goto is not None
+
+    # Request processing
+
+    def feed(self, data, now = None):
+
+        # Consume request bytes (possibly partial, possibly several requests) and return the
+        # response bytes for every request that is complete.
+
+        with self._lock:
+
+            self._buffer += data
+            responses = []
+
+            while self._buffer:
+                command = _COMMANDS.get(self._buffer[0])
+                if command is None:
+                    # The hand controller silently ignores unknown command characters.
+                    del self._buffer[:1]
+                    continue
+                length = REQUEST_LENGTHS[command]
+                if len(self._buffer) < length:
+                    break
+                request = bytes(self._buffer[:length])
+                del self._buffer[:length]
+                responses.append(self.handle(command, request[1:], now))
+
+            return b''.join(responses)
+
+    def handle(self, command, arguments, now = None):
+
+        with self._lock:
+
+            self.advance(now)
+            now = self._now
+
+            if command in (Command.GET_POSITION_RA_DEC, Command.GET_POSITION_RA_DEC_PRECISE, Command.GET_POSITION_AZM_ALT, Command.GET_POSITION_AZM_ALT_PRECISE):
+                if command in (Command.GET_POSITION_RA_DEC, Command.GET_POSITION_RA_DEC_PRECISE):
+                    (first, second) = self._raDec(now)
+                else:
+                    (first, second) = self._axes
+                if command in (Command.GET_POSITION_RA_DEC_PRECISE, Command.GET_POSITION_AZM_ALT_PRECISE):
+                    return b"%08X,%08X#" % (round(first / 360.0 * 0x100000000) & 0xffffffff, round(second / 360.0 * 0x100000000) & 0xffffffff)
+                return b"%04X,%04X#" % (round(first / 360.0 * 0x10000) & 0xffff, round(second / 360.0 * 0x10000) & 0xffff)
+
+            if command in (Command.GOTO_POSITION_RA_DEC, Command.GOTO_POSITION_RA_DEC_PRECISE, Command.GOTO_POSITION_AZM_ALT, Command.GOTO_POSITION_AZM_ALT_PRECISE, Command.SYNC, Command.SYNC_PRECISE):
+                (first, second) = arguments.split(b",")
+                denominator = float(1 << (4 * len(first)))
+                first  = 360.0 * int(first, 16)  / denominator
+                second = 360.0 * int(second, 16) / denominator
+                if command in (Command.SYNC, Command.SYNC_PRECISE):
+                    (ra, dec) = self._raDec(now)
+                    self._syncOffset = (self._syncOffset[0] + first - ra, self._syncOffset[1] + second - dec)
+                else:
+                    raDecFlag = command in (Command.GOTO_POSITION_RA_DEC, Command.GOTO_POSITION_RA_DEC_PRECISE)
+                    self._goto = (raDecFlag, first, second)
+                    self._rates = [0.0, 0.0]
+                return b"#"
+
+            if command == Command.GET_TRACKING_MODE:
+                return bytes([self.trackingMode.value]) + b"#"
+
+            if command == Command.SET_TRACKING_MODE:
+                self.trackingMode = TrackingMode(arguments[0])
+                return b"#"
+
+            if command == Command.GET_LOCATION:
+                return self._encodeLocation() + b"#"
+
+            if command == Command.SET_LOCATION:
+                self.location = self._decodeLocation(arguments)
+                return b"#"
+
+            if command == Command.GET_TIME:
+                return self._encodeTime() + b"#"
+
+            if command == Command.SET_TIME:
+                self._decodeTime(arguments)
+                return b"#"
+
+            if command == Command.GET_VERSION:
+                return bytes(self.version) + b"#"
+
+            if command == Command.GET_MODEL:
+                return bytes([self.model.value]) + b"#"
+
+            if command == Command.ECHO:
+                return arguments + b"#"
+
+            if command == Command.GET_ALIGNMENT_COMPLETE:
+                return bytes([1 if self.alignmentComplete else 0]) + b"#"
+
+            if command == Command.GET_GOTO_IN_PROGRESS:
+                return b"1#" if self._goto is not None else b"0#"
+
+            if command == Command.CANCEL_GOTO:
+                self._goto = None
+                self._rates = [0.0, 0.0]
+                return b"#"
+
+            if command == Command.PASSTHROUGH:
+                return self._passthrough(arguments)
+
+            raise UsageError("handle() failed: unsupported command {}".format(command))
+
+    def _passthrough(self, arguments):
+
+        (length, destination, identifier, d1, d2, d3, response_length) = arguments
+
+        response = bytes(response_length)
+
+        if destination in (AxisId.AZM_RA_MOTOR.value, AxisId.ALT_DEC_MOTOR.value):
+
+            axis = 0 if destination == AxisId.AZM_RA_MOTOR.value else 1
+
+            if identifier == PassthroughCommand.GET_DEVICE_VERSION.value:
+                response = bytes(self.deviceVersion)[:response_length].ljust(response_length, b"\0")
+
+            elif identifier in (PassthroughCommand.MOTOR_SLEW_POSITIVE_FIXED_RATE.value, PassthroughCommand.MOTOR_SLEW_NEGATIVE_FIXED_RATE.value):
+                rate = FIXED_SLEW_RATES[min(d1, 9)]
+                if identifier == PassthroughCommand.MOTOR_SLEW_NEGATIVE_FIXED_RATE.value:
+                    rate = -rate
+                self._goto = None
+                self._rates[axis] = rate
+
+            elif identifier in (PassthroughCommand.MOTOR_SLEW_POSITIVE_VARIABLE_RATE.value, PassthroughCommand.MOTOR_SLEW_NEGATIVE_VARIABLE_RATE.value):
+                # rate is given in units of 1/4 arcsecond / second
+                rate = (d1 * 256 + d2) / 4.0 / 3600.0
+                if identifier == PassthroughCommand.MOTOR_SLEW_NEGATIVE_VARIABLE_RATE.value:
+                    rate = -rate
+                self._goto = None
+                self._rates[axis] = rate
+
+        return response + b"#"
+
+    # Location and time encoding, the inverse of the decoders in SynScanProtocol.
+
+    def _encodeLocation(self):
+
+        encoded = []
+
+        for value in self.location:
+            seconds = round(abs(value) * 3600)
+            encoded += [seconds // 3600, (seconds % 3600) // 60, seconds % 60, 1 if value < 0 else 0]
+
+        return bytes(encoded)
+
+    @staticmethod
+    def _decodeLocation(arguments):
+
+        location = []
+
+        for offset in (0, 4):
+            (degrees, minutes, seconds, sign) = arguments[offset:offset + 4]
+            value = degrees + minutes / 60.0 + seconds / 3600.0
+            location.append(-value if sign != 0 else value)
+
+        return tuple(location)
+
+    def _mountTime(self):
+        return (datetime.datetime.now(datetime.timezone.utc) + self._timeOffset).astimezone(self._timeZone)
+
+    def _encodeTime(self):
+
+        timestamp = self._mountTime()
+        zone = round(timestamp.utcoffset() / datetime.timedelta(hours = 1))
+        if zone < 0:
+            zone += 256
+
+        return bytes([timestamp.hour, timestamp.minute, timestamp.second, timestamp.month, timestamp.day, timestamp.year - 2000, zone, 1 if self._dst else 0])
+
+    def _decodeTime(self, arguments):
+
+        (hour, minute, second, month, day, year, zone, dst) = arguments
+
+        if zone >= 128:
+            zone -= 256
+
+        self._timeZone = datetime.timezone(datetime.timedelta(hours = zone))
+        self._dst = (dst != 0)
+
+        timestamp = datetime.datetime(year + 2000, month, day, hour, minute, second, 0, self._timeZone)
+        self._timeOffset = timestamp - datetime.datetime.now(datetime.timezone.utc)
+
+
+class SimulatedDevice:
+
+    # File-like stand-in for the serial port that SynScanController.connect() can attach to.
+    #
+    # Models the timing of a real link: every byte takes 10 bit times to transfer (8N1), requests
+    # are handled once their last byte has arrived, and the response starts after 'responseDelay'
+    # seconds. With baudrate = None all responses are available instantly. A non-zero
+    # 'byteLossProbability' drops response bytes at random, to exercise error recovery.
+
+    def __init__(self, simulator = None, baudrate = 9600, responseDelay = 0.0, timeout = 3.500, byteLossProbability = 0.0):
+        self.simulator = simulator if simulator is not None else SynScanSimulator()
+        self.baudrate = baudrate
+        self.responseDelay = responseDelay
+        self.timeout = timeout
+        self.byteLossProbability = byteLossProbability
+        self.is_open = True
+        self._pending = collections.deque() # (arrival time, byte value)
+        self._lineFree = 0.0                # end of the last transfer host -> hand controller
+        self._responseFree = 0.0            # end of the last transfer hand controller -> host
+        self._condition = threading.Condition()
+
+    def _byteTime(self):
+        return 10.0 / self.baudrate if self.baudrate else 0.0
+
+    def write(self, data):
+
+        with self._condition:
+
+            if not self.is_open:
+                raise UsageError("write() failed: device is closed")
+
+            now = time.monotonic()
+            byte_time = self._byteTime()
+
+            received = max(now, self._lineFree) + len(data) * byte_time
+            self._lineFree = received
+
+            response = self.simulator.feed(bytes(data), now = None if byte_time == 0.0 else received)
+
+            arrival = max(received + self.responseDelay, self._responseFree)
+            for value in response:
+                arrival += byte_time
+                if self.byteLossProbability and random.random() < self.byteLossProbability:
+                    continue
+                self._pending.append((arrival, value))
+            self._responseFree = arrival
+
+            self._condition.notify_all()
+
+        if byte_time != 0.0:
+            # Like a real UART, the write returns once the bytes are on the wire.
+            delay = received - time.monotonic()
+            if delay > 0.0:
+                time.sleep(delay)
+
+        return len(data)
+
+    def read(self, size = 1):
+        response = bytearray(size)
+        length = self.readinto(response)
+        return bytes(response[:length])
+
+    def readinto(self, buffer):
+
+        size = len(buffer)
+        length = 0
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        with self._condition:
+
+            while length < size:
+
+                now = time.monotonic()
+
+                while self._pending and self._pending[0][0] <= now and length < size:
+                    buffer[length] = self._pending.popleft()[1]
+                    length += 1
+
+                if length == size:
+                    break
+
+                wait = self._pending[0][0] - now if self._pending else None
+
+                if deadline is not None:
+                    if now >= deadline:
+                        break
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+
+                self._condition.wait(wait)
+
+        return length
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        with self._condition:
+            return sum(1 for (arrival, value) in self._pending if arrival <= now)
+
+    def reset_input_buffer(self):
+        with self._condition:
+            now = time.monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                self._pending.popleft()
+
+    def close(self):
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
+
+
+class SimulatedPty:
+
+    # Serves a SynScanSimulator on the master side of a pseudo terminal, so that the simulator can
+    # be used through a real serial port path: controller.connect(SimulatedPty().port).
+    # Only available on POSIX systems.
+
+    def __init__(self, simulator = None, baudrate = 9600, responseDelay = 0.0):
+
+        import tty
+
+        self.simulator = simulator if simulator is not None else SynScanSimulator()
+        self.baudrate = baudrate
+        self.responseDelay = responseDelay
+
+        (self._master, self._slave) = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        (self._wakeup, self._wakeupWrite) = os.pipe()
+        self._running = True
+        self._thread = threading.Thread(target = self._serve, name = "SimulatedPty", daemon = True)
+        self._thread.start()
+
+    def _serve(self):
+
+        byte_time = 10.0 / self.baudrate if self.baudrate else 0.0
+
+        while self._running:
+            (readable, _, _) = select.select([self._master, self._wakeup], [], [])
+            if self._wakeup in readable:
+                break
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                break
+            # Request bytes have already been transferred once they show up here; the response
+            # is paced at the configured baud rate.
+            response = self.simulator.feed(data)
+            if response:
+                time.sleep(self.responseDelay + len(response) * byte_time)
+                os.write(self._master, response)
+
+    def close(self):
+        if self._running:
+            self._running = False
+            os.write(self._wakeupWrite, b"x")
+            self._thread.join()
+            for fd in (self._master, self._slave, self._wakeup, self._wakeupWrite):
+                os.close(fd)
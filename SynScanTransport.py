@@ -0,0 +1,248 @@
+import select, socket, threading, time, urllib.parse
+
+import serial
+
+from SynScanProtocol import UsageError
+
+# Transports carry the byte stream between SynScanController and a hand controller. Any object with
+# the file-like subset the controller uses will do:
+#
+#   read(size)            block until 'size' bytes arrived or 'timeout' expired; may return fewer
+#   readinto(buffer)      optional; like read(len(buffer)), filling 'buffer', returns the count
+#   write(data)           send all bytes
+#   timeout               read timeout in seconds, settable
+#   close()
+#
+# and optionally writev(buffers) for scatter/gather writes of several requests at once,
+# reset_input_buffer() and in_waiting. serial.Serial already is one; this module adds socket and
+# in-memory transports, and openTransport() to create one from an address string.
+
+DEFAULT_BAUDRATE = 9600
+
+
+def openSerial(port, baudrate = DEFAULT_BAUDRATE, timeout = 3.500, readBufferSize = None, writeBufferSize = None):
+
+    device = serial.Serial(
+            port             = port,
+            baudrate         = baudrate,
+            bytesize         = serial.EIGHTBITS,
+            parity           = serial.PARITY_NONE,
+            stopbits         = serial.STOPBITS_ONE,
+            timeout          = timeout,
+            xonxoff          = 0,
+            rtscts           = False,
+            writeTimeout     = None,
+            dsrdtr           = False,
+            interCharTimeout = None
+        )
+
+    # Only the Windows driver lets us size its buffers.
+    if (readBufferSize or writeBufferSize) and hasattr(device, "set_buffer_size"):
+        device.set_buffer_size(rx_size = readBufferSize or 4096, tx_size = writeBufferSize)
+
+    return device
+
+
+class _SocketTransport:
+
+    def __init__(self, sock, timeout, receiveBufferSize, sendBufferSize):
+        if receiveBufferSize:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receiveBufferSize)
+        if sendBufferSize:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sendBufferSize)
+        self._socket = sock
+        self._received = bytearray() # bytes received but not read yet
+        self._chunk = bytearray(65536)
+        self._lock = threading.Lock()
+        self.timeout = timeout
+        self.is_open = True
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def _receive(self, wait):
+        # Wait up to 'wait' seconds (None: forever) for data; False on timeout.
+        self._socket.settimeout(wait)
+        try:
+            length = self._socket.recv_into(self._chunk)
+        except (socket.timeout, BlockingIOError):
+            return False
+        if length == 0:
+            raise ConnectionError("connection closed by peer")
+        self._received += memoryview(self._chunk)[:length]
+        return True
+
+    def _wait(self, size):
+        # Called with the lock held: receive until 'size' bytes are there or the timeout expired.
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while len(self._received) < size:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not self._receive(wait):
+                break
+
+    def read(self, size = 1):
+        with self._lock:
+            self._wait(size)
+            response = bytes(self._received[:size])
+            del self._received[:size]
+        return response
+
+    def readinto(self, buffer):
+        with self._lock:
+            self._wait(len(buffer))
+            length = min(len(buffer), len(self._received))
+            buffer[:length] = self._received[:length]
+            del self._received[:length]
+        return length
+
+    def write(self, data):
+        self._socket.sendall(data)
+        return len(data)
+
+    if hasattr(socket.socket, "sendmsg"):
+
+        # sendmsg() is Unix only. Without it there is no writev(), and the controller joins a
+        # burst into one write() instead.
+
+        def writev(self, buffers):
+
+            # One sendmsg() for all requests, without joining them first.
+
+            self._socket.settimeout(None)
+            total = sum(len(buffer) for buffer in buffers)
+            sent = self._socket.sendmsg(buffers)
+            if sent < total:
+                # Partial send (full socket buffer): fall back to sending the rest in one piece.
+                self._socket.sendall(b''.join(buffers)[sent:])
+            return total
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            readable = select.select([self._socket], [], [], 0)[0]
+            if readable:
+                self._receive(0.0)
+            return len(self._received)
+
+    def reset_input_buffer(self):
+        with self._lock:
+            while select.select([self._socket], [], [], 0)[0]:
+                if not self._receive(0.0):
+                    break
+            self._received.clear()
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self._socket.close()
+
+
+class TcpTransport(_SocketTransport):
+
+    # WiFi / Ethernet bridges exposing the hand controller port as a TCP byte stream.
+
+    def __init__(self, host, port, timeout = 3.500, connectTimeout = 5.0, noDelay = True, receiveBufferSize = None, sendBufferSize = None):
+        sock = socket.create_connection((host, port), timeout = connectTimeout)
+        if noDelay:
+            # Requests are tiny and latency-bound: never let Nagle hold them back.
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super(TcpTransport, self).__init__(sock, timeout, receiveBufferSize, sendBufferSize)
+
+
+class UdpTransport(_SocketTransport):
+
+    # Bridges that forward each datagram to the serial port and send the response bytes back as
+    # datagrams. A write is one datagram; responses are read as one continuous stream.
+
+    def __init__(self, host, port, timeout = 3.500, receiveBufferSize = None, sendBufferSize = None):
+        address = socket.getaddrinfo(host, port, type = socket.SOCK_DGRAM)[0]
+        sock = socket.socket(address[0], socket.SOCK_DGRAM)
+        sock.connect(address[4])
+        super(UdpTransport, self).__init__(sock, timeout, receiveBufferSize, sendBufferSize)
+
+    def write(self, data):
+        self._socket.settimeout(None)
+        self._socket.send(data)
+        return len(data)
+
+    if hasattr(socket.socket, "sendmsg"):
+
+        def writev(self, buffers):
+            self._socket.settimeout(None)
+            return self._socket.sendmsg(buffers)
+
+
+class MemoryTransport:
+
+    # In-process transport: every write is passed to 'respond' (bytes -> bytes, e.g. the feed()
+    # method of a SynScanSimulator) and the response is readable at once. No threads, no timing;
+    # for tests and for measuring the controller's own overhead.
+
+    def __init__(self, respond, timeout = 3.500):
+        self._respond = respond
+        self._received = bytearray()
+        self.timeout = timeout
+        self.is_open = True
+
+    def write(self, data):
+        self._received += self._respond(bytes(data))
+        return len(data)
+
+    def writev(self, buffers):
+        return self.write(b''.join(buffers))
+
+    def read(self, size = 1):
+        response = bytes(self._received[:size])
+        del self._received[:size]
+        return response
+
+    def readinto(self, buffer):
+        length = min(len(buffer), len(self._received))
+        buffer[:length] = self._received[:length]
+        del self._received[:length]
+        return length
+
+    @property
+    def in_waiting(self):
+        return len(self._received)
+
+    def reset_input_buffer(self):
+        self._received.clear()
+
+    def close(self):
+        self.is_open = False
+
+
+def openTransport(address, timeout = 3.500, baudrate = DEFAULT_BAUDRATE):
+
+    # Address forms:
+    #   COM4, /dev/ttyUSB0                 serial port at 'baudrate'
+    #   serial:///dev/ttyUSB0?baudrate=N   serial port, baud rate in the address
+    #   tcp://host:port                    TCP bridge
+    #   udp://host:port                    UDP bridge
+    #   memory://                          in-memory simulated hand controller
+    # Socket addresses take 'rcvbuf' and 'sndbuf' query parameters for the socket buffer sizes.
+
+    if "://" not in address:
+        return openSerial(address, baudrate, timeout)
+
+    url = urllib.parse.urlsplit(address)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    receiveBufferSize = int(query["rcvbuf"]) if "rcvbuf" in query else None
+    sendBufferSize = int(query["sndbuf"]) if "sndbuf" in query else None
+
+    if url.scheme == "serial":
+        return openSerial(url.netloc + url.path, int(query.get("baudrate", baudrate)), timeout)
+
+    if url.scheme in ("tcp", "udp"):
+        if url.hostname is None or url.port is None:
+            raise UsageError("openTransport() failed: address needs a host and a port: {}".format(repr(address)))
+        if url.scheme == "tcp":
+            return TcpTransport(url.hostname, url.port, timeout, receiveBufferSize = receiveBufferSize, sendBufferSize = sendBufferSize)
+        return UdpTransport(url.hostname, url.port, timeout, receiveBufferSize = receiveBufferSize, sendBufferSize = sendBufferSize)
+
+    if url.scheme == "memory":
+        from SynScanSimulator import SynScanSimulator
+        return MemoryTransport(SynScanSimulator().feed, timeout)
+
+    raise UsageError("openTransport() failed: unknown transport {}".format(repr(url.scheme)))
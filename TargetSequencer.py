@@ -0,0 +1,206 @@
+import collections, time
+
+import numpy as np
+
+from SynScanProtocol import UsageError, CoordinateMode, Requests, FIXED_SLEW_RATES
+
+# One executed goto: 'predicted' is the slew time of the model, 'actual' the time from the goto
+# being acknowledged until the first poll that reported it finished (so it is quantised by the
+# polling interval).
+SlewRecord = collections.namedtuple("SlewRecord", ["index", "target", "distance", "predicted", "actual"])
+
+
+class SlewModel:
+
+    # Slew time of a two-axis mount: both axes move at the same time, each at its own goto rate,
+    # so a goto takes as long as its slower axis, plus a constant settle time. Angles are taken
+    # modulo 360 degrees along the shortest path.
+
+    def __init__(self, rates = (FIXED_SLEW_RATES[9], FIXED_SLEW_RATES[9]), settleTime = 0.5):
+        self.rates = np.asarray(rates, dtype = np.float64)
+        self.settleTime = settleTime
+
+    @staticmethod
+    def distances(origins, destinations):
+        # |shortest angular distance| per axis, broadcast over origins and destinations: (..., 2)
+        delta = np.asarray(destinations, dtype = np.float64) - np.asarray(origins, dtype = np.float64)
+        return np.abs((delta + 180.0) % 360.0 - 180.0)
+
+    def predict(self, origins, destinations):
+        return np.max(self.distances(origins, destinations) / self.rates, axis = -1) + self.settleTime
+
+    def calibrate(self, records):
+
+        # Fit rates and settle time to executed slews: a least-squares line through
+        # (slow axis distance / rate, actual time) rescales the rates and sets the settle time.
+
+        records = [record for record in records if record.actual is not None]
+        if len(records) < 2:
+            return
+
+        distances = np.array([record.distance for record in records])
+        actual = np.array([record.actual for record in records])
+        x = np.max(distances / self.rates, axis = 1)
+
+        if np.ptp(x) == 0.0:
+            return
+
+        (slope, intercept) = np.polyfit(x, actual, 1)
+        if slope > 0.0:
+            self.rates = self.rates / slope
+        self.settleTime = max(0.0, float(intercept))
+
+
+class SequenceReport:
+
+    def __init__(self, order, records):
+        self.order = order
+        self.records = records
+
+    @property
+    def predicted(self):
+        return sum(record.predicted for record in self.records)
+
+    @property
+    def actual(self):
+        return sum(record.actual for record in self.records if record.actual is not None)
+
+    def summary(self):
+        lines = ["{:>5} {:>22} {:>10} {:>10} {:>8}".format("index", "target", "predicted", "actual", "error")]
+        for record in self.records:
+            actual = record.actual if record.actual is not None else float("nan")
+            lines.append("{:>5} {:>22} {:>9.2f}s {:>9.2f}s {:>+7.2f}s".format(
+                    record.index, "({:.3f}, {:.3f})".format(*record.target), record.predicted, actual, actual - record.predicted))
+        lines.append("total predicted {:.2f}s, actual {:.2f}s".format(self.predicted, self.actual))
+        return "\n".join(lines)
+
+
+def planOrder(start, targets, model, improve = True):
+
+    # Visiting order that keeps the total slew time short: greedy nearest neighbour by predicted
+    # slew time, then 2-opt moves on the open path while they pay off.
+
+    targets = np.asarray(targets, dtype = np.float64).reshape(-1, 2)
+    count = len(targets)
+    if count == 0:
+        return []
+
+    points = np.vstack((np.asarray(start, dtype = np.float64).reshape(1, 2), targets))
+    cost = model.predict(points[:, None, :], points[None, :, :]) # (count + 1, count + 1), node 0 = start
+
+    path = [0]
+    unvisited = np.ones(count + 1, dtype = bool)
+    unvisited[0] = False
+    for _ in range(count):
+        candidates = np.where(unvisited, cost[path[-1]], np.inf)
+        following = int(np.argmin(candidates))
+        path.append(following)
+        unvisited[following] = False
+
+    if improve:
+        path = np.array(path)
+        improved = True
+        while improved:
+            improved = False
+            for i in range(1, count):
+                # Reverse path[i:j + 1] if that shortens the path; the last segment has no successor.
+                a = path[i - 1]
+                b = path[i]
+                c = path[i + 1:]
+                d = np.append(path[i + 2:], -1)
+                before = cost[a, b] + np.where(d >= 0, cost[c, d], 0.0)
+                after = cost[a, c] + np.where(d >= 0, cost[b, d], 0.0)
+                gain = before - after
+                j = int(np.argmax(gain))
+                if gain[j] > 1e-9:
+                    path[i:i + j + 2] = path[i:i + j + 2][::-1]
+                    improved = True
+        path = path.tolist()
+
+    return [node - 1 for node in path[1:]]
+
+
+class TargetSequencer:
+
+    # Executes a list of goto targets. Targets are ordered to minimise the total slew time predicted
+    # by a SlewModel; while a slew runs, the sequencer sleeps through most of the predicted time,
+    # then polls getGotoInProgress with a growing interval instead of hammering the port, and builds
+    # the next goto request in the meantime. The report compares predicted and actual slew times.
+
+    def __init__(self, controller, model = None, coordinateMode = CoordinateMode.AZM_ALT, highPrecisionFlag = True, pollInterval = 0.100, maxPollInterval = 1.0, backoff = 1.5, timeout = 600.0):
+        self._controller = controller
+        self.model = model if model is not None else SlewModel()
+        self._coordinateMode = coordinateMode
+        self._highPrecisionFlag = highPrecisionFlag
+        self._pollInterval = pollInterval
+        self._maxPollInterval = maxPollInterval
+        self._backoff = backoff
+        self._timeout = timeout
+        self.pollCount = 0
+
+    def _wait(self, predicted, prepare):
+
+        # Wait for the running goto to finish; 'prepare' is called once, while waiting.
+
+        started = time.monotonic()
+
+        # Sleep through the bulk of the predicted slew; no point in asking before then.
+        prepare()
+        remaining = 0.8 * predicted - (time.monotonic() - started)
+        if remaining > 0.0:
+            time.sleep(remaining)
+
+        interval = self._pollInterval
+        while True:
+            self.pollCount += 1
+            if not self._controller.getGotoInProgress():
+                return time.monotonic() - started
+            if time.monotonic() - started > self._timeout:
+                self._controller.cancelGoto()
+                return None
+            time.sleep(interval)
+            interval = min(interval * self._backoff, self._maxPollInterval)
+
+    def run(self, targets, optimizeOrder = True, onArrival = None):
+
+        # targets: sequence of (first, second) coordinates in the sequencer's coordinate mode.
+        # onArrival(index, target) is called after each goto has finished, e.g. to take an exposure.
+
+        targets = [tuple(target) for target in targets]
+        if not targets:
+            return SequenceReport([], [])
+
+        for target in targets:
+            if len(target) != 2:
+                raise UsageError("run() failed: targets must be coordinate pairs, got {}".format(repr(target)))
+
+        position = self._controller.getPosition(self._coordinateMode, highPrecisionFlag = True)
+
+        order = planOrder(position, targets, self.model) if optimizeOrder else list(range(len(targets)))
+
+        records = []
+        prefetched = {}
+
+        def prefetch(index):
+            if index < len(order) and index not in prefetched:
+                (first, second) = targets[order[index]]
+                prefetched[index] = Requests.gotoPosition(first, second, self._coordinateMode, self._highPrecisionFlag)
+
+        prefetch(0)
+
+        for (step, index) in enumerate(order):
+
+            target = targets[index]
+            distance = tuple(SlewModel.distances(position, target))
+            predicted = float(self.model.predict(position, target))
+
+            self._controller.execute(prefetched.pop(step))
+            actual = self._wait(predicted, lambda: prefetch(step + 1))
+
+            records.append(SlewRecord(index, target, distance, predicted, actual))
+            position = target
+
+            if onArrival is not None:
+                onArrival(index, target)
+
+        return SequenceReport(order, records)
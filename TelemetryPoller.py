@@ -0,0 +1,117 @@
+import collections, threading, time
+
+from SynScanProtocol import Requests, CoordinateMode
+
+# Immutable state of the mount as seen by the last poll. 'timestamp' is the host's time.monotonic()
+# when the sample was taken, 'error' the message of the last failed poll (None if it succeeded).
+Telemetry = collections.namedtuple("Telemetry", ["sequence", "timestamp", "position", "gotoInProgress", "trackingMode", "location", "error"])
+
+_EMPTY = Telemetry(0, None, None, None, None, None, None)
+
+
+class TelemetryPoller:
+
+    # Samples position, goto state and tracking mode in a single pipelined burst at a fixed rate,
+    # on a dedicated thread. Others sharing the controller must hold 'lock' while they use it, so
+    # that their bytes cannot interleave with a poll on the port. Every sample is
+    # published as a new Telemetry tuple; readers just pick up the 'snapshot' attribute, which is
+    # replaced atomically, so any number of them can read without locking or touching the port.
+    # The location hardly ever changes and is only read when the poller starts or on request.
+
+    def __init__(self, controller, rate = 2.0, coordinateMode = CoordinateMode.RA_DEC, highPrecisionFlag = False, onUpdate = None, lock = None):
+        self._controller = controller
+        self._lock = lock if lock is not None else threading.Lock()
+        self._period = 1.0 / rate
+        self._coordinateMode = coordinateMode
+        self._highPrecisionFlag = highPrecisionFlag
+        self._onUpdate = onUpdate
+        self._snapshot = _EMPTY
+        self._refreshLocation = True
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def lock(self):
+        return self._lock
+
+    @property
+    def rate(self):
+        return 1.0 / self._period
+
+    @rate.setter
+    def rate(self, rate):
+        self._period = 1.0 / rate
+
+    def refreshLocation(self):
+        self._refreshLocation = True
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target = self._run, name = "TelemetryPoller", daemon = True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def poll(self):
+
+        # Take one sample and publish it. Called by the polling thread, but may also be used
+        # directly when the poller is not running.
+
+        previous = self._snapshot
+
+        transactions = [
+                Requests.getPosition(self._coordinateMode, self._highPrecisionFlag),
+                Requests.getGotoInProgress(),
+                Requests.getTrackingMode()
+            ]
+
+        refreshLocation = self._refreshLocation
+        if refreshLocation:
+            transactions.append(Requests.getLocation())
+
+        timestamp = time.monotonic()
+
+        try:
+            with self._lock:
+                results = self._controller.execute(*transactions)
+        except Exception as exception:
+            # Not only protocol errors: OSError from the port or QueueFullError / UsageError from an
+            # arbiter must show up in the snapshot too, instead of ending the polling thread.
+            snapshot = previous._replace(sequence = previous.sequence + 1, error = str(exception))
+        else:
+            if refreshLocation:
+                self._refreshLocation = False
+                location = results[3]
+            else:
+                location = previous.location
+            snapshot = Telemetry(previous.sequence + 1, timestamp, results[0], results[1], results[2], location, None)
+
+        self._snapshot = snapshot
+
+        if self._onUpdate is not None:
+            self._onUpdate(snapshot)
+
+        return snapshot
+
+    def _run(self):
+
+        deadline = time.monotonic()
+
+        while not self._stop.is_set():
+            self.poll()
+            deadline += self._period
+            delay = deadline - time.monotonic()
+            if delay < 0.0:
+                # Fell behind (slow link or a long timeout): don't try to catch up with a burst.
+                deadline = time.monotonic()
+                delay = 0.0
+            self._stop.wait(delay)
@@ -1,16 +1,16 @@
-# This Python file uses the following encoding: utf-8
-from PySide2 import QtCore
-from PySide2 import QtWidgets
+from SynScanProtocol import SynScanController
+from SynScanSimulator import SynScanSimulator, SimulatedDevice
 
-class TestController:
-    def __init__(self, com_port):
-        pass
+class TestController(SynScanController):
 
-    def close(self):
-        pass
+    # SynScanController talking to a simulated hand controller instead of a real mount.
+    # The port passed to connect() is ignored.
 
-    def slew_fixed(axisId, speed):
-        pass
+    def __init__(self, com_port = None, simulator = None, baudrate = 9600, responseDelay = 0.0):
+        super(TestController, self).__init__()
+        self.simulator = simulator if simulator is not None else SynScanSimulator()
+        self._baudrate = baudrate
+        self._responseDelay = responseDelay
 
-    def connect(self, port):
-        pass
+    def connect(self, port = None, timeout = 3.500):
+        super(TestController, self).connect(SimulatedDevice(self.simulator, self._baudrate, self._responseDelay, timeout))
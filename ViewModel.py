@@ -1,91 +1,221 @@
-from PySide2.QtCore import QObject, Slot, Property, Signal
+from PySide2.QtCore import QObject, QThread, Slot, Property, Signal
 
 from SynScanProtocol import SynScanController, AxisId
+from TelemetryPoller import TelemetryPoller
+from CommandArbiter import CommandArbiter, Priority
+from SlewControl import SlewControl
+
+
+class _Worker(QObject):
+
+    # Lives on the worker thread: everything that may block on the port (opening and closing it,
+    # starting and stopping the I/O threads) runs here, never on the GUI thread.
+
+    connectFinished = Signal(bool, str)
+    disconnectFinished = Signal()
+
+    def __init__(self, controller, arbiter, slew, poller):
+        super(_Worker, self).__init__()
+        self._controller = controller
+        self._arbiter = arbiter
+        self._slew = slew
+        self._poller = poller
+
+    @Slot(str)
+    def connectPort(self, port):
+        try:
+            self._controller.connect(port)
+        except Exception as exception:
+            self.connectFinished.emit(False, str(exception))
+            return
+        self._arbiter.start()
+        self._slew.start()
+        self._poller.refreshLocation()
+        self._poller.start()
+        self.connectFinished.emit(True, "")
+
+    @Slot()
+    def disconnectPort(self):
+        self._poller.stop()
+        self._slew.close()
+        self._arbiter.stop()
+        self._controller.close()
+        self.disconnectFinished.emit()
 
-import threading
-import time
 
 class ViewModel(QObject):
-    def __init__(self, controller, parent=None):
+
+    # Nothing in here blocks the GUI thread: connecting and disconnecting run on a worker QThread,
+    # slews only set the desired rate for SlewControl, and telemetry arrives from the poller thread
+    # through a queued signal. Telemetry is coalesced: however many samples arrive while the GUI
+    # thread is busy, it applies only the latest, and all its properties share one notify signal,
+    # so a sample causes at most one repaint.
+
+    _connectRequested = Signal(str)
+    _disconnectRequested = Signal()
+    _telemetryAvailable = Signal()
+
+    def __init__(self, controller, pollRate = 2.0, parent=None):
         super(ViewModel, self).__init__(parent)
         self._controller = controller
         self._connected = False
-        self._positionUpdaterThread = None
-
-    locationChanged = Signal()
-    def getLocation(self):
+        self._busy = False
+        self._lastError = ""
+        self._telemetry = None
+        self._latest = None
+        self._telemetryQueued = False
+        # All serial traffic goes through the arbiter: slews preempt the telemetry poller.
+        self._arbiter = CommandArbiter(controller)
+        self._slew = SlewControl(self._arbiter.client(Priority.SLEW))
+        self._poller = TelemetryPoller(self._arbiter.client(Priority.TELEMETRY), rate = pollRate, onUpdate = self._onTelemetry)
+
+        self._thread = QThread()
+        self._thread.setObjectName("ViewModelWorker")
+        self._worker = _Worker(controller, self._arbiter, self._slew, self._poller)
+        self._worker.moveToThread(self._thread)
+        self._connectRequested.connect(self._worker.connectPort)
+        self._disconnectRequested.connect(self._worker.disconnectPort)
+        self._worker.connectFinished.connect(self._onConnectFinished)
+        self._worker.disconnectFinished.connect(self._onDisconnectFinished)
+        self._telemetryAvailable.connect(self._applyTelemetry)
+        self._thread.start()
+
+    def shutdown(self):
+        # Blocking; for application exit, after the event loop has finished.
         if self._connected:
-            latitude, longitude = self._controller.getLocation()
-            return str(latitude) + ',' + str(longitude)
-        return "disconnected"
+            self._worker.disconnectPort()
+        self._thread.quit()
+        self._thread.wait()
 
-    def updateLocation(self):
-        self.locationChanged.emit()
+    # Telemetry
 
-    location = Property(str, getLocation, notify = locationChanged)
+    def _onTelemetry(self, snapshot):
+        # Called on the poller thread: keep the latest sample, wake the GUI thread once.
+        self._latest = snapshot
+        if not self._telemetryQueued:
+            self._telemetryQueued = True
+            self._telemetryAvailable.emit()
 
-    positionChanged = Signal()
-    def getPosition(self):
-        if self._connected:
-            ra, dec = self._controller.getPosition()
-            return "RA: " + str(ra) + ", DEC: " + str(dec)
-        return "disconnected"
+    @Slot()
+    def _applyTelemetry(self):
+        self._telemetryQueued = False
+        snapshot = self._latest
+        if not self._connected or snapshot is None or snapshot is self._telemetry:
+            return
+        self._telemetry = snapshot
+        self.telemetryChanged.emit()
+
+    telemetryChanged = Signal()
+
+    def _field(self, name, default):
+        if self._telemetry is None:
+            return default
+        value = getattr(self._telemetry, name)
+        return default if value is None else value
+
+    def getHasLocation(self):
+        return self._field("location", None) is not None
+
+    def getLatitude(self):
+        return float(self._field("location", (0.0, 0.0))[0])
+
+    def getLongitude(self):
+        return float(self._field("location", (0.0, 0.0))[1])
 
-    def updatePosition(self):
-        self.positionChanged.emit()
+    def getHasPosition(self):
+        return self._field("position", None) is not None
 
-    position = Property(str, getPosition, notify = positionChanged)
+    def getRightAscension(self):
+        return float(self._field("position", (0.0, 0.0))[0])
 
-    def positionUpdater(self):
-        while(self._connected):
-            self.updatePosition()
-            time.sleep(1)
+    def getDeclination(self):
+        return float(self._field("position", (0.0, 0.0))[1])
+
+    def getGotoInProgress(self):
+        return bool(self._field("gotoInProgress", False))
+
+    def getTrackingMode(self):
+        return int(self._field("trackingMode", 0))
+
+    def getTelemetryError(self):
+        return self._field("error", "")
+
+    hasLocation    = Property(bool,  getHasLocation,    notify = telemetryChanged)
+    latitude       = Property(float, getLatitude,       notify = telemetryChanged)
+    longitude      = Property(float, getLongitude,      notify = telemetryChanged)
+    hasPosition    = Property(bool,  getHasPosition,    notify = telemetryChanged)
+    rightAscension = Property(float, getRightAscension, notify = telemetryChanged)
+    declination    = Property(float, getDeclination,    notify = telemetryChanged)
+    gotoInProgress = Property(bool,  getGotoInProgress, notify = telemetryChanged)
+    trackingMode   = Property(int,   getTrackingMode,   notify = telemetryChanged)
+    telemetryError = Property(str,   getTelemetryError, notify = telemetryChanged)
+
+    # Connection
 
     connectionStateChanged = Signal()
+
     @Slot(str)
     def connect(self, port):
-        if not self._connected:
-            self._controller.connect(port)
-            self._connected = True
+        if not self._connected and not self._busy:
+            self._busy = True
+            self._lastError = ""
+            self.connectionStateChanged.emit()
+            self._connectRequested.emit(port)
+
+    @Slot()
+    def disconnect(self):
+        if self._connected and not self._busy:
+            self._busy = True
+            self._connected = False
             self.connectionStateChanged.emit()
+            self._disconnectRequested.emit()
+
+    @Slot(bool, str)
+    def _onConnectFinished(self, success, error):
+        self._busy = False
+        self._connected = success
+        self._lastError = error
+        self.connectionStateChanged.emit()
 
-        self.updateLocation()
-        self.updatePosition()
-        #self._positionUpdaterThread = threading.Thread(target=self.positionUpdater)
-        #self._positionUpdaterThread.start()
+    @Slot()
+    def _onDisconnectFinished(self):
+        self._busy = False
+        self._telemetry = None
+        self._latest = None
+        self.connectionStateChanged.emit()
+        self.telemetryChanged.emit()
 
     def getConnectionState(self):
         return self._connected
 
-    connected = Property(bool, getConnectionState, notify = connectionStateChanged)
+    def getBusy(self):
+        return self._busy
 
-    @Slot()
-    def disconnect(self):
-        if self._connected:
-            self._controller.close()
-            self._connected = False
-            self.connectionStateChanged.emit()
-        self.updateLocation()
-        self.updatePosition()
+    def getLastError(self):
+        return self._lastError
+
+    connected = Property(bool, getConnectionState, notify = connectionStateChanged)
+    busy      = Property(bool, getBusy,            notify = connectionStateChanged)
+    lastError = Property(str,  getLastError,       notify = connectionStateChanged)
 
+    # Slewing; these only record the desired rate, SlewControl sends it.
 
     @Slot()
     def on_slewStop(self):
-        self._controller.slew_fixed(AxisId.ALT_DEC_MOTOR, 0)
-        self._controller.slew_fixed(AxisId.AZM_RA_MOTOR, 0)
+        self._slew.stop()
 
     @Slot(int)
     def on_slewLeftButton(self, speed):
-        self._controller.slew_fixed(AxisId.AZM_RA_MOTOR, -speed)
+        self._slew.setRate(AxisId.AZM_RA_MOTOR, -speed)
 
     @Slot(int)
     def on_slewRightButton(self, speed):
-        self._controller.slew_fixed(AxisId.AZM_RA_MOTOR, speed)
+        self._slew.setRate(AxisId.AZM_RA_MOTOR, speed)
 
     @Slot(int)
     def on_slewUpButton(self, speed):
-        self._controller.slew_fixed(AxisId.ALT_DEC_MOTOR, speed)
+        self._slew.setRate(AxisId.ALT_DEC_MOTOR, speed)
 
     @Slot(int)
     def on_slewDownButton(self, speed):
-        self._controller.slew_fixed(AxisId.ALT_DEC_MOTOR, -speed)
+        self._slew.setRate(AxisId.ALT_DEC_MOTOR, -speed)
@@ -1,28 +1,79 @@
-import sys
-import serial.tools.list_ports
+import sys, time
 
-from PySide2.QtWidgets import QApplication
-from PySide2.QtCore import QStringListModel
-from PySide2.QtQml import QQmlApplicationEngine
+# Taken before anything else is imported, so that the startup profile covers the imports too.
+_started = time.perf_counter()
 
-from ViewModel import ViewModel
-from SynScanProtocol import SynScanController
-from TestController import TestController
+import argparse
 
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
+from StartupProfile import StartupProfile
+
+# Seconds from process start to the first frame of the window.
+STARTUP_BUDGET = 1.5
+
+
+def main(argv = None):
+
+    # Shows the window first: Qt and the protocol modules are imported on demand, pyserial only
+    # once the port monitor runs (after the first frame) or a port is opened, and the port list
+    # fills in from the background.
+
+    parser = argparse.ArgumentParser(description = "SynScan hand controller GUI.")
+    parser.add_argument("--startup-budget", type = float, default = STARTUP_BUDGET, help = "startup time budget in seconds, up to the first frame")
+    parser.add_argument("--profile-startup", action = "store_true", help = "print the startup profile (always printed when over budget)")
+    (args, qtArguments) = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+
+    profile = StartupProfile(args.startup_budget, _started)
+
+    QtCore = profile.importModule("PySide2.QtCore")
+    QtGui = profile.importModule("PySide2.QtGui")
+    QtQml = profile.importModule("PySide2.QtQml")
+
+    # The QML view only needs a QGuiApplication, not QtWidgets.
+    app = QtGui.QGuiApplication([sys.argv[0]] + qtArguments)
+    profile.mark("application created")
+
+    ViewModel = profile.importModule("ViewModel").ViewModel
+    SynScanController = profile.importModule("SynScanProtocol").SynScanController
+    profile.mark("modules imported")
 
-    com_ports = QStringListModel(([comport.device for comport in serial.tools.list_ports.comports()]))
     controller = SynScanController()
-    #controller = TestController("COM4")
+    #controller = profile.importModule("TestController").TestController("COM4")
     view_model = ViewModel(controller)
 
-    engine = QQmlApplicationEngine()
+    # Empty until the port monitor's first enumeration arrives.
+    com_ports = QtCore.QStringListModel()
+
+    engine = QtQml.QQmlApplicationEngine()
     engine.rootContext().setContextProperty("comPortsModel", com_ports)
     engine.rootContext().setContextProperty("viewModel", view_model)
     engine.load('MainView.qml')
+    profile.mark("window loaded")
+
+    monitors = []
+
+    def onFirstFrame():
+        window.frameSwapped.disconnect(onFirstFrame)
+        profile.mark("first frame")
+        if args.profile_startup or profile.overBudget():
+            print(profile.report(), file = sys.stderr)
+        monitor = profile.importModule("PortMonitor").PortMonitor()
+        monitor.portsChanged.connect(com_ports.setStringList)
+        monitor.start()
+        monitors.append(monitor)
 
-    app.exec_()
-    controller.close()
+    if not engine.rootObjects():
+        return 1
+    window = engine.rootObjects()[0]
+    window.frameSwapped.connect(onFirstFrame)
 
+    result = app.exec_()
 
+    for monitor in monitors:
+        monitor.stop()
+    view_model.shutdown()
+
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,371 @@
+import pytest
+
+from SynScanProtocol import SynScanController, ResponseTimeoutError, ProtocolError, PassthroughError, Command, PassthroughCommand, CoordinateMode, TrackingMode, AxisId, Requests
+from SynScanSimulator import SynScanSimulator, SimulatedDevice
+
+
+class UnpluggedDevice(SimulatedDevice):
+
+    # Fails every write with OSError while 'unplugged' is set.
+
+    unplugged = False
+
+    def write(self, data):
+        if self.unplugged:
+            raise OSError("device unplugged")
+        return super(UnpluggedDevice, self).write(data)
+
+
+def trainedController(delay, samples = 40):
+    device = SimulatedDevice(SynScanSimulator(trackingMode = TrackingMode.EQ_NORTH), baudrate = None, responseDelay = delay)
+    controller = SynScanController(cacheTimeToLive = None)
+    controller.connect(device, timeout = 1.0)
+    for i in range(samples):
+        controller.getTrackingMode()
+    return (controller, device)
+
+
+def test_jitter_within_deadline_floor():
+    (controller, device) = trainedController(0.020)
+    device.responseDelay = 0.028
+    assert controller.getTrackingMode() == TrackingMode.EQ_NORTH.value
+    assert controller.timeoutCount == 0
+
+
+def test_late_response_is_drained():
+    (controller, device) = trainedController(0.020)
+
+    device.responseDelay = 0.080
+    with pytest.raises(ResponseTimeoutError):
+        controller.getTrackingMode()
+
+    # The late response must not be taken for the response to the next requests.
+    device.responseDelay = 0.020
+    assert controller.getGotoInProgress() is False
+    assert controller.getTrackingMode() == TrackingMode.EQ_NORTH.value
+    assert controller.execute(Requests.getTrackingMode(), Requests.getGotoInProgress()) == [TrackingMode.EQ_NORTH.value, False]
+
+
+def test_getter_before_setter_in_burst_is_not_cached():
+    controller = SynScanController()
+    controller.connect(SimulatedDevice(SynScanSimulator(location = (10.0, 20.0)), baudrate = None))
+    (before, _) = controller.execute(Requests.getLocation(), Requests.setLocation(48.0, 11.0))
+    assert before == (10.0, 20.0)
+    assert controller.getLocation() == (48.0, 11.0)
+
+
+def test_async_late_response_is_drained():
+    import asyncio
+    from AsyncSynScanController import AsyncSynScanController
+
+    async def run():
+        device = SimulatedDevice(SynScanSimulator(trackingMode = TrackingMode.EQ_NORTH), baudrate = None, responseDelay = 0.080)
+        controller = AsyncSynScanController()
+        await controller.connect(device)
+        with pytest.raises(asyncio.TimeoutError):
+            await controller.getTrackingMode(timeout = 0.050)
+        device.responseDelay = 0.020
+        assert await controller.getGotoInProgress() is False
+        assert await controller.getTrackingMode() == TrackingMode.EQ_NORTH.value
+        await controller.close()
+
+    asyncio.run(run())
+
+
+def test_server_cache_is_dropped_by_goto():
+    from SynScanServer import SynScanServer, SynScanClient
+
+    controller = SynScanController()
+    controller.connect(SimulatedDevice(SynScanSimulator(), baudrate = None))
+    server = SynScanServer(controller, address = ("127.0.0.1", 0), cacheTimeToLive = 10.0)
+    server.start()
+    client = SynScanClient()
+    client.connect(server.address)
+    try:
+        assert client.getGotoInProgress() is False
+        client.gotoPosition(90.0, 45.0)
+        assert client.getGotoInProgress() is True
+        client.cancelGoto()
+        assert client.getGotoInProgress() is False
+    finally:
+        client.close()
+        server.close()
+
+
+def test_poller_survives_port_errors():
+    from TelemetryPoller import TelemetryPoller
+
+    device = UnpluggedDevice(SynScanSimulator(), baudrate = None)
+    controller = SynScanController()
+    controller.connect(device)
+    poller = TelemetryPoller(controller)
+
+    assert poller.poll().error is None
+    device.unplugged = True
+    assert poller.poll().error == "device unplugged"
+    device.unplugged = False
+    snapshot = poller.poll()
+    assert snapshot.error is None
+    assert snapshot.sequence == 3
+
+
+def test_slew_control_start_sends_nothing():
+    import time
+    from SlewControl import SlewControl
+
+    simulator = SynScanSimulator()
+    controller = SynScanController()
+    controller.connect(SimulatedDevice(simulator, baudrate = None))
+    controller.gotoPosition(90.0, 45.0)
+
+    slewControl = SlewControl(controller)
+    slewControl.start()
+    time.sleep(0.050)
+    assert slewControl.sentCount == 0
+    assert controller.getGotoInProgress() is True
+
+    slewControl.stop()
+    while slewControl.pending():
+        time.sleep(0.005)
+    slewControl.close()
+    assert slewControl.sentCount == 2
+    assert controller.getGotoInProgress() is False
+
+
+def test_position_stream_survives_port_errors():
+    import time
+    from PositionStream import PositionStream
+
+    device = UnpluggedDevice(SynScanSimulator(), baudrate = None)
+    controller = SynScanController()
+    controller.connect(device)
+    stream = PositionStream(controller, interval = 0.010)
+
+    device.unplugged = True
+    stream.start()
+    try:
+        time.sleep(0.100)
+        assert isinstance(stream.lastError, OSError)
+        assert stream.errorCount >= 1
+        assert len(stream.history) == 0
+        device.unplugged = False
+        deadline = time.monotonic() + 2.0
+        while len(stream.history) == 0 and time.monotonic() < deadline:
+            time.sleep(0.010)
+        assert len(stream.history) > 0
+    finally:
+        stream.stop()
+
+
+def test_async_controller_uses_transports_and_capabilities():
+    import asyncio
+    from AsyncSynScanController import AsyncSynScanController
+    from SynScanProtocol import Capabilities, UnsupportedCommandError
+    from SynScanMetrics import Metrics
+
+    async def run():
+        controller = AsyncSynScanController()
+        await controller.connect("memory://")
+        controller.metrics = Metrics()
+        assert await controller.execute(Requests.getVersion(), Requests.getGotoInProgress()) == [(4, 21), False]
+        assert controller.metrics.bytesSent == 2
+        controller.capabilities = Capabilities((4, 6))
+        with pytest.raises(UnsupportedCommandError):
+            await controller.sync(10.0, 20.0)
+        assert controller.metrics.bytesSent == 2
+        await controller.close()
+
+    asyncio.run(run())
+
+
+def test_arbiter_invalidates_on_its_own_thread():
+    import threading
+    from CommandArbiter import CommandArbiter
+    from SynScanProtocol import Command
+
+    threads = []
+
+    class RecordingController(SynScanController):
+        def invalidate(self, *fields):
+            threads.append(threading.current_thread())
+            super(RecordingController, self).invalidate(*fields)
+
+    simulator = SynScanSimulator(location = (10.0, 20.0))
+    controller = RecordingController()
+    controller.connect(SimulatedDevice(simulator, baudrate = None))
+    arbiter = CommandArbiter(controller)
+    arbiter.start()
+    try:
+        client = arbiter.client()
+        assert client.getLocation() == (10.0, 20.0)
+        simulator.location = (48.0, 11.0)
+        assert client.getLocation() == (10.0, 20.0) # cached
+        arbiter.invalidate(Command.GET_LOCATION)
+        assert client.getLocation() == (48.0, 11.0)
+        assert threads and threading.current_thread() not in threads
+    finally:
+        arbiter.stop()
+
+
+def _baseline(*args):
+    # The request bytes as the original public methods composed them: arguments through _to_bytes().
+    return SynScanController._to_bytes(args)
+
+
+def _baselineCoordinates(command, first, second, highPrecisionFlag):
+    if highPrecisionFlag:
+        return _baseline(command, "{:08x},{:08x}".format(round(first / 360.0 * 0x100000000), round(second / 360.0 * 0x100000000)))
+    return _baseline(command, "{:04x},{:04x}".format(round(first / 360.0 * 0x10000), round(second / 360.0 * 0x10000)))
+
+
+def _baselinePassthrough(axisId, command, expected_response_bytes):
+    command_bytes = SynScanController._to_bytes(command)
+    return _baseline(Command.PASSTHROUGH, len(command_bytes), axisId, command_bytes, bytes(4 - len(command_bytes)), expected_response_bytes)
+
+
+def test_requests_match_baseline_encoding():
+    import datetime
+
+    zone = datetime.timezone(datetime.timedelta(hours = -5))
+
+    table = [
+            (Requests.getPosition(CoordinateMode.RA_DEC, False),  _baseline(Command.GET_POSITION_RA_DEC)),
+            (Requests.getPosition(CoordinateMode.RA_DEC, True),   _baseline(Command.GET_POSITION_RA_DEC_PRECISE)),
+            (Requests.getPosition(CoordinateMode.AZM_ALT, False), _baseline(Command.GET_POSITION_AZM_ALT)),
+            (Requests.getPosition(CoordinateMode.AZM_ALT, True),  _baseline(Command.GET_POSITION_AZM_ALT_PRECISE)),
+            (Requests.getTrackingMode(),                          _baseline(Command.GET_TRACKING_MODE)),
+            (Requests.getLocation(),                              _baseline(Command.GET_LOCATION)),
+            (Requests.setLocation(48.1375, 11.575),               _baseline(Command.SET_LOCATION, 48, 8, 15, 0, 11, 34, 30, 0)),
+            (Requests.setLocation(-33.5, -70.25),                 _baseline(Command.SET_LOCATION, 33, 30, 0, 1, 70, 15, 0, 1)),
+            (Requests.getTime(),                                  _baseline(Command.GET_TIME)),
+            (Requests.setTime(datetime.datetime(2024, 3, 1, 12, 30, 5, tzinfo = zone), True), _baseline(Command.SET_TIME, 12, 30, 5, 3, 1, 24, 256 - 5, True)),
+            (Requests.getVersion(),                               _baseline(Command.GET_VERSION)),
+            (Requests.getModel(),                                 _baseline(Command.GET_MODEL)),
+            (Requests.echo(0x5a),                                 _baseline(Command.ECHO, 0x5a)),
+            (Requests.getAlignmentComplete(),                     _baseline(Command.GET_ALIGNMENT_COMPLETE)),
+            (Requests.getGotoInProgress(),                        _baseline(Command.GET_GOTO_IN_PROGRESS)),
+            (Requests.cancelGoto(),                               _baseline(Command.CANCEL_GOTO)),
+            # The original setTrackingMode() sent GET_TRACKING_MODE by mistake.
+            (Requests.setTrackingMode(TrackingMode.EQ_SOUTH),     _baseline(Command.SET_TRACKING_MODE, TrackingMode.EQ_SOUTH))
+        ]
+
+    for axisId in AxisId:
+        table += [
+                (Requests.passthrough(axisId, [PassthroughCommand.MOTOR_SLEW_POSITIVE_FIXED_RATE], 0), _baselinePassthrough(axisId, [PassthroughCommand.MOTOR_SLEW_POSITIVE_FIXED_RATE], 0)),
+                (Requests.passthrough(axisId, [1, 2, 3, 4], 3),   _baselinePassthrough(axisId, [1, 2, 3, 4], 3)),
+                (Requests.slew_fixed(axisId, 7),                  _baselinePassthrough(axisId, [PassthroughCommand.MOTOR_SLEW_POSITIVE_FIXED_RATE, 7], 0)),
+                (Requests.slew_fixed(axisId, -9),                 _baselinePassthrough(axisId, [PassthroughCommand.MOTOR_SLEW_NEGATIVE_FIXED_RATE, 9], 0)),
+                (Requests.slew_fixed(axisId, 0),                  _baselinePassthrough(axisId, [PassthroughCommand.MOTOR_SLEW_POSITIVE_FIXED_RATE, 0], 0)),
+                (Requests.slew_variable(axisId, 0.5),             _baselinePassthrough(axisId, [PassthroughCommand.MOTOR_SLEW_POSITIVE_VARIABLE_RATE, 7200 // 256, 7200 % 256], 0)),
+                (Requests.slew_variable(axisId, -1.25),           _baselinePassthrough(axisId, [PassthroughCommand.MOTOR_SLEW_NEGATIVE_VARIABLE_RATE, 18000 // 256, 18000 % 256], 0)),
+                (Requests.getDeviceVersion(axisId),               _baselinePassthrough(axisId, PassthroughCommand.GET_DEVICE_VERSION, 2))
+            ]
+
+    # Coordinates. The original code could not encode negative angles or 360 degrees (it sent a
+    # minus sign or nine digits); they now encode like the same direction within [0, 360). The
+    # original sync() had a format string bug and sent nothing; its encoding is that of goto.
+    angles = [(0.0, 0.0), (12.5, 89.999), (180.0, 45.0), (359.9, 270.0), (-10.0, -45.0), (360.0, -0.5), (720.5, -360.0)]
+    for (first, second) in angles:
+        wrapped = (first % 360.0, second % 360.0)
+        for precise in (False, True):
+            table += [
+                    (Requests.gotoPosition(first, second, CoordinateMode.AZM_ALT, precise), _baselineCoordinates(Command.GOTO_POSITION_AZM_ALT_PRECISE if precise else Command.GOTO_POSITION_AZM_ALT, *wrapped, precise)),
+                    (Requests.gotoPosition(first, second, CoordinateMode.RA_DEC, precise),  _baselineCoordinates(Command.GOTO_POSITION_RA_DEC_PRECISE if precise else Command.GOTO_POSITION_RA_DEC, *wrapped, precise)),
+                    (Requests.sync(first, second, precise),                                 _baselineCoordinates(Command.SYNC_PRECISE if precise else Command.SYNC, *wrapped, precise))
+                ]
+
+    for (transaction, expected) in table:
+        assert bytes(transaction.request) == expected, (transaction.command, bytes(transaction.request), expected)
+
+
+class FailingPassthroughSimulator(SynScanSimulator):
+
+    # Passthrough requests to 'failingAxis' get no answer from the motor: the hand controller then
+    # sends the requested number of bytes without a trailing hash, followed by one extra hash.
+
+    failingAxis = AxisId.ALT_DEC_MOTOR
+
+    def _passthrough(self, arguments):
+        if arguments[1] == self.failingAxis.value:
+            return bytes(arguments[6] + 1) + b"#"
+        return super(FailingPassthroughSimulator, self)._passthrough(arguments)
+
+
+def test_pipeline_keeps_response_order():
+    from SynScanTransport import MemoryTransport
+
+    controller = SynScanController(cacheTimeToLive = None)
+    controller.connect(MemoryTransport(SynScanSimulator(location = (10.0, 20.0), trackingMode = TrackingMode.EQ_NORTH).feed))
+
+    with controller.pipeline() as pipeline:
+        version = pipeline.getVersion()
+        location = pipeline.getLocation()
+        trackingMode = pipeline.getTrackingMode()
+        gotoInProgress = pipeline.getGotoInProgress()
+        deviceVersion = pipeline.getDeviceVersion(AxisId.AZM_RA_MOTOR)
+        alignmentComplete = pipeline.getAlignmentComplete()
+
+    assert version.result() == (4, 21)
+    assert location.result() == (10.0, 20.0)
+    assert trackingMode.result() == TrackingMode.EQ_NORTH.value
+    assert gotoInProgress.result() is False
+    assert tuple(deviceVersion.result()) == (7, 11)
+    assert alignmentComplete.result() is True
+
+
+def test_pipeline_isolates_failed_transactions():
+    from SynScanTransport import MemoryTransport
+
+    controller = SynScanController(cacheTimeToLive = None)
+    controller.connect(MemoryTransport(FailingPassthroughSimulator(trackingMode = TrackingMode.ALT_AZ).feed))
+
+    with controller.pipeline() as pipeline:
+        before = pipeline.getTrackingMode()
+        failing = pipeline.getDeviceVersion(AxisId.ALT_DEC_MOTOR)
+        working = pipeline.getDeviceVersion(AxisId.AZM_RA_MOTOR)
+        after = pipeline.getGotoInProgress()
+
+    assert before.result() == TrackingMode.ALT_AZ.value
+    with pytest.raises(PassthroughError):
+        failing.result()
+    assert tuple(working.result()) == (7, 11)
+    assert after.result() is False
+
+    # execute() reads all responses before raising the first error, so the stream stays aligned.
+    with pytest.raises(PassthroughError):
+        controller.execute(Requests.getDeviceVersion(AxisId.ALT_DEC_MOTOR), Requests.getVersion())
+    assert controller.execute(Requests.getVersion(), Requests.getTrackingMode()) == [(4, 21), TrackingMode.ALT_AZ.value]
+
+
+def test_coordinate_transforms_against_known_values():
+    import datetime
+    import numpy as np
+    from SynScanCoordinates import raDecToAzAlt, azAltToRaDec, localSiderealTime, gotoTransactions
+
+    # M13 seen from Birmingham on 1998-08-10 at 23:10 UT, the worked example of Keith Burnett's
+    # "Converting RA and DEC to ALT and AZ": LST 304.80762, altitude 49.169122, azimuth 269.14634.
+    when = datetime.datetime(1998, 8, 10, 23, 10, tzinfo = datetime.timezone.utc).timestamp()
+    (latitude, longitude) = (52.5, -1.9166667)
+    assert localSiderealTime(when, longitude) == pytest.approx(304.80762, abs = 1e-3)
+    (azimuth, altitude) = raDecToAzAlt(250.425, 36.466667, latitude, longitude, when)
+    assert azimuth == pytest.approx(269.14634, abs = 1e-3)
+    assert altitude == pytest.approx(49.169122, abs = 1e-3)
+
+    # The celestial pole stands at the observer's latitude, due north.
+    (azimuth, altitude) = raDecToAzAlt(123.0, 90.0, 48.0, 11.0, when)
+    assert altitude == pytest.approx(48.0)
+    assert min(azimuth % 360.0, 360.0 - azimuth % 360.0) == pytest.approx(0.0, abs = 1e-9)
+
+    # Round trip over the visible sky, vectorised.
+    rng = np.random.default_rng(1)
+    ra = rng.uniform(0.0, 360.0, 1000)
+    dec = rng.uniform(-60.0, 89.0, 1000)
+    times = when + rng.uniform(0.0, 86400.0, 1000)
+    (azimuth, altitude) = raDecToAzAlt(ra, dec, latitude, longitude, times)
+    (ra2, dec2) = azAltToRaDec(azimuth, altitude, latitude, longitude, times)
+    assert np.allclose((ra2 - ra + 180.0) % 360.0 - 180.0, 0.0, atol = 1e-8)
+    assert np.allclose(dec2, dec, atol = 1e-8)
+
+    # Batch goto requests are the ones Requests builds one at a time.
+    for (transaction, first, second) in zip(gotoTransactions(azimuth, altitude), azimuth, altitude):
+        assert transaction.request == Requests.gotoPosition(first, second).request